@@ -1,6 +1,14 @@
-import sqlite3
-from flask import Blueprint, render_template, session, redirect, url_for, flash, request
-from db import ejecutar_select, recalcular_dvv, conectar_bd, calcular_dvh
+from flask import Blueprint, render_template, session, redirect, url_for, flash, request, jsonify
+from db import ejecutar_select, recalcular_dvv_en, dvh_fila
+import admision
+import cache_consultas
+import escritor
+import flujo_json
+import metricas
+import compactacion
+import integridad
+import plantillas
+from plantillas import Perezoso
 \
 admin_bp = Blueprint("admin_bp", __name__, url_prefix="/admin")
 \
@@ -15,7 +23,9 @@ def require_admin():
 def admin_panel():
     if not require_admin():
         return redirect(url_for("home"))
-    logs = ejecutar_select("""
+    # Perezosos: con la bitácora y el resumen en cache de fragmentos (ver
+    # plantillas.py) estas consultas no corren.
+    logs = Perezoso(lambda: ejecutar_select("""
         SELECT 
             a.id, a.accion, a.tabla_afectada, a.registro_id,
             a.fecha, a.ip_origen,
@@ -23,58 +33,50 @@ def admin_panel():
         FROM audits_logs a
         LEFT JOIN usuarios u ON a.usuario_id = u.id
         ORDER BY a.fecha DESC
-    """)
+    """))
     \
-\
-    tablas = [\
-        "usuarios", "muestras", "reactivos", "experimentos",\
-        "laboratorios", "reservas_equipos", "equipos", "audits_logs"\
-    ]
-    \
-    dv_info = []
-    \
-    for tabla in tablas:
-        \
-        try:
-            if tabla in ["audits_logs"]:
-                filas = ejecutar_select(f"SELECT dvh FROM {tabla}")
-            else:
-                filas = ejecutar_select(f"SELECT dvh FROM {tabla} WHERE estado_logico = 0")
-            dvv_real = sum(f["dvh"] for f in filas if f["dvh"] is not None)
-        except sqlite3.OperationalError:
-            \
-            dvv_real = None
-        reg = ejecutar_select("SELECT dvv FROM verificaciones_verticales WHERE tabla = ?", (tabla,))
-        dvv_registrado = reg[0]["dvv"] if reg else None
-        \
-        dv_info.append({\
-            "tabla": tabla,\
-            "dvv_real": dvv_real,\
-            "dvv_registrado": dvv_registrado,\
-            "ok": (dvv_real == dvv_registrado) if dvv_real is not None else True\
-        })
+    # Sin recorrer tablas: raíces de Merkle y DVV guardados. La verificación
+    # completa corre aparte (POST /admin/integridad/verificar).
+    dv_info = Perezoso(integridad.resumen)
     return render_template("admin/AdminPanel.html", logs=logs, dv_info=dv_info)
+@admin_bp.route("/integridad/verificar", methods=["POST"])
+def verificar_integridad():
+    if not require_admin():
+        return redirect(url_for("home_bp.home"))
+    resultados = integridad.verificar_todo()
+    plantillas.invalidar("integridad")
+    alteradas = [r for r in resultados if r["estado"] != "ok"]
+    if not alteradas:
+        flash(" Verificación completa: todas las tablas coinciden con su raíz de Merkle.", "success")
+    for r in alteradas:
+        # Un bloque sospechoso suele estar también entre los distintos.
+        bloques = sorted({tuple(x) for x in r["rangos"] + r["sospechosos"]})
+        rangos = ", ".join(f"ids {a}-{b}" for a, b in bloques)
+        tabla = f"{r['tabla']} ({r['archivo']})" if r["archivo"] else r["tabla"]
+        flash(f" {tabla}: bloques alterados en {rangos}.", "error")
+    return redirect(url_for("admin_bp.admin_panel"))
+def recalcular_dvh_en(cursor, tabla):
+    filas = cursor.execute(f"SELECT * FROM {tabla}").fetchall()
+    for fila in filas:
+        cursor.execute(f"UPDATE {tabla} SET dvh = ? WHERE id = ?", (dvh_fila(fila), fila["id"]))
+    recalcular_dvv_en(cursor, tabla)
+    # Recalcular es aceptar el estado actual de la tabla: el árbol se rearma
+    # entero, incluidos los bloques sospechosos (ver integridad.py).
+    if tabla in integridad.TABLAS:
+        integridad.construir(cursor, tabla)
+def recalcular_en_todas(tabla):
+    # Con sharding la tabla puede vivir también en cada archivo de
+    # laboratorio: un trabajo por archivo.
+    for bd, tablas in integridad.bases():
+        if bd is None or tabla in tablas:
+            escritor.ejecutar(recalcular_dvh_en, tabla, bd=bd, agrupable=False)
 @admin_bp.route("/recalcular/<tabla>", methods=["POST"])
 def recalcular_tabla(tabla):
     if not require_admin():
         return redirect(url_for("home"))
-    conn = conectar_bd()
-    cursor = conn.cursor()
-    \
     try:
-        filas = cursor.execute(f"SELECT * FROM {tabla}").fetchall()
-        for fila in filas:
-            datos = dict(fila)
-            datos.pop("id", None)
-            datos.pop("dvh", None)
-            \
-            nuevo_dvh = calcular_dvh(datos)
-            cursor.execute(f"UPDATE {tabla} SET dvh = ? WHERE id = ?", (nuevo_dvh, fila["id"]))
-        conn.commit()
-        conn.close()
-        \
-\
-        recalcular_dvv(tabla)
+        recalcular_en_todas(tabla)
+        plantillas.invalidar("integridad")
         flash(f" Integridad recalculada para la tabla {tabla}.", "success")
     except Exception as e:
         flash(f" Error recalculando {tabla}: {e}", "error")
@@ -85,24 +87,91 @@ def recalcular_todo():
         return redirect(url_for("home"))
     tablas = [\
         "usuarios", "muestras", "reactivos", "experimentos",\
-        "laboratorios", "reservas_equipos", "equipos", "audits_logs"\
+        "laboratorios", "reservas_equipos", "equipos", "audits_logs",\
+        "movimientos_reactivos"\
     ]
     \
     for tabla in tablas:
-        conn = conectar_bd()
-        cursor = conn.cursor()
-        filas = cursor.execute(f"SELECT * FROM {tabla}").fetchall()
-        \
-        for fila in filas:
-            datos = dict(fila)
-            datos.pop("id", None)
-            datos.pop("dvh", None)
-            \
-            nuevo_dvh = calcular_dvh(datos)
-            cursor.execute(f"UPDATE {tabla} SET dvh = ? WHERE id = ?", (nuevo_dvh, fila["id"]))
-        conn.commit()
-        conn.close()
-        \
-        recalcular_dvv(tabla)
+        # DVH y DVV de una tabla por trabajo: entre tabla y tabla pasan
+        # las escrituras que estaban esperando.
+        recalcular_en_todas(tabla)
+    plantillas.invalidar("integridad")
     flash(" Se recalculó la integridad de TODAS las tablas.", "success")
     return redirect(url_for("admin_bp.admin_panel"))
+@admin_bp.route("/logs")
+def logs():
+    # Bitácora completa en JSON, en streaming (ver flujo_json.py): puede
+    # tener cientos de miles de filas. idx_audits_fecha evita ordenar la
+    # tabla entera antes del primer byte.
+    if session.get("rol") != "admin":
+        return jsonify({"error": "No autorizado."}), 403
+    query = """
+        SELECT 
+            a.id, a.accion, a.tabla_afectada, a.registro_id,
+            a.fecha, a.ip_origen,
+            u.nombre as usuario
+        FROM audits_logs a
+        LEFT JOIN usuarios u ON a.usuario_id = u.id
+        ORDER BY a.fecha DESC
+    """
+    return flujo_json.responder([(None, query, ())])
+@admin_bp.route("/metricas")
+def metricas_panel():
+    if not require_admin():
+        return redirect(url_for("home_bp.home"))
+    return render_template(\
+        "admin/Metricas.html",\
+        endpoints=metricas.resumen(),\
+        perfiles=metricas.perfiles(),\
+        contadores=metricas.contadores(),\
+        cache_consultas=cache_consultas.estadisticas(),\
+        admision=admision.estadisticas()\
+    )
+@admin_bp.route("/compactar", methods=["POST"])
+def compactar():
+    if not require_admin():
+        return redirect(url_for("home_bp.home"))
+    resultado = compactacion.compactar(session["usuario_id"], request.remote_addr)
+    plantillas.invalidar("muestras", "auditoria", "integridad")
+    movidas = sum(v for k, v in resultado.items() if k != "paginas_liberadas")
+    flash(f" Compactación: {movidas} filas archivadas, {resultado['paginas_liberadas']} páginas liberadas.", "success")
+    return redirect(url_for("admin_bp.admin_panel"))
+@admin_bp.route("/archivo/<tabla>")
+def archivo(tabla):
+    if session.get("rol") != "admin":
+        return jsonify({"error": "No autorizado."}), 403
+    try:
+        filas = compactacion.listar_archivo(
+            tabla,
+            min(max(request.args.get("limite", 100, type=int), 1), 1000),
+            request.args.get("antes_de", type=int),
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    return jsonify(filas)
+@admin_bp.route("/restaurar/<tabla>/<int:id>", methods=["POST"])
+def restaurar(tabla, id):
+    if session.get("rol") != "admin":
+        return jsonify({"error": "No autorizado."}), 403
+    try:
+        fila = compactacion.restaurar(tabla, id, session["usuario_id"], request.remote_addr)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except compactacion.ReservaSuperpuesta as e:
+        return jsonify({"error": str(e)}), 409
+    if fila is None:
+        return jsonify({"error": "Registro no encontrado en el archivo."}), 404
+    \
+    from servidor import socketio
+    if tabla == "experimentos":
+        socketio.emit("experimento_actualizado", {\
+            "mensaje": f"Experimento '{fila['titulo']}' restaurado.",\
+            "revision": fila["revision"]\
+        })
+    elif tabla == "reservas_equipos":
+        from analitica import actualizar_uso
+        actualizar_uso([(fila["equipo"], fila["fecha_inicio"], fila["fecha_fin"], 1)])
+        socketio.emit("refresh_calendar", {})
+    else:
+        socketio.emit("nuevo_evento", f"Muestra '{fila['nombre']}' restaurada.")
+    return jsonify(fila)
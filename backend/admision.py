@@ -0,0 +1,207 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, jsonify, request, session, Response
+
+import metricas
+
+
+# ========================================
+#  CONTROL DE ADMISIÓN
+# ========================================
+# Antes de cada request:
+# - Token bucket por usuario (si hay sesión) y por IP. Cada endpoint cuesta
+#   COSTOS[...] fichas (1 si no figura); sin fichas -> 429 con Retry-After
+#   igual a lo que falta para juntarlas.
+# - Tope de concurrencia por grupo de endpoints pesados (recálculos,
+#   compactación, reconstrucción de analítica, login con bcrypt). Si el
+#   grupo está lleno -> 503 con Retry-After según lo que vienen tardando.
+#   Así un recálculo repetido ocupa a lo sumo un hilo y las rutas baratas
+#   siguen atendiéndose con el resto.
+#
+# Los límites son por proceso (cada worker lleva sus buckets). Con
+# app.testing no se aplica nada, para que las pruebas y los benchmarks de
+# otros endpoints no choquen con los límites.
+ACTIVO = os.environ.get("BIOLABHUB_ADMISION", "1") != "0"
+# Fichas por segundo y capacidad (ráfaga) de cada bucket.
+TASA_USUARIO = float(os.environ.get("BIOLABHUB_TASA_USUARIO", "10"))
+RAFAGA_USUARIO = float(os.environ.get("BIOLABHUB_RAFAGA_USUARIO", "60"))
+# La IP puede ser compartida por todo un laboratorio (NAT): más holgada.
+TASA_IP = float(os.environ.get("BIOLABHUB_TASA_IP", "30"))
+RAFAGA_IP = float(os.environ.get("BIOLABHUB_RAFAGA_IP", "200"))
+MAX_BUCKETS = 10000
+
+# endpoint o (endpoint, método) -> fichas
+COSTOS = {
+    "static": 0,
+    "metrics": 0,
+    # Los equipos mandan lecturas seguido; telemetria.py ya las agrupa.
+    "telemetria_bp.recibir_lecturas": 0,
+    ("login_bp.login", "POST"): 10,
+    ("login_bp.register", "POST"): 10,
+    "busqueda_bp.search": 2,
+    "samples_bp.samples_details": 3,
+    "equipments_bp.equipreserve_events": 3,
+    "experiments_bp.experiments_events": 3,
+    "admin_bp.logs": 3,
+    "analitica_bp.analytics_data": 3,
+    "telemetria_bp.telemetria_datos": 3,
+    "equipments_bp.bulk_reserva": 5,
+    "admin_bp.verificar_integridad": 20,
+    "admin_bp.recalcular_tabla": 20,
+    "admin_bp.recalcular_todo": 40,
+    "admin_bp.compactar": 40,
+    "analitica_bp.analytics_rebuild": 40,
+}
+
+# Grupos de endpoints pesados y cuántos pueden correr a la vez.
+CONCURRENCIA = {
+    # Recorren tablas enteras y toman el escritor: de a uno.
+    "mantenimiento": 1,
+    "login": 4,
+    "lote": 2,
+}
+GRUPOS = {
+    "admin_bp.verificar_integridad": "mantenimiento",
+    "admin_bp.recalcular_tabla": "mantenimiento",
+    "admin_bp.recalcular_todo": "mantenimiento",
+    "admin_bp.compactar": "mantenimiento",
+    "analitica_bp.analytics_rebuild": "mantenimiento",
+    ("login_bp.login", "POST"): "login",
+    ("login_bp.register", "POST"): "login",
+    "equipments_bp.bulk_reserva": "lote",
+}
+
+
+class TokenBucket:
+    __slots__ = ("tasa", "capacidad", "fichas", "ultimo")
+
+    def __init__(self, tasa, capacidad):
+        self.tasa = tasa
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self.ultimo = time.monotonic()
+
+    def _recargar(self, ahora):
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self.ultimo) * self.tasa)
+        self.ultimo = ahora
+
+    def faltante(self, costo, ahora):
+        # Segundos hasta tener `costo` fichas (0 = alcanza ya).
+        self._recargar(ahora)
+        costo = min(costo, self.capacidad)
+        return 0 if self.fichas >= costo else (costo - self.fichas) / self.tasa
+
+    def tomar(self, costo):
+        self.fichas -= min(costo, self.capacidad)
+
+
+class Grupo:
+    def __init__(self, nombre, limite):
+        self.nombre = nombre
+        self.limite = limite
+        self.activos = 0
+        # Promedio móvil de la duración, para el Retry-After del 503.
+        self.duracion = 1.0
+
+
+_buckets = OrderedDict()        # ("usuario", id) / ("ip", dirección) -> TokenBucket
+_grupos = {nombre: Grupo(nombre, limite) for nombre, limite in CONCURRENCIA.items()}
+_por_endpoint = {}              # endpoint -> {"limitados": n, "saturados": n}
+_lock = threading.Lock()
+
+
+def _clave_endpoint(tabla, endpoint, metodo, defecto=None):
+    return tabla.get((endpoint, metodo), tabla.get(endpoint, defecto))
+
+
+def _bucket(clave, tasa, capacidad):
+    bucket = _buckets.get(clave)
+    if bucket is None:
+        bucket = _buckets[clave] = TokenBucket(tasa, capacidad)
+        if len(_buckets) > MAX_BUCKETS:
+            _buckets.popitem(last=False)
+    else:
+        _buckets.move_to_end(clave)
+    return bucket
+
+
+def _contar(endpoint, campo):
+    stats = _por_endpoint.setdefault(endpoint, {"limitados": 0, "saturados": 0})
+    stats[campo] += 1
+
+
+def _rechazo(estado, mensaje, espera):
+    if request.is_json or request.accept_mimetypes.best == "application/json":
+        respuesta = jsonify({"error": mensaje})
+        respuesta.status_code = estado
+    else:
+        respuesta = Response(mensaje + "\n", status=estado, mimetype="text/plain")
+    respuesta.headers["Retry-After"] = str(max(1, math.ceil(espera)))
+    return respuesta
+
+
+# ========================================
+#  HOOKS
+# ========================================
+def _admitir():
+    if not ACTIVO or current_app.testing or request.endpoint is None:
+        return None
+    endpoint, metodo = request.endpoint, request.method
+    costo = _clave_endpoint(COSTOS, endpoint, metodo, 1)
+    nombre_grupo = _clave_endpoint(GRUPOS, endpoint, metodo)
+    ahora = time.monotonic()
+    with _lock:
+        if costo:
+            buckets = [_bucket(("ip", request.remote_addr), TASA_IP, RAFAGA_IP)]
+            if "usuario_id" in session:
+                buckets.append(_bucket(("usuario", session["usuario_id"]), TASA_USUARIO, RAFAGA_USUARIO))
+            espera = max(b.faltante(costo, ahora) for b in buckets)
+            if espera:
+                _contar(endpoint, "limitados")
+                metricas.incrementar("admision_limitados")
+                return _rechazo(429, "Demasiadas solicitudes. Probá de nuevo en unos segundos.", espera)
+        grupo = _grupos.get(nombre_grupo)
+        if grupo is not None:
+            if grupo.activos >= grupo.limite:
+                _contar(endpoint, "saturados")
+                metricas.incrementar("admision_saturados")
+                return _rechazo(503, "El servidor está ocupado con otra operación pesada. Probá más tarde.",
+                                grupo.duracion)
+            grupo.activos += 1
+            g.admision_grupo = (grupo, ahora)
+        # Las fichas se descuentan solo si el request entra.
+        if costo:
+            for b in buckets:
+                b.tomar(costo)
+    return None
+
+
+def _liberar(error=None):
+    ocupado = g.pop("admision_grupo", None)
+    if ocupado is None:
+        return
+    grupo, inicio = ocupado
+    with _lock:
+        grupo.activos -= 1
+        grupo.duracion = 0.8 * grupo.duracion + 0.2 * (time.monotonic() - inicio)
+
+
+def init_app(app):
+    app.before_request(_admitir)
+    app.teardown_request(_liberar)
+
+
+def estadisticas():
+    with _lock:
+        return {
+            "endpoints": [{"endpoint": e, **s} for e, s in sorted(_por_endpoint.items())],
+            "grupos": [
+                {"grupo": gr.nombre, "activos": gr.activos, "limite": gr.limite, "duracion_s": round(gr.duracion, 2)}
+                for gr in _grupos.values()
+            ],
+            "buckets": len(_buckets),
+        }
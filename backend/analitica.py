@@ -0,0 +1,293 @@
+import os
+from datetime import date, datetime, timedelta
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+
+from db import ejecutar_select
+import escritor
+import shards
+
+analitica_bp = Blueprint("analitica_bp", __name__)
+
+HORAS = [f"h{h:02d}" for h in range(24)]
+# Horario en que se considera disponible un equipo para calcular utilización.
+JORNADA = tuple(int(h) for h in os.environ.get("BIOLABHUB_JORNADA", "8-20").split("-"))
+# Una hora cuenta como saturada si el equipo estuvo ocupado al menos este
+# porcentaje de los 60 minutos.
+UMBRAL_SATURACION = 0.9
+DIAS_SEMANA = ["Lun", "Mar", "Mié", "Jue", "Vie", "Sáb", "Dom"]
+# La reconstrucción completa bina de a este número de días para acotar memoria.
+DIAS_POR_BLOQUE = 366
+
+
+# ========================================
+#  BINEADO VECTORIZADO
+# ========================================
+# numpy se importa dentro de cada función: solo lo pagan las rutas de
+# analítica y las escrituras de reservas, no el arranque.
+def binear(equipo_idx, inicios, fines, dia0, n_dias, n_equipos):
+    # Minutos ocupados por (equipo, día, hora). Cada reserva suma +1 en su
+    # minuto de inicio y -1 en el de fin; el cumsum da cuántas reservas
+    # hay activas en cada minuto y se agrupa de a 60. Sin loops por fila.
+    import numpy as np
+
+    base = np.datetime64(dia0, "m")
+    total = n_dias * 1440
+    ini = np.clip((inicios - base).astype(np.int64), 0, total)
+    fin = np.clip((fines - base).astype(np.int64), 0, total)
+    validas = fin > ini
+    dif = np.zeros((n_equipos, total + 1), dtype=np.int32)
+    np.add.at(dif, (equipo_idx[validas], ini[validas]), 1)
+    np.add.at(dif, (equipo_idx[validas], fin[validas]), -1)
+    ocupacion = np.cumsum(dif[:, :total], axis=1, dtype=np.int32)
+    minutos = ocupacion.reshape(n_equipos, n_dias, 24, 60).sum(axis=3)
+
+    # Reservas contadas en el día en que empiezan
+    reservas = np.zeros((n_equipos, n_dias), dtype=np.int64)
+    dia_inicio = (inicios - base).astype(np.int64) // 1440
+    en_rango = validas & (dia_inicio >= 0) & (dia_inicio < n_dias)
+    np.add.at(reservas, (equipo_idx[en_rango], dia_inicio[en_rango]), 1)
+    return minutos, reservas
+
+
+def _a_minutos(valores):
+    import numpy as np
+    # Acepta "2025-03-01T10:30" (datetime-local) y "2025-03-01 10:30:00"
+    return np.array(list(valores), dtype="datetime64[m]")
+
+
+UPSERT_USO = f"""
+    INSERT INTO uso_equipos_diario (equipo, dia, reservas, rechazos, {", ".join(HORAS)})
+    VALUES (?, ?, ?, 0, {", ".join("?" * 24)})
+    ON CONFLICT(equipo, dia) DO UPDATE SET
+        reservas = reservas + excluded.reservas,
+        {", ".join(f"{h} = {h} + excluded.{h}" for h in HORAS)}
+"""
+
+
+def _volcar(cursor, equipos, dia0, minutos, reservas, signo=1):
+    import numpy as np
+
+    ocupados = np.argwhere((minutos.sum(axis=2) > 0) | (reservas > 0))
+    filas = [
+        (str(equipos[e]), (dia0 + timedelta(days=int(d))).isoformat(), signo * int(reservas[e, d]),
+         *(signo * minutos[e, d]).tolist())
+        for e, d in ocupados
+    ]
+    cursor.executemany(UPSERT_USO, filas)
+    return len(filas)
+
+
+def actualizar_uso(cambios):
+    # Mantenimiento incremental desde las escrituras de reservas.
+    # cambios: [(equipo, fecha_inicio, fecha_fin, signo), ...] con signo +1
+    # al crear y -1 al borrar; una edición manda el intervalo viejo con -1
+    # y el nuevo con +1. Todo en una transacción.
+    import numpy as np
+
+    cambios = [c for c in cambios if c[0] and c[1] and c[2]]
+    if not cambios:
+        return
+    # El bineado se hace fuera del escritor; el trabajo solo vuelca.
+    def volcar(cursor, volcados):
+        for args in volcados:
+            _volcar(cursor, *args)
+    try:
+        volcados = []
+        for signo in (1, -1):
+            grupo = [c for c in cambios if c[3] == signo]
+            if not grupo:
+                continue
+            equipos, idx = np.unique([c[0] for c in grupo], return_inverse=True)
+            inicios = _a_minutos(c[1] for c in grupo)
+            fines = _a_minutos(c[2] for c in grupo)
+            dia0 = inicios.min().astype("datetime64[D]").item()
+            n_dias = int((fines.max().astype("datetime64[D]") - np.datetime64(dia0, "D")).astype(int)) + 1
+            minutos, reservas = binear(idx, inicios, fines, dia0, n_dias, len(equipos))
+            volcados.append((equipos, dia0, minutos, reservas, signo))
+        escritor.ejecutar(volcar, volcados)
+    except Exception as e:
+        print("No se pudo actualizar el resumen de uso de equipos:", e)
+
+
+def registrar_rechazo(equipo, fecha_inicio):
+    # Pedidos rechazados por conflicto: la señal más directa de que un
+    # equipo no alcanza.
+    dia = str(fecha_inicio)[:10]
+    escritor.ejecutar(lambda cursor: cursor.execute("""
+        INSERT INTO uso_equipos_diario (equipo, dia, rechazos) VALUES (?, ?, 1)
+        ON CONFLICT(equipo, dia) DO UPDATE SET rechazos = rechazos + 1
+    """, (equipo, dia)))
+
+
+def reconstruir_resumen():
+    # Recalcula minutos y reservas desde reservas_equipos (carga en bloque,
+    # bineado por bloques de DIAS_POR_BLOQUE). Los rechazos se conservan
+    # porque no se pueden deducir de las reservas. Un solo trabajo del
+    # escritor, no agrupable: sin sharding las reservas se leen en la misma
+    # transacción, así no se pierde un alta que entre en el medio.
+    import numpy as np
+
+    consulta = """
+        SELECT equipo, fecha_inicio, fecha_fin FROM reservas_equipos
+        WHERE estado_logico = 0
+    """
+
+    def reconstruir(cursor):
+        filas = shards.consultar_todos(consulta) if shards.ACTIVO else cursor.execute(consulta).fetchall()
+        cursor.execute(f"UPDATE uso_equipos_diario SET reservas = 0, {', '.join(f'{h} = 0' for h in HORAS)}")
+        escritas = 0
+        if filas:
+            equipos, idx = np.unique([f[0] for f in filas], return_inverse=True)
+            inicios = _a_minutos(f[1] for f in filas)
+            fines = _a_minutos(f[2] for f in filas)
+            desde = inicios.min().astype("datetime64[D]").item()
+            hasta = fines.max().astype("datetime64[D]").item()
+            dia0 = desde
+            while dia0 <= hasta:
+                n_dias = min(DIAS_POR_BLOQUE, (hasta - dia0).days + 1)
+                fin_bloque = np.datetime64(dia0 + timedelta(days=n_dias), "m")
+                sel = (inicios < fin_bloque) & (fines > np.datetime64(dia0, "m"))
+                minutos, reservas = binear(idx[sel], inicios[sel], fines[sel], dia0, n_dias, len(equipos))
+                escritas += _volcar(cursor, equipos, dia0, minutos, reservas)
+                dia0 += timedelta(days=n_dias)
+        cursor.execute(f"DELETE FROM uso_equipos_diario WHERE reservas = 0 AND rechazos = 0 AND {' + '.join(HORAS)} = 0")
+        return escritas
+    return escritor.ejecutar(reconstruir, agrupable=False)
+
+
+# ========================================
+#  MÉTRICAS SOBRE EL RESUMEN DIARIO
+# ========================================
+def calcular_uso(desde, hasta, equipo=None):
+    # desde/hasta: date, rango [desde, hasta). Lee solo las filas diarias
+    # (equipos x días) y agrega con numpy.
+    import numpy as np
+
+    n_dias = max((hasta - desde).days, 0)
+    equipos = [e["nombre"] for e in ejecutar_select(
+        "SELECT nombre FROM equipos WHERE estado_logico = 0 ORDER BY nombre ASC", cache=True
+    )]
+    if equipo:
+        equipos = [equipo]
+
+    consulta = f"""
+        SELECT equipo, dia, reservas, rechazos, {", ".join(HORAS)}
+        FROM uso_equipos_diario WHERE dia >= ? AND dia < ?
+    """
+    parametros = [desde.isoformat(), hasta.isoformat()]
+    if equipo:
+        consulta += " AND equipo = ?"
+        parametros.append(equipo)
+    filas = [tuple(f) for f in ejecutar_select(consulta, parametros)]
+    for nombre in sorted({f[0] for f in filas} - set(equipos)):
+        equipos.append(nombre)
+
+    n_eq = len(equipos)
+    posicion = {nombre: i for i, nombre in enumerate(equipos)}
+    if filas:
+        eq = np.array([posicion[f[0]] for f in filas])
+        dias = np.array([f[1] for f in filas], dtype="datetime64[D]")
+        datos = np.array([f[2:] for f in filas], dtype=np.int64)
+    else:
+        eq = np.zeros(0, dtype=np.int64)
+        dias = np.zeros(0, dtype="datetime64[D]")
+        datos = np.zeros((0, 26), dtype=np.int64)
+    reservas, rechazos, minutos = datos[:, 0], datos[:, 1], datos[:, 2:]
+
+    # 1970-01-01 fue jueves: (días + 3) % 7 da 0 = lunes
+    dia_semana = (dias.astype(np.int64) + 3) % 7
+    calendario = (np.arange(n_dias) + np.datetime64(desde, "D").astype(np.int64) + 3) % 7
+    dias_por_semana = np.bincount(calendario, minlength=7)
+
+    calor = np.zeros((n_eq, 7, 24), dtype=np.int64)
+    np.add.at(calor, (eq, dia_semana), minutos)
+    # fracción de cada hora ocupada, promediada sobre las semanas del rango
+    calor_pct = calor / np.maximum(dias_por_semana, 1)[None, :, None] / 60.0
+
+    j0, j1 = JORNADA
+    en_jornada = np.bincount(eq, weights=minutos[:, j0:j1].sum(axis=1), minlength=n_eq)
+    capacidad = n_dias * (j1 - j0) * 60
+    total = np.bincount(eq, weights=minutos.sum(axis=1), minlength=n_eq)
+    saturadas = np.bincount(eq, weights=(minutos >= 60 * UMBRAL_SATURACION).sum(axis=1), minlength=n_eq)
+    superpuestos = np.bincount(eq, weights=np.clip(minutos - 60, 0, None).sum(axis=1), minlength=n_eq)
+    n_reservas = np.bincount(eq, weights=reservas, minlength=n_eq)
+    n_rechazos = np.bincount(eq, weights=rechazos, minlength=n_eq)
+
+    resultado = []
+    for i, nombre in enumerate(equipos):
+        por_hora = calor_pct[i].mean(axis=0)
+        resultado.append({
+            "equipo": nombre,
+            "utilizacion": round(float(en_jornada[i]) / capacidad, 4) if capacidad else 0.0,
+            "horas_reservadas": round(float(total[i]) / 60, 2),
+            "reservas": int(n_reservas[i]),
+            "rechazos": int(n_rechazos[i]),
+            "horas_saturadas": int(saturadas[i]),
+            "minutos_superpuestos": int(superpuestos[i]),
+            "hora_pico": int(por_hora.argmax()) if por_hora.any() else None,
+            "mapa_calor": np.round(calor_pct[i], 3).tolist(),
+        })
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "dias": n_dias,
+        "jornada": list(JORNADA),
+        "equipos": resultado,
+    }
+
+
+# ========================================
+#  RUTAS
+# ========================================
+def _rango():
+    hoy = date.today()
+    try:
+        hasta = date.fromisoformat(request.args["hasta"]) if request.args.get("hasta") else hoy + timedelta(days=1)
+        desde = date.fromisoformat(request.args["desde"]) if request.args.get("desde") else hasta - timedelta(days=30)
+    except ValueError:
+        raise ValueError("Fechas inválidas (formato AAAA-MM-DD).")
+    if desde >= hasta:
+        raise ValueError("'desde' debe ser anterior a 'hasta'.")
+    if (hasta - desde).days > 3660:
+        raise ValueError("El rango máximo es de 10 años.")
+    return desde, hasta
+
+
+@analitica_bp.route("/equipreserve/analytics")
+def analytics():
+    if "usuario_id" not in session:
+        flash("Debes iniciar sesión primero.", "error")
+        return redirect(url_for("login_bp.login"))
+    try:
+        desde, hasta = _rango()
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for("analitica_bp.analytics"))
+    return render_template(
+        "equipreserve/Analitica.html",
+        uso=calcular_uso(desde, hasta, request.args.get("equipo") or None),
+        dias_semana=DIAS_SEMANA,
+    )
+
+
+@analitica_bp.route("/equipreserve/analytics/data")
+def analytics_data():
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    try:
+        desde, hasta = _rango()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(calcular_uso(desde, hasta, request.args.get("equipo") or None))
+
+
+@analitica_bp.route("/equipreserve/analytics/rebuild", methods=["POST"])
+def analytics_rebuild():
+    if session.get("rol") != "admin":
+        flash("Solo los administradores pueden reconstruir el resumen.", "error")
+        return redirect(url_for("analitica_bp.analytics"))
+    inicio = datetime.now()
+    filas = reconstruir_resumen()
+    flash(f"Resumen reconstruido: {filas} filas en {(datetime.now() - inicio).total_seconds():.2f} s.", "success")
+    return redirect(url_for("analitica_bp.analytics"))
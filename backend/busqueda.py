@@ -0,0 +1,186 @@
+import os
+import re
+import zipfile
+from xml.etree import ElementTree
+
+from flask import Blueprint, request, session, jsonify
+
+from db import conectar_bd
+import escritor
+import shards
+
+busqueda_bp = Blueprint("busqueda_bp", __name__)
+
+TIPOS = ("muestras", "experimentos", "protocolos")
+POR_PAGINA_MAX = 100
+
+
+# ========================================
+#  CONSULTAS FTS5
+# ========================================
+# Por tipo: tabla FTS, cómo llegar a la fila real (para descartar borrados
+# lógicos), qué mostrar como título y los pesos de bm25 por columna.
+# bm25() da menor puntaje a lo más relevante. "shards": la tabla y su FTS
+# viven en los archivos de laboratorio cuando el sharding está activo.
+FUENTES = {
+    "muestras": {
+        "shards": True,
+        "fts": "muestras_fts",
+        "join": "JOIN muestras t ON t.id = muestras_fts.rowid",
+        "vivo": "t.estado_logico = 0",
+        "id": "t.id",
+        "titulo": "t.nombre",
+        "bm25": "bm25(muestras_fts, 10.0, 2.0, 1.0)",
+    },
+    "experimentos": {
+        "fts": "experimentos_fts",
+        "join": "JOIN experimentos t ON t.id = experimentos_fts.rowid",
+        "vivo": "(t.estado_logico = 0 OR t.estado_logico IS NULL)",
+        "id": "t.id",
+        "titulo": "t.titulo",
+        "bm25": "bm25(experimentos_fts, 10.0, 1.0)",
+    },
+    "protocolos": {
+        "fts": "protocolos_fts",
+        "join": "JOIN experimentos t ON t.id = protocolos_fts.experimento_id",
+        "vivo": "(t.estado_logico = 0 OR t.estado_logico IS NULL)",
+        "id": "t.id",
+        "titulo": "protocolos_fts.archivo",
+        "bm25": "bm25(protocolos_fts)",
+    },
+}
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def armar_consulta_fts(texto):
+    # Cada palabra entre comillas (así no se interpreta sintaxis FTS del
+    # usuario) y con * para que "centri" encuentre "centrífuga".
+    palabras = _TOKEN.findall(texto or "")
+    return " ".join(f'"{p}"*' for p in palabras)
+
+
+def buscar(texto, tipos=TIPOS, pagina=1, por_pagina=20):
+    consulta = armar_consulta_fts(texto)
+    if not consulta:
+        return {"total": 0, "resultados": []}
+
+    # Para mezclar tipos ordenados por rank alcanza con traer, de cada uno,
+    # las primeras pagina*por_pagina filas. snippet() es lo más caro, así
+    # que se calcula después, solo para la página que se devuelve.
+    hasta = pagina * por_pagina
+    conn = conectar_bd()
+    cur = conn.cursor()
+
+    def consultar(tipo, query, parametros, clave=None):
+        # En modo sharding la consulta corre en cada archivo; cada uno
+        # devuelve sus filas ordenadas y se intercalan por `clave` (los
+        # bm25 de archivos distintos son comparables: mismos pesos).
+        if FUENTES[tipo].get("shards") and shards.ACTIVO:
+            return shards.consultar_todos(query, parametros, clave=clave)
+        return cur.execute(query, parametros).fetchall()
+
+    total = 0
+    candidatos = []
+    for tipo in tipos:
+        f = FUENTES[tipo]
+        base = f"FROM {f['fts']} {f['join']} WHERE {f['fts']} MATCH ? AND {f['vivo']}"
+        total += sum(fila[0] for fila in consultar(tipo, f"SELECT COUNT(*) {base}", (consulta,)))
+        filas = consultar(tipo, f"""
+            SELECT {f['fts']}.rowid AS fila, {f['id']} AS id, {f['bm25']} AS rank
+            {base} ORDER BY rank LIMIT ?
+        """, (consulta, hasta), clave=lambda fila: fila["rank"])
+        candidatos.extend((fila["rank"], tipo, fila["fila"], fila["id"]) for fila in filas[:hasta])
+
+    candidatos.sort(key=lambda c: c[0])
+    pagina_actual = candidatos[(pagina - 1) * por_pagina:hasta]
+
+    detalles = {}
+    for tipo in tipos:
+        filas = [c[2] for c in pagina_actual if c[1] == tipo]
+        if not filas:
+            continue
+        f = FUENTES[tipo]
+        marcas = ", ".join("?" * len(filas))
+        for fila in consultar(tipo, f"""
+            SELECT {f['fts']}.rowid AS fila, {f['titulo']} AS titulo,
+                   snippet({f['fts']}, -1, '<mark>', '</mark>', '…', 12) AS fragmento
+            FROM {f['fts']} {f['join']}
+            WHERE {f['fts']} MATCH ? AND {f['fts']}.rowid IN ({marcas})
+        """, (consulta, *filas)):
+            detalles[(tipo, fila["fila"])] = (fila["titulo"], fila["fragmento"])
+    conn.close()
+
+    resultados = []
+    for rank, tipo, fila, id_real in pagina_actual:
+        titulo, fragmento = detalles.get((tipo, fila), (None, None))
+        resultados.append({
+            "tipo": tipo,
+            "id": id_real,
+            "titulo": titulo,
+            "fragmento": fragmento,
+            "rank": round(rank, 4),
+        })
+    return {"total": total, "resultados": resultados}
+
+
+@busqueda_bp.route("/search")
+def search():
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+
+    texto = request.args.get("q", "").strip()
+    pagina = max(request.args.get("pagina", 1, type=int), 1)
+    por_pagina = min(max(request.args.get("por_pagina", 20, type=int), 1), POR_PAGINA_MAX)
+    tipo = request.args.get("tipo")
+    if tipo and tipo not in TIPOS:
+        return jsonify({"error": f"Tipo inválido. Opciones: {', '.join(TIPOS)}"}), 400
+    tipos = (tipo,) if tipo else TIPOS
+
+    resultado = buscar(texto, tipos, pagina, por_pagina)
+    return jsonify({
+        "q": texto,
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "total": resultado["total"],
+        "resultados": resultado["resultados"],
+    })
+
+
+# ========================================
+#  TEXTO DE PROTOCOLOS
+# ========================================
+def extraer_texto(ruta):
+    extension = os.path.splitext(ruta)[1].lower()
+    try:
+        if extension in (".txt", ".md", ".csv"):
+            with open(ruta, encoding="utf-8", errors="ignore") as f:
+                return f.read()
+        if extension == ".docx":
+            with zipfile.ZipFile(ruta) as docx:
+                xml = docx.read("word/document.xml")
+            return " ".join(t for t in ElementTree.fromstring(xml).itertext() if t.strip())
+        if extension == ".pdf":
+            try:
+                from pypdf import PdfReader
+            except ImportError:
+                return ""
+            return "\n".join(pagina.extract_text() or "" for pagina in PdfReader(ruta).pages)
+    except Exception as e:
+        print(f"No se pudo extraer texto de {ruta}:", e)
+    return ""
+
+
+def indexar_protocolo(experimento_id, archivo, carpeta):
+    # Se llama desde el post-proceso del experimento (en segundo plano),
+    # así la extracción no frena el request de subida.
+    texto = extraer_texto(os.path.join(carpeta, archivo)) if archivo else ""
+
+    def indexar(cursor):
+        cursor.execute("DELETE FROM protocolos_fts WHERE experimento_id = ?", (experimento_id,))
+        if texto:
+            cursor.execute(
+                "INSERT INTO protocolos_fts (texto, experimento_id, archivo) VALUES (?, ?, ?)",
+                (texto, experimento_id, archivo),
+            )
+    escritor.ejecutar(indexar)
@@ -0,0 +1,270 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import metricas
+
+
+# ========================================
+#  CACHE DE RESULTADOS DE CONSULTAS
+# ========================================
+# ejecutar_select(..., cache=True) guarda las filas en memoria con clave
+# (archivo, SQL normalizado, parámetros). Es opcional: conviene solo para
+# consultas que se repiten mucho y cambian poco (listas de laboratorios y
+# equipos, umbrales, el inicio de cada usuario).
+#
+# - Dependencias: al preparar la consulta SQLite avisa por el authorizer
+#   cada tabla que lee (vistas, subconsultas y la BD "global" adjunta
+#   incluidas), así que no hay que adivinarlas del texto.
+# - Invalidación: el escritor (escritor.py) anota con el mismo mecanismo
+#   las tablas que toca cada transacción, triggers incluidos, y después del
+#   COMMIT tira las entradas que dependen de ellas. Eso cubre
+#   ejecutar_insert, ejecutar_update, registrar_auditoria y cualquier
+#   trabajo del escritor.
+# - Las escrituras que no pasan por el escritor (transacciones entre
+#   archivos, restauraciones, otros workers) no invalidan: el TTL acota lo
+#   vieja que puede quedar una entrada.
+# - Estampida: si varios hilos piden la misma clave ausente, la consulta
+#   corre una vez y los demás esperan ese resultado.
+# - LRU con tope de entradas y de filas totales.
+ACTIVO = os.environ.get("BIOLABHUB_CACHE_CONSULTAS", "1") != "0"
+TTL = float(os.environ.get("BIOLABHUB_CACHE_CONSULTAS_TTL", "30"))
+MAX_ENTRADAS = int(os.environ.get("BIOLABHUB_CACHE_CONSULTAS_MAX", "512"))
+MAX_FILAS = int(os.environ.get("BIOLABHUB_CACHE_CONSULTAS_FILAS", "50000"))
+# Un resultado más grande que esto no se guarda (desplazaría todo lo demás).
+MAX_FILAS_ENTRADA = MAX_FILAS // 10
+MAX_ESTADISTICAS = 256
+
+# Funciones cuyo resultado cambia sin que cambie ninguna tabla.
+NO_DETERMINISTAS = {
+    "random", "randomblob", "date", "time", "datetime", "julianday", "unixepoch",
+    "strftime", "timediff", "changes", "total_changes", "last_insert_rowid",
+}
+
+ESCRITURAS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+
+
+class Entrada:
+    __slots__ = ("filas", "tablas", "vence", "consulta")
+
+    def __init__(self, filas, tablas, vence, consulta):
+        self.filas = filas
+        self.tablas = tablas
+        self.vence = vence
+        self.consulta = consulta
+
+
+_entradas = OrderedDict()       # clave -> Entrada
+_por_tabla = {}                 # (archivo, tabla) -> claves que la leen
+_invalidada_en = {}             # (archivo, tabla) -> secuencia de su última invalidación
+_en_vuelo = {}                  # clave -> Future de la consulta que la está cargando
+_estadisticas = {}              # SQL normalizado -> {"aciertos", "fallos", "invalidaciones"}
+_secuencia = 0
+_vaciado_en = 0
+_filas_total = 0
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def normalizar(query):
+    # Colapsa espacios fuera de los literales: la misma consulta escrita con
+    # otra indentación comparte entrada.
+    partes = re.split(r"('(?:[^']|'')*')", query)
+    return "".join(p if i % 2 else re.sub(r"\s+", " ", p) for i, p in enumerate(partes)).strip()
+
+
+def _clave_parametros(parametros):
+    if isinstance(parametros, dict):
+        return tuple(sorted(parametros.items()))
+    return tuple(parametros)
+
+
+def _reiniciar_si_fork():
+    global _pid, _filas_total
+    if _pid != os.getpid():
+        _entradas.clear()
+        _por_tabla.clear()
+        _en_vuelo.clear()
+        _filas_total = 0
+        _pid = os.getpid()
+
+
+def _contar(consulta, campo):
+    stats = _estadisticas.get(consulta)
+    if stats is None:
+        if len(_estadisticas) >= MAX_ESTADISTICAS:
+            return
+        stats = _estadisticas[consulta] = {"aciertos": 0, "fallos": 0, "invalidaciones": 0}
+    stats[campo] += 1
+
+
+# ========================================
+#  LECTURA
+# ========================================
+def leer(conectar, archivo, archivo_global, query, parametros, ttl=None):
+    # conectar(): conexión nueva a `archivo` (la de ejecutar_select).
+    consulta = normalizar(query)
+    try:
+        clave = (archivo, consulta, _clave_parametros(parametros))
+        hash(clave)
+    except TypeError:
+        return _consultar(conectar, archivo, archivo_global, query, parametros)[0]
+
+    ahora = time.monotonic()
+    with _lock:
+        _reiniciar_si_fork()
+        entrada = _entradas.get(clave)
+        if entrada is not None and entrada.vence > ahora:
+            _entradas.move_to_end(clave)
+            _contar(consulta, "aciertos")
+            metricas.incrementar("cache_consultas_aciertos")
+            return list(entrada.filas)
+        _contar(consulta, "fallos")
+        futuro = _en_vuelo.get(clave)
+        propio = futuro is None
+        if propio:
+            futuro = _en_vuelo[clave] = Future()
+            inicio = _secuencia
+    metricas.incrementar("cache_consultas_fallos")
+
+    if not propio:
+        # Otro hilo ya la está consultando: se espera su resultado.
+        metricas.incrementar("cache_consultas_esperas")
+        return list(futuro.result())
+
+    try:
+        filas, tablas, cacheable = _consultar(conectar, archivo, archivo_global, query, parametros)
+    except BaseException as e:
+        with _lock:
+            _en_vuelo.pop(clave, None)
+        futuro.set_exception(e)
+        raise
+    with _lock:
+        _en_vuelo.pop(clave, None)
+        # Si una escritura sobre alguna de sus tablas se confirmó mientras
+        # corría la consulta, el resultado puede ser anterior: no se guarda.
+        vigente = _vaciado_en <= inicio and all(_invalidada_en.get(t, 0) <= inicio for t in tablas)
+        if cacheable and vigente and tablas and len(filas) <= MAX_FILAS_ENTRADA:
+            _guardar(clave, Entrada(filas, tablas, time.monotonic() + (TTL if ttl is None else ttl), consulta))
+    futuro.set_result(filas)
+    return list(filas)
+
+
+def _consultar(conectar, archivo, archivo_global, query, parametros):
+    tablas = set()
+    cacheable = [True]
+
+    def autorizar(accion, arg1, arg2, base, origen):
+        if accion == sqlite3.SQLITE_READ and arg1:
+            if base == "main":
+                tablas.add((archivo, arg1))
+            elif base == "global":
+                tablas.add((archivo_global, arg1))
+        elif accion == sqlite3.SQLITE_FUNCTION and arg2 and arg2.lower() in NO_DETERMINISTAS:
+            cacheable[0] = False
+        return sqlite3.SQLITE_OK
+
+    conn = conectar()
+    try:
+        conn.set_authorizer(autorizar)
+        filas = conn.execute(query, parametros).fetchall()
+    finally:
+        conn.close()
+    return filas, frozenset(tablas), cacheable[0]
+
+
+def _guardar(clave, entrada):
+    global _filas_total
+    _sacar(clave)
+    _entradas[clave] = entrada
+    _filas_total += len(entrada.filas)
+    for tabla in entrada.tablas:
+        _por_tabla.setdefault(tabla, set()).add(clave)
+    while _entradas and (len(_entradas) > MAX_ENTRADAS or _filas_total > MAX_FILAS):
+        _sacar(next(iter(_entradas)))
+
+
+def _sacar(clave):
+    global _filas_total
+    entrada = _entradas.pop(clave, None)
+    if entrada is None:
+        return None
+    _filas_total -= len(entrada.filas)
+    for tabla in entrada.tablas:
+        claves = _por_tabla.get(tabla)
+        if claves is not None:
+            claves.discard(clave)
+            if not claves:
+                del _por_tabla[tabla]
+    return entrada
+
+
+# ========================================
+#  INVALIDACIÓN
+# ========================================
+def vigilar(conn, archivo, archivo_global=None):
+    # Se llama al empezar cada transacción de escritura. Devuelve el set
+    # donde quedan las tablas (archivo, tabla) que toque. Volver a poner el
+    # authorizer hace que SQLite re-prepare las sentencias que la conexión
+    # tenía en cache, así también se anotan. archivo_global: para las
+    # transacciones de un shard que también escriben en la BD adjunta.
+    escritas = set()
+
+    def autorizar(accion, arg1, arg2, base, origen):
+        if accion in ESCRITURAS:
+            if base == "main":
+                escritas.add((archivo, arg1))
+            elif base == "global" and archivo_global:
+                escritas.add((archivo_global, arg1))
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(autorizar)
+    return escritas
+
+
+def invalidar(tablas):
+    global _secuencia
+    if not tablas:
+        return
+    with _lock:
+        _secuencia += 1
+        sacadas = 0
+        for tabla in tablas:
+            _invalidada_en[tabla] = _secuencia
+            for clave in list(_por_tabla.get(tabla, ())):
+                entrada = _sacar(clave)
+                if entrada is not None:
+                    _contar(entrada.consulta, "invalidaciones")
+                    sacadas += 1
+    if sacadas:
+        metricas.incrementar("cache_consultas_invalidaciones", sacadas)
+
+
+def vaciar():
+    # Para escrituras que no pasan por el escritor y no pueden esperar al
+    # TTL (restaurar un respaldo).
+    global _secuencia, _vaciado_en, _filas_total
+    with _lock:
+        _secuencia += 1
+        _vaciado_en = _secuencia
+        _entradas.clear()
+        _por_tabla.clear()
+        _filas_total = 0
+
+
+def estadisticas():
+    with _lock:
+        consultas = [
+            {"consulta": consulta, **stats,
+             "tasa_aciertos": round(stats["aciertos"] / ((stats["aciertos"] + stats["fallos"]) or 1), 3)}
+            for consulta, stats in _estadisticas.items()
+        ]
+        return {
+            "entradas": len(_entradas),
+            "filas": _filas_total,
+            "consultas": sorted(consultas, key=lambda c: -(c["aciertos"] + c["fallos"])),
+        }
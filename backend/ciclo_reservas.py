@@ -0,0 +1,255 @@
+import heapq
+import json
+import os
+from datetime import datetime, timedelta
+from threading import Event, Lock
+
+from db import ejecutar_select, sumar_dvv
+import escritor
+import metricas
+import shards
+
+
+# ========================================
+#  CICLO DE VIDA DE LAS RESERVAS
+# ========================================
+# Reservado -> En espera (al llegar fecha_inicio) -> En curso (check-in)
+#           -> Finalizada (al llegar fecha_fin)
+# En espera sin check-in pasada la tolerancia -> No presentado: la reserva
+# se corta en ese momento y el resto del turno queda libre para otros.
+# Con BIOLABHUB_RESERVAS_TOLERANCIA_MIN=0 no hay check-in: al empezar pasa
+# directo a En curso.
+#
+# Un heap con los próximos bordes (inicio, tolerancia, fin) y un hilo que
+# duerme hasta el siguiente, como las alertas de reactivos. Con decenas de
+# miles de reservas futuras el heap solo guarda las que caen dentro de
+# HORIZONTE_H; el resto se carga al recargar (los índices por estado y
+# fecha hacen que esa consulta solo lea las filas de la ventana).
+#
+# En cada tick se aplican juntas todas las transiciones vencidas: un
+# trabajo del escritor por archivo, con el DVH de cada fila ajustado y un
+# solo sumar_dvv, y un único refresh_calendar para todos los cambios.
+TOLERANCIA = timedelta(minutes=int(os.environ.get("BIOLABHUB_RESERVAS_TOLERANCIA_MIN", "15")))
+HORIZONTE = timedelta(hours=float(os.environ.get("BIOLABHUB_RESERVAS_HORIZONTE_H", "6")))
+# Cada cuánto se relee la ventana (reservas creadas en otros workers o
+# editadas a mano).
+RECARGAR_CADA = 60
+FORMATO = "%Y-%m-%dT%H:%M"
+
+RESERVADO = ("Reservado", "Activa")     # "Activa": default de las filas viejas
+EN_ESPERA = "En espera"
+EN_CURSO = "En curso"
+FINALIZADA = "Finalizada"
+NO_PRESENTADO = "No presentado"
+VIGENTES = RESERVADO + (EN_ESPERA, EN_CURSO)
+
+
+def _marcas(lista):
+    return ", ".join(f"'{e}'" for e in lista)
+
+
+# Por borde: (estados desde los que aplica, condición de tiempo). El orden
+# importa cuando una reserva vencida entera llega de una (p. ej. al
+# arrancar): primero termina y ya no "empieza".
+TRANSICIONES = (
+    ("fin", VIGENTES, "fecha_fin <= :ahora"),
+    ("tolerancia", (EN_ESPERA,), "fecha_inicio <= :limite_espera"),
+    ("inicio", RESERVADO, "fecha_inicio <= :ahora AND fecha_fin > :ahora"),
+)
+
+
+def _fecha(valor):
+    try:
+        return datetime.fromisoformat(str(valor))
+    except (TypeError, ValueError):
+        return None
+
+
+def aplicar_transiciones(cursor, ids_por_borde, ahora):
+    # Trabajo del escritor. Relee cada fila con la condición del borde (la
+    # reserva pudo editarse, borrarse o hacer check-in desde que se
+    # programó) y devuelve [(id, equipo, fecha_inicio, fin_anterior, fin, estado), ...].
+    parametros = {
+        "ahora": ahora.strftime("%Y-%m-%dT%H:%M:%S"),
+        "limite_espera": (ahora - TOLERANCIA).strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    cambios, delta = [], 0
+    for borde, desde, condicion in TRANSICIONES:
+        ids = ids_por_borde.get(borde)
+        if not ids:
+            continue
+        filas = cursor.execute(f"""
+            SELECT id, equipo, estado, fecha_inicio, fecha_fin, dvh FROM reservas_equipos
+            WHERE id IN (SELECT value FROM json_each(:ids)) AND estado_logico = 0
+              AND estado IN ({_marcas(desde)}) AND {condicion}
+        """, {"ids": json.dumps(ids), **parametros}).fetchall()
+        nuevas = []
+        for f in filas:
+            fin = f["fecha_fin"]
+            if borde == "fin":
+                estado = FINALIZADA
+            elif borde == "tolerancia":
+                # Se libera el resto del turno.
+                estado, fin = NO_PRESENTADO, ahora.strftime(FORMATO)
+            elif not TOLERANCIA or (_fecha(f["fecha_inicio"]) or ahora) + TOLERANCIA <= ahora:
+                # Sin check-in, o el borde se procesa tarde (servidor caído
+                # al empezar el turno): no se puede saber si vinieron.
+                estado = EN_CURSO
+            else:
+                estado = EN_ESPERA
+            # El DVH es la suma de largos: alcanza con ajustar lo que cambió.
+            dvh = f["dvh"]
+            if dvh is not None:
+                dvh += len(estado) - len(f["estado"]) + len(str(fin)) - len(str(f["fecha_fin"]))
+                delta += dvh - f["dvh"]
+            nuevas.append((estado, fin, dvh, f["id"]))
+            cambios.append((f["id"], f["equipo"], f["fecha_inicio"], f["fecha_fin"], fin, estado))
+        cursor.executemany("UPDATE reservas_equipos SET estado = ?, fecha_fin = ?, dvh = ? WHERE id = ?", nuevas)
+    if cambios:
+        sumar_dvv(cursor, "reservas_equipos", delta)
+    return cambios
+
+
+class PlanificadorReservas:
+    def __init__(self):
+        self._heap = []
+        self._secuencia = 0
+        # (bd, id, borde) -> momento vigente. Lo que quede en el heap con
+        # otro momento (reserva editada, recargas repetidas) se descarta al salir.
+        self._programadas = {}
+        self._lock = Lock()
+        self._despertar = Event()
+        self._activo = False
+        self.transiciones = 0
+        self.ticks = 0
+
+    def _empujar(self, momento, borde, bd=None, rid=None):
+        self._secuencia += 1
+        heapq.heappush(self._heap, (momento, self._secuencia, borde, bd, rid))
+
+    def programar(self, bd, rid, fecha_inicio, fecha_fin, estado=RESERVADO[0]):
+        # Lo llaman las altas y ediciones de reservas. Fuera del horizonte no
+        # hace nada: la recarga la va a traer cuando se acerque.
+        if not self._activo:
+            return
+        inicio, fin = _fecha(fecha_inicio), _fecha(fecha_fin)
+        if inicio is None or fin is None:
+            return
+        bordes = []
+        if estado in RESERVADO:
+            bordes.append(("inicio", inicio))
+        if estado == EN_ESPERA and TOLERANCIA:
+            bordes.append(("tolerancia", inicio + TOLERANCIA))
+        if estado in VIGENTES:
+            bordes.append(("fin", fin))
+        limite = datetime.now() + HORIZONTE
+        despertar = False
+        with self._lock:
+            for borde, momento in bordes:
+                clave = (bd, rid, borde)
+                if momento > limite or self._programadas.get(clave) == momento:
+                    continue
+                self._programadas[clave] = momento
+                self._empujar(momento, borde, bd, rid)
+                despertar = despertar or self._heap[0][0] == momento
+        if despertar:
+            self._despertar.set()
+
+    def iniciar(self, socketio):
+        if self._activo:
+            return
+        self._activo = True
+        self._socketio = socketio
+        with self._lock:
+            self._empujar(datetime.now(), "recargar")
+        socketio.start_background_task(self._bucle)
+
+    def pendientes(self):
+        with self._lock:
+            return len(self._programadas)
+
+    # ---------- hilo ----------
+    def _bucle(self):
+        while True:
+            with self._lock:
+                espera = (self._heap[0][0] - datetime.now()).total_seconds() if self._heap else RECARGAR_CADA
+            if espera > 0:
+                self._despertar.wait(min(espera, RECARGAR_CADA))
+                self._despertar.clear()
+                continue
+            try:
+                self._tick()
+            except Exception as e:
+                print("Error en el ciclo de reservas:", e)
+
+    def _tick(self):
+        ahora = datetime.now()
+        por_bd, recargar = {}, False
+        with self._lock:
+            while self._heap and self._heap[0][0] <= ahora:
+                momento, _, borde, bd, rid = heapq.heappop(self._heap)
+                if borde == "recargar":
+                    recargar = True
+                    continue
+                if self._programadas.get((bd, rid, borde)) != momento:
+                    continue
+                del self._programadas[(bd, rid, borde)]
+                por_bd.setdefault(bd, {}).setdefault(borde, []).append(rid)
+
+        cambios = []
+        for bd, ids_por_borde in por_bd.items():
+            try:
+                cambios += [(bd, *c) for c in escritor.ejecutar(aplicar_transiciones, ids_por_borde, ahora, bd=bd)]
+            except Exception as e:
+                print("Error al actualizar estados de reservas:", e)
+        if recargar:
+            with self._lock:
+                self._empujar(ahora + timedelta(seconds=RECARGAR_CADA), "recargar")
+            self._recargar(ahora)
+        self.ticks += 1
+        if not cambios:
+            return
+
+        self.transiciones += len(cambios)
+        metricas.incrementar("reservas_transiciones", len(cambios))
+        for bd, rid, _, inicio, _, fin, estado in cambios:
+            self.programar(bd, rid, inicio, fin, estado)
+        liberadas = [c for c in cambios if c[-1] == NO_PRESENTADO]
+        if liberadas:
+            from analitica import actualizar_uso
+            actualizar_uso(
+                [(equipo, inicio, fin_anterior, -1) for _, _, equipo, inicio, fin_anterior, _, _ in liberadas]
+                + [(equipo, inicio, fin, 1) for _, _, equipo, inicio, _, fin, _ in liberadas]
+            )
+        # Un solo aviso por tick, cambien una o mil reservas.
+        self._socketio.emit("refresh_calendar", {})
+
+    def _recargar(self, ahora):
+        limite = (ahora + HORIZONTE).strftime(FORMATO)
+        limite_espera = (ahora + HORIZONTE - TOLERANCIA).strftime(FORMATO)
+        for bd in shards.todas():
+            try:
+                filas = ejecutar_select(f"""
+                    SELECT id, estado, fecha_inicio, fecha_fin FROM reservas_equipos
+                    WHERE estado_logico = 0 AND estado IN ({_marcas(RESERVADO)}) AND fecha_inicio <= ?
+                    UNION
+                    SELECT id, estado, fecha_inicio, fecha_fin FROM reservas_equipos
+                    WHERE estado_logico = 0 AND estado = '{EN_ESPERA}' AND fecha_inicio <= ?
+                    UNION
+                    SELECT id, estado, fecha_inicio, fecha_fin FROM reservas_equipos
+                    WHERE estado_logico = 0 AND estado IN ({_marcas(VIGENTES)}) AND fecha_fin <= ?
+                """, (limite, limite_espera, limite), bd=bd)
+            except Exception as e:
+                print("Error al cargar reservas próximas:", e)
+                continue
+            for f in filas:
+                self.programar(bd, f["id"], f["fecha_inicio"], f["fecha_fin"], f["estado"])
+
+
+planificador = PlanificadorReservas()
+
+
+def iniciar_ciclo_reservas(socketio):
+    # Como las alertas de reactivos: las transiciones salen de un solo worker.
+    if os.environ.get("BIOLABHUB_WORKER", "0") == "0":
+        planificador.iniciar(socketio)
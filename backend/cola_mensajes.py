@@ -0,0 +1,66 @@
+import queue
+import threading
+
+import socketio
+
+
+# ========================================
+#  COLA DE MENSAJES PARA SOCKET.IO
+# ========================================
+# Con varios workers cada proceso tiene sus propios clientes conectados; para
+# que un socketio.emit() llegue a todos hace falta un pub/sub compartido
+# (redis://, amqp://, kafka://...). "memoria://" es un reemplazo dentro del
+# mismo proceso para probar ese camino sin levantar Redis.
+class ColaEnMemoria(socketio.PubSubManager):
+    name = "memoria"
+
+    _canales = {}
+    _lock = threading.Lock()
+
+    def __init__(self, url="memoria://", channel="flask-socketio", write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._entrada = queue.Queue()
+        with self._lock:
+            self._canales.setdefault(channel, []).append(self._entrada)
+
+    def _publish(self, data):
+        with self._lock:
+            suscriptores = list(self._canales.get(self.channel, []))
+        for cola in suscriptores:
+            cola.put(data)
+
+    def _listen(self):
+        while True:
+            yield self._entrada.get()
+
+
+def opciones_socketio(url):
+    # kwargs para SocketIO() según BIOLABHUB_MESSAGE_QUEUE
+    if not url:
+        return {}
+    if url.startswith("memoria://"):
+        return {"client_manager": ColaEnMemoria(url)}
+    return {"message_queue": url}
+
+
+def verificar_cola_local(timeout=2.0):
+    # Dos servidores Socket.IO en el mismo proceso comparten una ColaEnMemoria:
+    # un emit en el servidor A tiene que llegar a un cliente conectado al B.
+    canal = "verificacion-biolabhub"
+    sio_a = socketio.Server(async_mode="threading", client_manager=ColaEnMemoria(channel=canal))
+    sio_b = socketio.Server(async_mode="threading", client_manager=ColaEnMemoria(channel=canal))
+
+    recibidos = queue.Queue()
+    sio_b._send_eio_packet = lambda eio_sid, pkt: recibidos.put(
+        socketio.packet.Packet(encoded_packet=pkt.data).data
+    )
+    for sio in (sio_a, sio_b):
+        sio.manager_initialized = True
+        sio.manager.initialize()
+    sio_b.manager.connect("cliente-de-prueba", "/")
+
+    sio_a.emit("refresh_calendar", {"origen": "worker_a"})
+    try:
+        return recibidos.get(timeout=timeout) == ["refresh_calendar", {"origen": "worker_a"}]
+    except queue.Empty:
+        return False
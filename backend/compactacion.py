@@ -0,0 +1,203 @@
+# ========================================
+#  COMPACTACIÓN DE BORRADOS LÓGICOS
+# ========================================
+# Las filas con estado_logico = 1 de muestras, experimentos y
+# reservas_equipos se mueven a <tabla>_archivo: las tablas activas quedan
+# solo con datos vivos y los recorridos no pasan por filas borradas.
+# El DVH de cada fila viaja con ella y el DVV se traslada de una tabla a
+# la otra, así la verificación de integridad sigue cerrando.
+#
+#   python compactacion.py              # compactar todo (para cron)
+#   python compactacion.py --paginas 0  # sin límite de páginas a liberar
+import argparse
+import os
+from datetime import datetime
+
+from db import (
+    ARCHIVABLES,
+    conectar_bd,
+    columnas_de,
+    dvh_fila,
+    sumar_dvv,
+    siguiente_revision,
+    registrar_auditoria,
+    registrar_auditoria_en,
+)
+import escritor
+import shards
+
+# Páginas que libera cada incremental_vacuum (0 = todas las libres).
+PAGINAS_VACUUM = int(os.environ.get("BIOLABHUB_VACUUM_PAGINAS", "2000"))
+
+
+class ReservaSuperpuesta(Exception):
+    # Restaurar la reserva la superpondría con otra viva del mismo equipo.
+    pass
+
+
+def _mover(cursor, origen, destino, condicion, parametros=(), extra=None):
+    # Copia filas de origen a destino por nombre de columna y las borra del
+    # origen. Devuelve (filas movidas, suma de sus DVH).
+    columnas = [nombre for nombre, _ in columnas_de(cursor, origen)]
+    destino_cols = {nombre for nombre, _ in columnas_de(cursor, destino)}
+    comunes = [c for c in columnas if c in destino_cols]
+    lista = ", ".join(comunes)
+    cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(dvh), 0) FROM {origen} WHERE {condicion}", parametros)
+    cantidad, suma_dvh = cursor.fetchone()
+    if not cantidad:
+        return 0, 0
+    if extra:
+        nombre, valor = extra
+        cursor.execute(
+            f"INSERT INTO {destino} ({lista}, {nombre}) SELECT {lista}, ? FROM {origen} WHERE {condicion}",
+            (valor, *parametros),
+        )
+    else:
+        cursor.execute(f"INSERT INTO {destino} ({lista}) SELECT {lista} FROM {origen} WHERE {condicion}", parametros)
+    cursor.execute(f"DELETE FROM {origen} WHERE {condicion}", parametros)
+    return cantidad, suma_dvh
+
+
+def compactar(usuario_id=None, ip_origen=None, paginas=PAGINAS_VACUUM):
+    resultado = {}
+    for bd in shards.todas():
+        tablas = ARCHIVABLES if bd is None else shards.TABLAS
+        for tabla, movidas in _compactar_bd(bd, tablas, usuario_id, ip_origen).items():
+            resultado[tabla] = resultado.get(tabla, 0) + movidas
+    resultado["paginas_liberadas"] = sum(vacuum_incremental(paginas, bd) for bd in shards.todas())
+    return resultado
+
+
+def _compactar_bd(bd, tablas, usuario_id, ip_origen):
+    fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def compactar_tabla(cursor, tabla):
+        movidas, suma = _mover(
+            cursor, tabla, f"{tabla}_archivo", "estado_logico = 1", extra=("fecha_archivado", fecha),
+        )
+        if movidas:
+            sumar_dvv(cursor, tabla, -suma)
+            sumar_dvv(cursor, f"{tabla}_archivo", suma)
+            if bd is None:
+                registrar_auditoria_en(cursor, usuario_id, f"COMPACTAR ({movidas})", tabla, None, ip_origen)
+        return movidas
+
+    resultado = {}
+    # Un trabajo del escritor (no agrupable) por tabla: el lock de escritura
+    # se suelta entre tablas y no frena tanto a las escrituras normales.
+    for tabla in tablas:
+        movidas = escritor.ejecutar(compactar_tabla, tabla, bd=bd, agrupable=False)
+        if movidas and bd is not None:
+            # La auditoría vive en la BD compartida.
+            registrar_auditoria(usuario_id, f"COMPACTAR ({movidas})", tabla, None, ip_origen)
+        resultado[tabla] = movidas
+    return resultado
+
+
+def vacuum_incremental(paginas=PAGINAS_VACUUM, bd=None):
+    # Fuera del escritor: incremental_vacuum y VACUUM no corren dentro de
+    # una transacción, y no cambian datos (nada que invalidar en cache).
+    conn = conectar_bd(bd, adjuntar_global=False)
+    conn.isolation_level = None
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # BD creada antes de auto_vacuum: se convierte una sola vez con
+            # un VACUUM completo; de ahí en adelante alcanza con el incremental.
+            print(" Convirtiendo la base a auto_vacuum=INCREMENTAL (VACUUM completo, una sola vez)...")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            return 0
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if paginas:
+            conn.execute(f"PRAGMA incremental_vacuum({int(paginas)})").fetchall()
+        else:
+            conn.execute("PRAGMA incremental_vacuum").fetchall()
+        return libres - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def restaurar(tabla, registro_id, usuario_id=None, ip_origen=None):
+    # Devuelve la fila a la tabla activa (desde el archivo o, si todavía no
+    # se compactó, solo desmarcando el borrado lógico). Devuelve la fila
+    # restaurada como dict, o None si no existe. Una reserva que choca con
+    # otra viva del mismo equipo no se restaura (ReservaSuperpuesta).
+    if tabla not in ARCHIVABLES:
+        raise ValueError(f"La tabla '{tabla}' no admite restauración.")
+    archivo = f"{tabla}_archivo"
+    bd = shards.bd_de_id(tabla, registro_id)
+
+    def restaurar_en(cursor):
+        cursor.execute(f"SELECT dvh FROM {tabla} WHERE id = ? AND estado_logico = 1", (registro_id,))
+        fila = cursor.fetchone()
+        if fila:
+            dvh_anterior = fila["dvh"] or 0
+        else:
+            movidas, dvh_anterior = _mover(cursor, archivo, tabla, "id = ?", (registro_id,))
+            if not movidas:
+                return None
+            sumar_dvv(cursor, archivo, -dvh_anterior)
+            sumar_dvv(cursor, tabla, dvh_anterior)
+
+        if tabla == "experimentos":
+            # Para /experiments/cambios la restauración es un cambio más.
+            revision = siguiente_revision(cursor, "experimentos")
+            cursor.execute("UPDATE experimentos SET estado_logico = 0, revision = ? WHERE id = ?", (revision, registro_id))
+        else:
+            cursor.execute(f"UPDATE {tabla} SET estado_logico = 0 WHERE id = ?", (registro_id,))
+
+        cursor.execute(f"SELECT * FROM {tabla} WHERE id = ?", (registro_id,))
+        restaurada = dict(cursor.fetchone())
+        if tabla == "reservas_equipos":
+            # Mismo control semiabierto que reservar() / reservar_lote(): en
+            # el tiempo que estuvo borrada alguien pudo tomar ese horario.
+            # Todas las reservas de un equipo están en el mismo archivo. Al
+            # lanzar la excepción el escritor deshace todo el trabajo.
+            cursor.execute("""
+                SELECT fecha_inicio, fecha_fin FROM reservas_equipos
+                WHERE estado_logico = 0 AND equipo = ? AND id != ?
+                AND fecha_inicio < ? AND fecha_fin > ?
+                LIMIT 1
+            """, (restaurada["equipo"], registro_id, restaurada["fecha_fin"], restaurada["fecha_inicio"]))
+            choque = cursor.fetchone()
+            if choque:
+                raise ReservaSuperpuesta(
+                    f"El equipo '{restaurada['equipo']}' ya está reservado de "
+                    f"{choque['fecha_inicio']} a {choque['fecha_fin']}."
+                )
+        # Cambió estado_logico: nuevo DVH de la fila completa (dvh_fila).
+        restaurada["dvh"] = dvh_fila(restaurada)
+        cursor.execute(f"UPDATE {tabla} SET dvh = ? WHERE id = ?", (restaurada["dvh"], registro_id))
+        sumar_dvv(cursor, tabla, restaurada["dvh"] - dvh_anterior)
+        if bd is None:
+            registrar_auditoria_en(cursor, usuario_id, "RESTAURAR", tabla, registro_id, ip_origen)
+        return restaurada
+
+    restaurada = escritor.ejecutar(restaurar_en, bd=bd)
+    if restaurada is not None and bd is not None:
+        registrar_auditoria(usuario_id, "RESTAURAR", tabla, registro_id, ip_origen)
+    return restaurada
+
+
+def listar_archivo(tabla, limite=100, antes_de=None):
+    if tabla not in ARCHIVABLES:
+        raise ValueError(f"La tabla '{tabla}' no tiene archivo.")
+    if tabla != "experimentos":
+        filas = shards.consultar_todos(f"""
+            SELECT * FROM {tabla}_archivo WHERE id < ? ORDER BY id DESC LIMIT ?
+        """, (antes_de or 2 ** 62, limite), clave=lambda f: f["id"], desc=True, limite=limite)
+        return [dict(f) for f in filas]
+    conn = conectar_bd()
+    filas = conn.execute(f"""
+        SELECT * FROM {tabla}_archivo WHERE id < ? ORDER BY id DESC LIMIT ?
+    """, (antes_de or 2 ** 62, limite)).fetchall()
+    conn.close()
+    return [dict(f) for f in filas]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compactar borrados lógicos de BioLabHub")
+    parser.add_argument("--paginas", type=int, default=PAGINAS_VACUUM,
+                        help="páginas a liberar con incremental_vacuum (0 = todas)")
+    args = parser.parse_args()
+    print(compactar(paginas=args.paginas))
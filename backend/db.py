@@ -3,21 +3,52 @@ from sqlite3 import Error
 import os
 from datetime import datetime
 import bcrypt
+from metricas import instrumentar_conexion, medir
+from integridad import (
+    TABLAS as TABLAS_MERKLE, crear_merkle, crear_sesion, abrir_escritura, cerrar_escritura,
+    aplicar_pendientes, construir as construir_merkle,
+)
+import escritor
+import cache_consultas
 \
 \
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-DB_PATH = os.path.join(BASE_DIR, "biolabhub.db")
+DB_PATH = os.environ.get("BIOLABHUB_DB", os.path.join(BASE_DIR, "biolabhub.db"))
+# Segundos que una conexión espera el lock de escritura antes de fallar.
+# Con gevent/eventlet la espera bloquea todo el proceso, así que el
+# lanzador de producción lo baja.
+DB_TIMEOUT = float(os.environ.get("BIOLABHUB_DB_TIMEOUT", "5"))
+# Se guarda en PRAGMA user_version al terminar crear_bd(). Subirlo cada vez
+# que se agregue una tabla, columna o índice.
+SCHEMA_VERSION = 18
 \
-def conectar_bd():
+def conectar_bd(ruta=None, adjuntar_global=True):
+    # ruta: archivo de un laboratorio en modo sharding (ver shards.py). La
+    # BD compartida se adjunta como "global" para los JOIN con usuarios.
+    # Ojo: BEGIN IMMEDIATE toma el lock de escritura de todas las BD
+    # adjuntas; las transacciones que solo escriben en el shard conectan
+    # con adjuntar_global=False para no frenar a la BD compartida.
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(ruta or DB_PATH, timeout=DB_TIMEOUT)
         conn.row_factory = sqlite3.Row
-        return conn
+        if ruta and ruta != DB_PATH and adjuntar_global:
+            conn.execute("ATTACH DATABASE ? AS global", (DB_PATH,))
+        return instrumentar_conexion(conn)
     except Error as e:
         print("Error al conectar con la base de datos:", e)
+def activar_wal():
+    # WAL es persistente en el archivo: los lectores no esperan al escritor,
+    # necesario cuando hay varios workers sobre la misma BD.
+    conn = conectar_bd()
+    modo = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+    conn.close()
+    return modo
 def crear_bd():
     conn = conectar_bd()
     cursor = conn.cursor()
+    # Solo tiene efecto en una BD nueva; en una existente la compactación
+    # hace la conversión (ver compactacion.py).
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
     \
 \
 \
@@ -138,11 +169,100 @@ def crear_bd():
         )
     """)
     \
+    # Inventario de reactivos (ver reactivos.py): el stock sale de un libro
+    # de movimientos que solo crece; saldos_reactivos guarda el saldo ya
+    # sumado hasta hasta_movimiento y se actualiza periódicamente.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS movimientos_reactivos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reactivo_id INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,
+            lote TEXT,
+            operacion TEXT,
+            usuario_id INTEGER,
+            fecha TIMESTAMP,
+            dvh INTEGER,
+            FOREIGN KEY (reactivo_id) REFERENCES reactivos(id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS saldos_reactivos (
+            reactivo_id INTEGER PRIMARY KEY,
+            saldo INTEGER NOT NULL DEFAULT 0,
+            hasta_movimiento INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (reactivo_id) REFERENCES reactivos(id)
+        )
+    """)
+    \
+    # Resumen diario de uso por equipo (ver analitica.py): minutos ocupados
+    # en cada hora del día, reservas y pedidos rechazados por conflicto.
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'uso_equipos_diario'")
+    habia_resumen = cursor.fetchone() is not None
+    horas = ", ".join(f"h{h:02d} INTEGER NOT NULL DEFAULT 0" for h in range(24))
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS uso_equipos_diario (
+            equipo TEXT NOT NULL,
+            dia DATE NOT NULL,
+            reservas INTEGER NOT NULL DEFAULT 0,
+            rechazos INTEGER NOT NULL DEFAULT 0,
+            {horas},
+            PRIMARY KEY (equipo, dia)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_uso_equipos_dia ON uso_equipos_diario(dia)")
+    \
+    # Tabla de clausura del linaje: una fila por cada par ancestro →
+    # descendiente (profundidad 1 = hijo directo). Ancestros y descendientes
+    # de una muestra salen de un recorrido de índice, sin recursión.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS linaje_muestras (
+            ancestro_id INTEGER NOT NULL,
+            descendiente_id INTEGER NOT NULL,
+            profundidad INTEGER NOT NULL,
+            PRIMARY KEY (ancestro_id, descendiente_id)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_linaje_descendiente
+        ON linaje_muestras(descendiente_id, profundidad, ancestro_id)
+    """)
+    \
+    # Modo sharding (ver shards.py): filas de muestras/reservas que no están
+    # en el archivo que indica su id (migradas o cambiadas de laboratorio).
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS directorio_ids (
+            tabla TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            laboratorio_id INTEGER NOT NULL,
+            PRIMARY KEY (tabla, id)
+        ) WITHOUT ROWID
+    """)
+    \
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS revisiones (
+            tabla TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    # Los nombres de usuario aparecen en páginas cacheadas por revisión
+    # (responsables y selector de experimentos): cualquier alta, baja o
+    # cambio de nombre, venga de donde venga, avanza la revisión "usuarios".
+    for evento, momento in (("ai", "INSERT"), ("ad", "DELETE"), ("au", "UPDATE OF nombre, estado_logico")):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS usuarios_revision_{evento} AFTER {momento} ON usuarios BEGIN
+                INSERT INTO revisiones (tabla, revision) VALUES ('usuarios', 1)
+                ON CONFLICT(tabla) DO UPDATE SET revision = revision + 1;
+            END
+        """)
+    \
     conn.commit()
     \
 \
 \
 \
+    alteradas = set()
     def asegurar_columna(tabla, columna, tipo):
         cursor.execute(f"PRAGMA table_info({tabla})")
         columnas_existentes = [col[1] for col in cursor.fetchall()]
@@ -151,14 +271,46 @@ def crear_bd():
             try:
                 cursor.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {tipo}")
                 conn.commit()
+                alteradas.update((tabla, f"{tabla}_archivo"))
                 print(f"Columna '{columna}' agregada correctamente.")
             except Error as e:
                 print(f"No se pudo agregar la columna '{columna}' a '{tabla}': {e}")
     asegurar_columna("experimentos", "protocolo_archivo", "TEXT")
     asegurar_columna("usuarios", "ultima_sesion", "TIMESTAMP")
     asegurar_columna("muestras", "fecha_ingreso", "TIMESTAMP DEFAULT CURRENT_TIMESTAMP")
+    asegurar_columna("experimentos", "revision", "INTEGER DEFAULT 0")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_experimentos_revision ON experimentos(revision)")
+    crear_fts(cursor)
+    asegurar_columna("reactivos", "stock_minimo", "INTEGER DEFAULT 0")
+    # Versión de fila para el compare-and-swap de las ediciones.
+    asegurar_columna("muestras", "version", "INTEGER NOT NULL DEFAULT 1")
+    asegurar_columna("experimentos", "version", "INTEGER NOT NULL DEFAULT 1")
+    # Linaje de muestras (ver linaje.py): padre directo en la fila y todos
+    # los pares ancestro/descendiente en linaje_muestras.
+    asegurar_columna("muestras", "padre_id", "INTEGER")
+    asegurar_columna("muestras", "relacion", "TEXT")
+    # Metadatos de la muestra (ver /samples/details).
+    asegurar_columna("muestras", "origen", "TEXT")
+    asegurar_columna("muestras", "condiciones", "TEXT")
+    asegurar_columna("muestras", "observaciones", "TEXT")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_movimientos_reactivo ON movimientos_reactivos(reactivo_id, id)")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reactivos_caducidad
+        ON reactivos(fecha_caducidad) WHERE estado_logico = 0
+    """)
+    # Reactivos cargados antes del libro de movimientos: su columna stock
+    # pasa a ser el saldo de apertura.
+    cursor.execute("""
+        INSERT INTO saldos_reactivos (reactivo_id, saldo, hasta_movimiento)
+        SELECT id, COALESCE(stock, 0), 0 FROM reactivos
+        WHERE id NOT IN (SELECT reactivo_id FROM saldos_reactivos)
+    """)
     \
 \
+    # Los seeds son escrituras de la app: van en una sesión de escritura
+    # para que abajo se plieguen en el árbol de Merkle (ver integridad.py).
+    crear_sesion(cursor)
+    abrir_escritura(cursor)
     cursor.execute("SELECT COUNT(*) FROM equipos")
     if cursor.fetchone()[0] == 0:
         equipos_iniciales = [\
@@ -188,7 +340,8 @@ def crear_bd():
     \
     if not admin_existente:
         contraseña = b"admin123"                            
-        hash_admin = bcrypt.hashpw(contraseña, bcrypt.gensalt()).decode("utf-8")
+        with medir("bcrypt"):
+            hash_admin = bcrypt.hashpw(contraseña, bcrypt.gensalt()).decode("utf-8")
         datos_admin = {\
             "nombre": "Administrador",\
             "email": "admin@biolabhub.com",\
@@ -204,21 +357,217 @@ def crear_bd():
             """,
             ("Administrador", "admin@biolabhub.com", hash_admin, "admin", 0, dvh_admin),
         )
-        conn.commit()
         print("Usuario admin creado: admin@biolabhub.com / admin123")
     else:
         print("Usuario admin ya existe.")
+    # La sesión no queda confirmada: el COMMIT ya no la ve.
+    cerrar_escritura(cursor)
+    conn.commit()
+    crear_archivos(cursor)
+    # Telemetría de equipos (ver telemetria.py). Las lecturas crudas usan
+    # códigos enteros y ts en ms en una tabla WITHOUT ROWID: la PK es el
+    # único índice y cada fila ocupa unos pocos bytes. Los rollups por
+    # minuto y por hora se actualizan en cada volcado y son lo que leen
+    # los gráficos.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS telemetria_lecturas (
+            equipo_id INTEGER NOT NULL,
+            metrica INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            valor REAL NOT NULL,
+            PRIMARY KEY (equipo_id, metrica, ts)
+        ) WITHOUT ROWID
+    """)
+    for resolucion in ("minuto", "hora"):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS telemetria_{resolucion} (
+                equipo_id INTEGER NOT NULL,
+                metrica INTEGER NOT NULL,
+                {resolucion} INTEGER NOT NULL,
+                n INTEGER NOT NULL,
+                suma REAL NOT NULL,
+                minimo REAL NOT NULL,
+                maximo REAL NOT NULL,
+                PRIMARY KEY (equipo_id, metrica, {resolucion})
+            ) WITHOUT ROWID
+        """)
+    # Umbrales de alerta: la alerta salta si la métrica queda fuera de
+    # [minimo, maximo] durante al menos sostenido_seg.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS umbrales_telemetria (
+            equipo_id INTEGER NOT NULL,
+            metrica TEXT NOT NULL,
+            minimo REAL,
+            maximo REAL,
+            sostenido_seg INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (equipo_id, metrica),
+            FOREIGN KEY (equipo_id) REFERENCES equipos(id)
+        )
+    """)
+    cursor.execute("SELECT COUNT(*) FROM umbrales_telemetria")
+    if cursor.fetchone()[0] == 0:
+        umbrales_iniciales = [\
+            ("Freezer -80°C", "temperatura", None, -70, 60),\
+            ("Freezer -80°C", "puerta", None, 0, 120),\
+            ("Centrífuga Eppendorf 5424R", "rpm", None, 15000, 0),\
+            ("Centrífuga Eppendorf 5424R", "temperatura", -11, 40, 30),\
+        ]
+        cursor.executemany("""
+            INSERT INTO umbrales_telemetria (equipo_id, metrica, minimo, maximo, sostenido_seg)
+            SELECT id, ?, ?, ?, ? FROM equipos WHERE nombre = ?
+        """, [(m, mi, ma, s, e) for e, m, mi, ma, s in umbrales_iniciales])
+    # Diario de eventos Socket.IO (solo con BIOLABHUB_DIARIO_PERSISTENTE=1,
+    # ver diario.py).
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS diario_eventos (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            evento TEXT NOT NULL,
+            datos TEXT,
+            fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Índices parciales: solo cubren filas vivas.
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_muestras_vivas_fecha
+        ON muestras(fecha_ingreso) WHERE estado_logico = 0
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservas_vivas_equipo
+        ON reservas_equipos(equipo, fecha_inicio) WHERE estado_logico = 0
+    """)
+    # Próximos cambios de estado de las reservas (ver ciclo_reservas.py).
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservas_estado_inicio
+        ON reservas_equipos(estado, fecha_inicio) WHERE estado_logico = 0
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservas_estado_fin
+        ON reservas_equipos(estado, fecha_fin) WHERE estado_logico = 0
+    """)
+    # Bitácora de la más nueva a la más vieja (admin/logs en streaming).
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audits_fecha ON audits_logs(fecha)")
+    if not habia_resumen:
+        # Primera vez: se arma el resumen con las reservas existentes.
+        conn.commit()
+        from analitica import reconstruir_resumen
+        reconstruir_resumen()
+    # Árboles de Merkle (ver integridad.py): se pliegan los bloques de los
+    # seeds de arriba; lo que se haya editado con el servidor apagado queda
+    # pendiente como sospechoso.
+    crear_merkle(cursor)
+    for tabla in TABLAS_MERKLE:
+        if tabla in alteradas:
+            # Una columna nueva cambia todas las filas de la tabla (y de su
+            # archivo): el árbol se rearma en vez de marcarlas alteradas.
+            construir_merkle(cursor, tabla)
+        aplicar_pendientes(cursor, tabla)
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
     print("Base de datos verificada y actualizada correctamente.")
+def version_esquema():
+    conn = conectar_bd()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+    return version
+def verificar_bd():
+    # Arranque rápido: si la BD ya está en la versión de esquema actual no
+    # hace falta correr los CREATE/PRAGMA/seeds de crear_bd().
+    if os.path.exists(DB_PATH) and version_esquema() == SCHEMA_VERSION:
+        return False
+    print(" Verificando esquema de la base de datos...")
+    crear_bd()
+    return True
+# Índices de texto completo (ver busqueda.py). Las tablas FTS usan la tabla
+# original como contenido y se mantienen con triggers, así que cualquier
+# camino de escritura queda sincronizado.
+FTS_TABLAS = {
+    "muestras": ("nombre", "tipo", "ubicacion"),
+    "experimentos": ("titulo", "descripcion"),
+}
+def fts_disponible(cursor):
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp._prueba_fts USING fts5(x)")
+        cursor.execute("DROP TABLE temp._prueba_fts")
+        return True
+    except Error:
+        return False
+def crear_fts(cursor):
+    if not fts_disponible(cursor):
+        print("SQLite sin FTS5: la búsqueda de texto completo queda desactivada.")
+        return
+    for tabla, columnas in FTS_TABLAS.items():
+        fts = f"{tabla}_fts"
+        cols = ", ".join(columnas)
+        nuevos = ", ".join(f"new.{c}" for c in columnas)
+        viejos = ", ".join(f"old.{c}" for c in columnas)
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,))
+        existia = cursor.fetchone() is not None
+        cursor.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {cols}, content='{tabla}', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {tabla} BEGIN
+                INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {nuevos});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {tabla} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {viejos});
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {tabla} BEGIN
+                INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {viejos});
+                INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {nuevos});
+            END
+        """)
+        if not existia:
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    # El texto de los protocolos no vive en ninguna tabla: se indexa al subir
+    # el archivo (busqueda.indexar_protocolo).
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS protocolos_fts USING fts5(
+            texto, experimento_id UNINDEXED, archivo UNINDEXED,
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+# Tablas cuyas filas con borrado lógico se mueven a <tabla>_archivo
+# (ver compactacion.py). El archivo tiene las mismas columnas más
+# fecha_archivado.
+ARCHIVABLES = ("muestras", "experimentos", "reservas_equipos")
+def columnas_de(cursor, tabla):
+    cursor.execute(f"PRAGMA table_info({tabla})")
+    return [(col[1], col[2]) for col in cursor.fetchall()]
+def crear_archivos(cursor):
+    for tabla in ARCHIVABLES:
+        archivo = f"{tabla}_archivo"
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {archivo} AS
+            SELECT *, CAST(NULL AS TIMESTAMP) AS fecha_archivado FROM {tabla} WHERE 0
+        """)
+        existentes = {nombre for nombre, _ in columnas_de(cursor, archivo)}
+        for nombre, tipo in columnas_de(cursor, tabla):
+            if nombre not in existentes:
+                cursor.execute(f"ALTER TABLE {archivo} ADD COLUMN {nombre} {tipo}")
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{archivo}_id ON {archivo}(id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_experimentos_archivo_revision ON experimentos_archivo(revision)")
 def calcular_dvh(datos):
     total = 0
     for valor in datos.values():
         total += len(str(valor))
     return total
-def recalcular_dvv(tabla):
-    conexion = conectar_bd()
-    cursor = conexion.cursor()
+def dvh_fila(fila):
+    # DVH de una fila completa leída de la tabla: todas las columnas menos
+    # dvh (id incluido). Es el que usan las altas de muestras, la
+    # restauración y el recálculo del panel de administración.
+    return calcular_dvh({k: fila[k] for k in fila.keys() if k != "dvh"})
+def recalcular_dvv(tabla, bd=None):
+    escritor.ejecutar(recalcular_dvv_en, tabla, bd=bd)
+def recalcular_dvv_en(cursor, tabla):
     cursor.execute(f"SELECT dvh FROM {tabla} WHERE dvh IS NOT NULL")
     suma = sum(fila[0] for fila in cursor.fetchall())
     cursor.execute("SELECT dvv FROM verificaciones_verticales WHERE tabla=?", (tabla,))
@@ -226,29 +575,45 @@ def recalcular_dvv(tabla):
         cursor.execute("UPDATE verificaciones_verticales SET dvv=? WHERE tabla=?", (suma, tabla))
     else:
         cursor.execute("INSERT INTO verificaciones_verticales (tabla, dvv) VALUES (?, ?)", (tabla, suma))
-    conexion.commit()
-    conexion.close()
-def ejecutar_select(query, parametros=()):
-    conn = conectar_bd()
+    aplicar_pendientes(cursor, tabla)
+def sumar_dvv(cursor, tabla, delta):
+    # El DVV es la suma de los DVH: para filas nuevas alcanza con sumarles
+    # su DVH, sin releer la tabla entera como recalcular_dvv().
+    cursor.execute("UPDATE verificaciones_verticales SET dvv = dvv + ? WHERE tabla = ?", (delta, tabla))
+    if cursor.rowcount == 0:
+        cursor.execute(f"SELECT COALESCE(SUM(dvh), 0) FROM {tabla} WHERE dvh IS NOT NULL")
+        cursor.execute("INSERT INTO verificaciones_verticales (tabla, dvv) VALUES (?, ?)", (tabla, cursor.fetchone()[0]))
+    aplicar_pendientes(cursor, tabla)
+def siguiente_revision(cursor, tabla):
+    # Se llama dentro de la misma transacción que la escritura: el UPDATE
+    # toma el lock de escritura, así dos escrituras nunca comparten revisión.
+    cursor.execute("UPDATE revisiones SET revision = revision + 1 WHERE tabla = ?", (tabla,))
+    if cursor.rowcount == 0:
+        cursor.execute("INSERT INTO revisiones (tabla, revision) VALUES (?, 1)", (tabla,))
+    cursor.execute("SELECT revision FROM revisiones WHERE tabla = ?", (tabla,))
+    return cursor.fetchone()[0]
+def revision_actual(tabla):
+    filas = ejecutar_select("SELECT revision FROM revisiones WHERE tabla = ?", (tabla,))
+    return filas[0]["revision"] if filas else 0
+def ejecutar_select(query, parametros=(), bd=None, cache=False):
+    # cache=True (o un TTL en segundos): resultado desde cache_consultas.py,
+    # invalidado cuando el escritor toca alguna de las tablas que lee.
+    if cache and cache_consultas.ACTIVO:
+        return cache_consultas.leer(\
+            lambda: conectar_bd(bd), bd or DB_PATH, DB_PATH, query, parametros,\
+            None if cache is True else cache\
+        )
+    conn = conectar_bd(bd)
     cursor = conn.cursor()
     cursor.execute(query, parametros)
     filas = cursor.fetchall()
     conn.close()
     return filas
-def ejecutar_insert(query, parametros=()):
-    conn = conectar_bd()
-    cursor = conn.cursor()
-    cursor.execute(query, parametros)
-    conn.commit()
-    last_id = cursor.lastrowid
-    conn.close()
-    return last_id
-def ejecutar_update(query, parametros=()):
-    conn = conectar_bd()
-    cursor = conn.cursor()
-    cursor.execute(query, parametros)
-    conn.commit()
-    conn.close()
+def ejecutar_insert(query, parametros=(), bd=None):
+    # Las escrituras pasan por el hilo escritor del archivo (escritor.py).
+    return escritor.ejecutar(lambda cursor: cursor.execute(query, parametros).lastrowid, bd=bd)
+def ejecutar_update(query, parametros=(), bd=None):
+    escritor.ejecutar(lambda cursor: cursor.execute(query, parametros), bd=bd)
 def registrar_auditoria(usuario_id, accion, tabla, registro_id, ip_origen):
     datos = {\
         "usuario_id": usuario_id,\
@@ -264,5 +629,24 @@ def registrar_auditoria(usuario_id, accion, tabla, registro_id, ip_origen):
                (usuario_id, accion, tabla_afectada, registro_id, fecha, ip_origen, dvh)
                VALUES (?, ?, ?, ?, ?, ?, ?)"""
     \
-    ejecutar_insert(query, (usuario_id, accion, tabla, registro_id, datetime.now(), ip_origen, dvh))
-    recalcular_dvv("audits_logs")
+    def insertar(cursor):
+        cursor.execute(query, (usuario_id, accion, tabla, registro_id, datos["fecha"], ip_origen, dvh))
+        sumar_dvv(cursor, "audits_logs", dvh)
+    escritor.ejecutar(insertar)
+def registrar_auditoria_en(cursor, usuario_id, accion, tabla, registro_id, ip_origen):
+    # Igual que registrar_auditoria() pero dentro de la transacción del
+    # llamador: la operación y su auditoría se confirman juntas.
+    fecha = datetime.now()
+    dvh = calcular_dvh({
+        "usuario_id": usuario_id,
+        "accion": accion,
+        "tabla_afectada": tabla,
+        "registro_id": registro_id,
+        "fecha": fecha,
+        "ip_origen": ip_origen,
+    })
+    cursor.execute("""INSERT INTO audits_logs
+               (usuario_id, accion, tabla_afectada, registro_id, fecha, ip_origen, dvh)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                   (usuario_id, accion, tabla, registro_id, fecha, ip_origen, dvh))
+    sumar_dvv(cursor, "audits_logs", dvh)
@@ -0,0 +1,107 @@
+import json
+import os
+import threading
+import uuid
+from collections import deque
+
+from db import conectar_bd
+import escritor
+
+
+# ========================================
+#  DIARIO DE EVENTOS SOCKET.IO
+# ========================================
+# Cada broadcast de EVENTOS (socketio.emit sin "to") recibe un número de
+# secuencia y queda en un buffer circular con los últimos CAPACIDAD. El
+# cliente (static/socket.js) recuerda el último seq que vio y al
+# reconectarse emite "reanudar": recibe solo lo que se perdió, o
+# resync=True si eso ya salió del buffer (o el servidor se reinició) y
+# entonces sí recarga la página.
+#
+# Con BIOLABHUB_DIARIO_PERSISTENTE=1 el diario se guarda en diario_eventos:
+# el seq lo asigna SQLite, así que sobrevive a reinicios y es el mismo para
+# todos los workers que comparten la BD. Con una cola de mensajes
+# compartida (BIOLABHUB_MESSAGE_QUEUE, varios workers) se activa solo: el
+# broadcast de un worker llega a los clientes de los demás, y un seq del
+# contador en memoria de A no significa nada en B (resync de más, o
+# eventos descartados por el dedup de socket.js si los seq coinciden).
+EVENTOS = ("nuevo_evento", "refresh_calendar", "experimento_actualizado", "experiment_event", "alerta_reactivo", "alerta_equipo")
+# Con un refresco de calendario alcanza: al reanudar se manda solo el último.
+COALESCIBLES = ("refresh_calendar",)
+CAPACIDAD = int(os.environ.get("BIOLABHUB_DIARIO_CAPACIDAD", "500"))
+_COLA = os.environ.get("BIOLABHUB_MESSAGE_QUEUE", "")
+PERSISTENTE = (
+    os.environ.get("BIOLABHUB_DIARIO_PERSISTENTE") == "1"
+    or bool(_COLA and not _COLA.startswith("memoria://"))
+)
+
+
+class Diario:
+    def __init__(self, capacidad=CAPACIDAD, persistente=PERSISTENTE):
+        self.capacidad = capacidad
+        self.persistente = persistente
+        self._eventos = deque(maxlen=capacidad)   # (seq, evento, datos)
+        self._seq = 0
+        self._lock = threading.Lock()
+        # En memoria el seq vuelve a 0 al reiniciar: la época distingue el
+        # seq 40 de antes del reinicio del seq 40 de después.
+        self.epoca = "bd" if persistente else uuid.uuid4().hex[:8]
+
+    def registrar(self, evento, datos):
+        if self.persistente:
+            return self._insertar(evento, datos)
+        with self._lock:
+            self._seq += 1
+            self._eventos.append((self._seq, evento, datos))
+            return self._seq
+
+    def _insertar(self, evento, datos):
+        # Por el escritor: varios emits seguidos comparten un commit.
+        def insertar(cursor):
+            cursor.execute("INSERT INTO diario_eventos (evento, datos) VALUES (?, ?)", (evento, json.dumps(datos)))
+            seq = cursor.lastrowid
+            cursor.execute("DELETE FROM diario_eventos WHERE seq <= ?", (seq - self.capacidad,))
+            return seq
+        return escritor.ejecutar(insertar)
+
+    def _leer(self, desde):
+        # (seq actual, seq más viejo disponible, eventos posteriores a desde)
+        if not self.persistente:
+            with self._lock:
+                eventos = [e for e in self._eventos if e[0] > desde]
+                return self._seq, self._eventos[0][0] if self._eventos else self._seq + 1, eventos
+        conn = conectar_bd()
+        try:
+            fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'diario_eventos'").fetchone()
+            actual = fila[0] if fila else 0
+            minimo = conn.execute("SELECT MIN(seq) FROM diario_eventos").fetchone()[0] or actual + 1
+            eventos = [
+                (f["seq"], f["evento"], json.loads(f["datos"]))
+                for f in conn.execute(
+                    "SELECT seq, evento, datos FROM diario_eventos WHERE seq > ? ORDER BY seq", (desde,)
+                )
+            ]
+        finally:
+            conn.close()
+        return actual, minimo, eventos
+
+    def reanudar(self, desde=None, epoca=None):
+        # desde=None: conexión nueva (la página ya está al día), solo se
+        # informa el seq actual.
+        actual, minimo, eventos = self._leer(desde if desde is not None else float("inf"))
+        respuesta = {"epoca": self.epoca, "seq": actual, "eventos": [], "resync": False}
+        if desde is None:
+            return respuesta
+        if epoca != self.epoca or desde > actual or desde < minimo - 1:
+            respuesta["resync"] = True
+            return respuesta
+        ultimos = {evento: seq for seq, evento, _ in eventos if evento in COALESCIBLES}
+        respuesta["eventos"] = [
+            {"seq": seq, "evento": evento, "datos": datos}
+            for seq, evento, datos in eventos
+            if evento not in ultimos or ultimos[evento] == seq
+        ]
+        return respuesta
+
+
+diario = Diario()
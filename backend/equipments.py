@@ -1,27 +1,46 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
-from datetime import datetime
+import heapq
+from datetime import datetime, timedelta
 from flask_socketio import emit
 
 from db import (
+    DB_PATH,
     ejecutar_select,
-    ejecutar_insert,
     ejecutar_update,
     registrar_auditoria,
     recalcular_dvv,
     calcular_dvh,
+    conectar_bd,
+    sumar_dvv,
+    registrar_auditoria_en,
 )
+from metricas import medir
+import cache_consultas
+import escritor
+import flujo_json
+import integridad
+import shards
+from analitica import actualizar_uso, registrar_rechazo
+from ciclo_reservas import planificador as ciclo, RESERVADO, EN_ESPERA, EN_CURSO, FINALIZADA, NO_PRESENTADO, TOLERANCIA
 
 
 import base64
-from cryptography.fernet import Fernet
+from functools import lru_cache
 
 SECRET_KEY = base64.urlsafe_b64encode(b"12345678901234567890123456789012")
-fernet = Fernet(SECRET_KEY)
+
+@lru_cache(maxsize=None)
+def _fernet():
+    # cryptography tarda en importarse; se carga con el primer ID a cifrar.
+    from cryptography.fernet import Fernet
+    return Fernet(SECRET_KEY)
 
 def encode_id(real_id: int) -> str:
-    return fernet.encrypt(str(real_id).encode()).decode()
+    with medir("fernet"):
+        return _fernet().encrypt(str(real_id).encode()).decode()
 def decode_id(hashed: str) -> int:
-    return int(fernet.decrypt(hashed.encode()).decode())
+    with medir("fernet"):
+        return int(_fernet().decrypt(hashed.encode()).decode())
 equipments_bp = Blueprint("equipments_bp", __name__)
 \
 \
@@ -34,7 +53,8 @@ def equipreserve():
         flash("Debes iniciar sesión para acceder.", "error")
         return redirect(url_for("login_bp.login"))
     equipos = ejecutar_select(\
-        "SELECT nombre FROM equipos WHERE estado_logico = 0 ORDER BY nombre ASC"\
+        "SELECT nombre FROM equipos WHERE estado_logico = 0 ORDER BY nombre ASC",\
+        cache=True\
     )
     \
     return render_template("equipreserve/EquipReserve.html", equipos=equipos)
@@ -44,39 +64,38 @@ def equipreserve_events():
     usuario_id = session.get("usuario_id")
     \
 \
-    if rol == "admin":
-        query = """
-            SELECT r.id, r.equipo, r.fecha_inicio, r.fecha_fin, r.estado,
-                   u.nombre as usuario, r.usuario_id
-            FROM reservas_equipos r
-            LEFT JOIN usuarios u ON r.usuario_id = u.id
-            WHERE r.estado_logico = 0
-        """
-        eventos = ejecutar_select(query)
-    else:
-        query = """
-            SELECT r.id, r.equipo, r.fecha_inicio, r.fecha_fin, r.estado,
-                   u.nombre as usuario, r.usuario_id
-            FROM reservas_equipos r
-            LEFT JOIN usuarios u ON r.usuario_id = u.id
-            WHERE r.estado_logico = 0 AND r.usuario_id = ?
-        """
-        eventos = ejecutar_select(query, (usuario_id,))
-    eventos_json = []
-    for e in eventos:
-        color = "#1a237e" if e["usuario"] == session["nombre"] else "#90a4ae"
-        \
-        eventos_json.append({\
-            "id": encode_id(e["id"]),\
-            "rid": encode_id(e["id"]),\
-            "title": f"{e['equipo']} ({e['usuario']})",\
+    filtro, parametros = ("", ()) if rol == "admin" else ("AND r.usuario_id = ?", (usuario_id,))
+    query = f"""
+        SELECT r.id, r.equipo, r.fecha_inicio, r.fecha_fin, r.estado,
+               u.nombre as usuario, r.usuario_id
+        FROM reservas_equipos r
+        LEFT JOIN usuarios u ON r.usuario_id = u.id
+        WHERE r.estado_logico = 0 {filtro}
+    """
+    nombre = session.get("nombre")
+
+    def evento(e):
+        color = "#1a237e" if e["usuario"] == nombre else "#90a4ae"
+        if e["estado"] in (FINALIZADA, NO_PRESENTADO):
+            color = "#cfd8dc"
+        titulo = f"{e['equipo']} ({e['usuario']})"
+        if e["estado"] not in RESERVADO:
+            titulo += f" · {e['estado']}"
+        rid = encode_id(e["id"])
+        return {\
+            "id": rid,\
+            "rid": rid,\
+            "title": titulo,\
+            "estado": e["estado"],\
             "start": e["fecha_inicio"],\
             "end": e["fecha_fin"],\
             "color": color,\
             "textColor": "#fff",\
             "usuario_id": e["usuario_id"]\
-        })
-    return jsonify(eventos_json)
+        }
+    # Un shard detrás del otro, en streaming: el calendario no necesita
+    # orden y así no se juntan todas las reservas en memoria.
+    return flujo_json.responder([(ruta, query, parametros) for ruta in shards.todas()], evento)
 @equipments_bp.route("/equipreserve/add", methods=["POST"])
 def add_reserva():
     equipo = request.form.get("equipo")
@@ -87,23 +106,15 @@ def add_reserva():
     if not equipo or not fecha_inicio or not fecha_fin:
         flash("Todos los campos son obligatorios.", "error")
         return redirect(url_for("equipments_bp.equipreserve"))
-    conflicto = ejecutar_select("""
-        SELECT * FROM reservas_equipos
-        WHERE estado_logico = 0 AND equipo = ?
-        AND (
-            (? BETWEEN fecha_inicio AND fecha_fin) OR
-            (? BETWEEN fecha_inicio AND fecha_fin)
-        )
-    """, (equipo, fecha_inicio, fecha_fin))
-    \
-    if conflicto:
-        flash(f"El equipo '{equipo}' ya está reservado en ese horario.", "error")
+    if request.form.get("frecuencia"):
+        return bulk_reserva()
+    if fecha_fin <= fecha_inicio:
+        flash("El fin de la reserva debe ser posterior al inicio.", "error")
         return redirect(url_for("equipments_bp.equipreserve"))
-    new_id = ejecutar_insert("""
-        INSERT INTO reservas_equipos (equipo, fecha_inicio, fecha_fin, usuario_id, estado, dvh)
-        VALUES (?, ?, ?, ?, 'Reservado', 0)
-    """, (equipo, fecha_inicio, fecha_fin, usuario_id))
-    \
+    # Todas las reservas de un equipo están en el mismo shard, así que el
+    # control de superposición no necesita mirar los demás.
+    bd = shards.bd_de_equipo(equipo)
+    ip_origen = request.remote_addr
     datos_reserva = {\
         "equipo": equipo,\
         "fecha_inicio": fecha_inicio,\
@@ -111,15 +122,40 @@ def add_reserva():
         "usuario_id": usuario_id,\
         "estado": "Reservado"\
     }
-    \
     nuevo_dvh = calcular_dvh(datos_reserva)
-    ejecutar_update("UPDATE reservas_equipos SET dvh=? WHERE id=?", (nuevo_dvh, new_id))
     \
-    registrar_auditoria(\
-        usuario_id, "CREAR RESERVA", "reservas_equipos", new_id, request.remote_addr\
-    )
+    # El control de superposición corre en el mismo trabajo del escritor
+    # que el alta: entre los dos no se puede colar otra reserva. Intervalos
+    # semiabiertos, como en reservar_lote: un turno que termina a las 10 no
+    # choca con otro que empieza a las 10.
+    def reservar(cursor):
+        cursor.execute("""
+            SELECT 1 FROM reservas_equipos
+            WHERE estado_logico = 0 AND equipo = ?
+            AND fecha_inicio < ? AND fecha_fin > ?
+            LIMIT 1
+        """, (equipo, fecha_fin, fecha_inicio))
+        if cursor.fetchone():
+            return None
+        cursor.execute("""
+            INSERT INTO reservas_equipos (equipo, fecha_inicio, fecha_fin, usuario_id, estado, dvh)
+            VALUES (?, ?, ?, ?, 'Reservado', ?)
+        """, (equipo, fecha_inicio, fecha_fin, usuario_id, nuevo_dvh))
+        new_id = cursor.lastrowid
+        sumar_dvv(cursor, "reservas_equipos", nuevo_dvh)
+        if bd is None:
+            registrar_auditoria_en(cursor, usuario_id, "CREAR RESERVA", "reservas_equipos", new_id, ip_origen)
+        return new_id
+    new_id = escritor.ejecutar(reservar, bd=bd)
     \
-    recalcular_dvv("reservas_equipos")
+    if new_id is None:
+        registrar_rechazo(equipo, fecha_inicio)
+        flash(f"El equipo '{equipo}' ya está reservado en ese horario.", "error")
+        return redirect(url_for("equipments_bp.equipreserve"))
+    if bd is not None:
+        registrar_auditoria(usuario_id, "CREAR RESERVA", "reservas_equipos", new_id, ip_origen)
+    actualizar_uso([(equipo, fecha_inicio, fecha_fin, 1)])
+    ciclo.programar(bd, new_id, fecha_inicio, fecha_fin)
     \
     from servidor import socketio
     socketio.emit("refresh_calendar", {})
@@ -134,7 +170,8 @@ def get_reserva(rid):
         return jsonify({"error": "ID no válido"}), 400
     data = ejecutar_select(\
         "SELECT equipo, fecha_inicio, fecha_fin FROM reservas_equipos WHERE id=?",\
-        (real_id,)\
+        (real_id,),\
+        bd=shards.bd_de_id("reservas_equipos", real_id)\
     )
     \
     if not data:
@@ -150,28 +187,109 @@ def edit_reserva(rid):
     equipo = request.form.get("equipo")
     inicio = request.form.get("fecha_inicio")
     fin = request.form.get("fecha_fin")
+    bd = shards.bd_de_id("reservas_equipos", real_id)
     \
-    ejecutar_update("""
-        UPDATE reservas_equipos
-        SET equipo=?, fecha_inicio=?, fecha_fin=?
-        WHERE id=?
-    """, (equipo, inicio, fin, real_id))
-    \
-    recalcular_dvv("reservas_equipos")
+    anterior = ejecutar_select(\
+        "SELECT equipo, fecha_inicio, fecha_fin FROM reservas_equipos WHERE id=? AND estado_logico = 0",\
+        (real_id,),\
+        bd=bd\
+    )
+    destino = shards.bd_de_equipo(equipo)
+    if anterior and destino != bd:
+        # Equipo de otro laboratorio: la reserva se muda de shard.
+        shards.mover("reservas_equipos", real_id, bd, destino)
+        bd = destino
+    # Un turno movido empieza su ciclo de nuevo: si estaba "Finalizada",
+    # "No presentado" o "En curso", vuelve a "Reservado" (el planificador
+    # solo avanza las vigentes). El DVH se ajusta por diferencia, como en el
+    # check-in.
+    def editar(cursor):
+        fila = cursor.execute(
+            "SELECT equipo, fecha_inicio, fecha_fin, estado, dvh FROM reservas_equipos WHERE id = ?", (real_id,)
+        ).fetchone()
+        if fila is None:
+            return
+        nuevos = (equipo, inicio, fin, RESERVADO[0])
+        dvh = fila["dvh"]
+        if dvh is not None:
+            dvh += sum(len(str(nuevo)) - len(str(viejo)) for nuevo, viejo in zip(nuevos, tuple(fila)[:4]))
+        cursor.execute("""
+            UPDATE reservas_equipos
+            SET equipo=?, fecha_inicio=?, fecha_fin=?, estado=?, dvh=?
+            WHERE id=?
+        """, nuevos + (dvh, real_id))
+        sumar_dvv(cursor, "reservas_equipos", 0 if dvh is None else dvh - fila["dvh"])
+    escritor.ejecutar(editar, bd=bd)
+    if anterior:
+        a = anterior[0]
+        actualizar_uso([(a["equipo"], a["fecha_inicio"], a["fecha_fin"], -1), (equipo, inicio, fin, 1)])
+    ciclo.programar(bd, real_id, inicio, fin)
 
     from servidor import socketio
     socketio.emit("refresh_calendar", {})
 
     flash("Reserva editada correctamente.", "success")
     return redirect(url_for("equipments_bp.equipreserve"))
+@equipments_bp.route("/equipreserve/checkin/<string:rid>", methods=["POST"])
+def checkin_reserva(rid):
+    # Confirma que el usuario llegó: sin esto, pasada la tolerancia la
+    # reserva queda "No presentado" y se libera (ver ciclo_reservas.py).
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    try:
+        real_id = decode_id(rid)
+    except Exception:
+        return jsonify({"error": "ID no válido"}), 400
+    bd = shards.bd_de_id("reservas_equipos", real_id)
+    usuario_id = session["usuario_id"]
+    es_admin = session.get("rol") == "admin"
+    ip_origen = request.remote_addr
+    ahora = datetime.now()
+    \
+    def confirmar(cursor):
+        # Se puede llegar hasta TOLERANCIA antes del inicio.
+        fila = cursor.execute("""
+            SELECT estado, usuario_id, dvh FROM reservas_equipos
+            WHERE id = ? AND estado_logico = 0 AND fecha_inicio <= ? AND fecha_fin > ?
+        """, (real_id, (ahora + TOLERANCIA).strftime("%Y-%m-%dT%H:%M:%S"), ahora.strftime("%Y-%m-%dT%H:%M:%S"))).fetchone()
+        if fila is None or fila["estado"] not in RESERVADO + (EN_ESPERA,):
+            return "fuera_de_horario"
+        if not es_admin and fila["usuario_id"] != usuario_id:
+            return "ajena"
+        dvh = fila["dvh"]
+        if dvh is not None:
+            dvh += len(EN_CURSO) - len(fila["estado"])
+        cursor.execute("UPDATE reservas_equipos SET estado = ?, dvh = ? WHERE id = ?", (EN_CURSO, dvh, real_id))
+        sumar_dvv(cursor, "reservas_equipos", 0 if dvh is None else dvh - fila["dvh"])
+        if bd is None:
+            registrar_auditoria_en(cursor, usuario_id, "CHECK-IN RESERVA", "reservas_equipos", real_id, ip_origen)
+        return "ok"
+    resultado = escritor.ejecutar(confirmar, bd=bd)
+    \
+    if resultado == "ajena":
+        return jsonify({"error": "Solo quien reservó puede hacer el check-in."}), 403
+    if resultado != "ok":
+        return jsonify({"error": "La reserva no está esperando check-in."}), 409
+    if bd is not None:
+        registrar_auditoria(usuario_id, "CHECK-IN RESERVA", "reservas_equipos", real_id, ip_origen)
+    \
+    from servidor import socketio
+    socketio.emit("refresh_calendar", {})
+    return jsonify({"estado": EN_CURSO})
 @equipments_bp.route("/equipreserve/delete/<string:rid>", methods=["POST"])
 def delete_reserva(rid):
     if session.get("rol") != "admin":
         flash("Solo los administradores pueden eliminar reservas.", "error")
         return redirect(url_for("equipments_bp.equipreserve"))
     real_id = decode_id(rid)
+    bd = shards.bd_de_id("reservas_equipos", real_id)
     \
-    ejecutar_update("UPDATE reservas_equipos SET estado_logico = 1 WHERE id=?", (real_id,))
+    anterior = ejecutar_select(\
+        "SELECT equipo, fecha_inicio, fecha_fin FROM reservas_equipos WHERE id=? AND estado_logico = 0",\
+        (real_id,),\
+        bd=bd\
+    )
+    ejecutar_update("UPDATE reservas_equipos SET estado_logico = 1 WHERE id=?", (real_id,), bd=bd)
     \
     registrar_auditoria(\
         session["usuario_id"],\
@@ -181,10 +299,232 @@ def delete_reserva(rid):
         request.remote_addr\
     )
     \
-    recalcular_dvv("reservas_equipos")
+    recalcular_dvv("reservas_equipos", bd)
+    if anterior:
+        a = anterior[0]
+        actualizar_uso([(a["equipo"], a["fecha_inicio"], a["fecha_fin"], -1)])
 
     from servidor import socketio
     socketio.emit("refresh_calendar", {})
 
     flash("Reserva eliminada correctamente.", "success")
     return redirect(url_for("equipments_bp.equipreserve"))
+# ========================================
+#  RESERVAS RECURRENTES Y EN LOTE
+# ========================================
+# Todas las ocurrencias se validan juntas (una consulta por equipo y un
+# barrido sobre los intervalos ordenados) y se guardan todas o ninguna en
+# una sola transacción, con una auditoría y un único refresh_calendar.
+FRECUENCIAS = {"diaria": timedelta(days=1), "semanal": timedelta(weeks=1)}
+MAX_OCURRENCIAS = 500
+FORMATO = "%Y-%m-%dT%H:%M"
+
+
+def expandir_recurrencia(fecha_inicio, fecha_fin, frecuencia, intervalo=1, hasta=None, cantidad=None):
+    # Devuelve [(inicio, fin), ...] en el formato de datetime-local. Corta
+    # en `hasta` (fecha inclusive) o a las `cantidad` ocurrencias.
+    if frecuencia not in FRECUENCIAS:
+        raise ValueError("La frecuencia debe ser 'diaria' o 'semanal'.")
+    if not hasta and not cantidad:
+        raise ValueError("Indicá hasta cuándo o cuántas veces se repite.")
+    inicio = datetime.fromisoformat(fecha_inicio)
+    duracion = datetime.fromisoformat(fecha_fin) - inicio
+    if duracion <= timedelta(0):
+        raise ValueError("La fecha de fin debe ser posterior a la de inicio.")
+    paso = FRECUENCIAS[frecuencia] * max(1, int(intervalo))
+    limite = datetime.fromisoformat(hasta).date() if hasta else None
+    ocurrencias = []
+    while (not cantidad or len(ocurrencias) < int(cantidad)) and (not limite or inicio.date() <= limite):
+        if len(ocurrencias) >= MAX_OCURRENCIAS:
+            raise ValueError(f"La recurrencia supera las {MAX_OCURRENCIAS} reservas.")
+        ocurrencias.append((inicio.strftime(FORMATO), (inicio + duracion).strftime(FORMATO)))
+        inicio += paso
+    return ocurrencias
+
+
+def _conflictos(existentes, nuevas):
+    # Barrido por inicio con un heap de intervalos activos: cada intervalo
+    # choca con los activos al momento de empezar. Solo interesan los
+    # choques en los que participa alguna reserva nueva.
+    intervalos = sorted(
+        [(r["fecha_inicio"], r["fecha_fin"], "existente", i) for i, r in enumerate(existentes)]
+        + [(ini, fin, "nueva", i) for i, (ini, fin) in enumerate(nuevas)]
+    )
+    activos, choques = [], []
+    for ini, fin, origen, i in intervalos:
+        while activos and activos[0][0] <= ini:
+            heapq.heappop(activos)
+        for _, otro_ini, otro_fin, otro_origen, _ in activos:
+            if "nueva" in (origen, otro_origen):
+                choques.append({
+                    "fecha_inicio": otro_ini if origen == "existente" else ini,
+                    "fecha_fin": otro_fin if origen == "existente" else fin,
+                    "con": "existente" if "existente" in (origen, otro_origen) else "lote",
+                })
+        heapq.heappush(activos, (fin, ini, fin, origen, i))
+    return choques
+
+
+def _conflictos_en(cursor, equipos, por_equipo):
+    conflictos = []
+    for equipo in equipos:
+        nuevas = por_equipo[equipo]
+        existentes = cursor.execute("""
+            SELECT fecha_inicio, fecha_fin FROM reservas_equipos
+            WHERE estado_logico = 0 AND equipo = ? AND fecha_inicio < ? AND fecha_fin > ?
+        """, (equipo, max(f for _, f in nuevas), min(i for i, _ in nuevas))).fetchall()
+        conflictos += [dict(c, equipo=equipo) for c in _conflictos(existentes, nuevas)]
+    return conflictos
+
+
+def _insertar_en(cursor, bd, equipos, por_equipo, usuario_id):
+    # Devuelve [(bd, id, inicio, fin), ...] de las reservas insertadas.
+    insertadas, suma = [], 0
+    for equipo in equipos:
+        for ini, fin in por_equipo[equipo]:
+            dvh = calcular_dvh({
+                "equipo": equipo,
+                "fecha_inicio": ini,
+                "fecha_fin": fin,
+                "usuario_id": usuario_id,
+                "estado": "Reservado",
+            })
+            cursor.execute("""
+                INSERT INTO reservas_equipos (equipo, fecha_inicio, fecha_fin, usuario_id, estado, dvh)
+                VALUES (?, ?, ?, ?, 'Reservado', ?)
+                RETURNING id
+            """, (equipo, ini, fin, usuario_id, dvh))
+            insertadas.append((bd, cursor.fetchone()[0], ini, fin))
+            suma += dvh
+    sumar_dvv(cursor, "reservas_equipos", suma)
+    return insertadas
+
+
+def reservar_lote(reservas, usuario_id, ip_origen):
+    # reservas: [(equipo, inicio, fin), ...]. Devuelve (ids, conflictos);
+    # si hay conflictos no se guarda nada.
+    for equipo, ini, fin in reservas:
+        if not equipo or not ini or not fin or fin <= ini:
+            raise ValueError("Cada reserva necesita equipo, inicio y un fin posterior al inicio.")
+    if not 1 <= len(reservas) <= MAX_OCURRENCIAS:
+        raise ValueError(f"Se pueden reservar entre 1 y {MAX_OCURRENCIAS} turnos por vez.")
+
+    por_equipo = {}
+    for equipo, ini, fin in reservas:
+        por_equipo.setdefault(equipo, []).append((ini, fin))
+    por_bd = {}
+    for equipo in por_equipo:
+        por_bd.setdefault(shards.bd_de_equipo(equipo), []).append(equipo)
+
+    accion = f"CREAR RESERVAS ({len(reservas)})"
+    if len(por_bd) == 1:
+        # Caso común (sin sharding, o todos los equipos del mismo
+        # laboratorio): control y alta en un trabajo del escritor.
+        [(bd, equipos)] = por_bd.items()
+
+        def lote(cursor):
+            conflictos = _conflictos_en(cursor, equipos, por_equipo)
+            if conflictos:
+                return [], conflictos
+            insertadas = _insertar_en(cursor, bd, equipos, por_equipo, usuario_id)
+            if bd is None:
+                registrar_auditoria_en(cursor, usuario_id, accion, "reservas_equipos", insertadas[0][1], ip_origen)
+            return insertadas, []
+        programadas, conflictos = escritor.ejecutar(lote, bd=bd)
+    else:
+        programadas, conflictos = _reservar_en_varios(por_bd, por_equipo, usuario_id, ip_origen, accion)
+
+    if conflictos:
+        for c in conflictos:
+            registrar_rechazo(c["equipo"], c["fecha_inicio"])
+        return [], conflictos
+    ids = [rid for _, rid, _, _ in programadas]
+    if None not in por_bd:
+        registrar_auditoria(usuario_id, accion, "reservas_equipos", ids[0], ip_origen)
+    actualizar_uso([(equipo, ini, fin, 1) for equipo, ini, fin in reservas])
+    for bd, rid, ini, fin in programadas:
+        ciclo.programar(bd, rid, ini, fin)
+    return ids, []
+
+
+def _reservar_en_varios(por_bd, por_equipo, usuario_id, ip_origen, accion):
+    # Lote con equipos de varios laboratorios (sharding): todo o nada entre
+    # archivos distintos, que el escritor (un hilo por archivo) no puede
+    # dar. Una transacción propia por archivo, con los locks tomados
+    # siempre en el mismo orden; la cache de consultas se invalida a mano.
+    conexiones = {bd: conectar_bd(bd, adjuntar_global=False) for bd in sorted(por_bd, key=lambda b: b or "")}
+    escritas = set()
+    programadas = []
+    try:
+        for bd, conn in conexiones.items():
+            escritas |= cache_consultas.vigilar(conn, bd or DB_PATH)
+            conn.execute("BEGIN IMMEDIATE")
+            integridad.abrir_escritura(conn)
+        conflictos = []
+        for bd, equipos in por_bd.items():
+            conflictos += _conflictos_en(conexiones[bd].cursor(), equipos, por_equipo)
+        if conflictos:
+            for conn in conexiones.values():
+                conn.rollback()
+            return [], conflictos
+        for bd, equipos in por_bd.items():
+            programadas += _insertar_en(conexiones[bd].cursor(), bd, equipos, por_equipo, usuario_id)
+        if None in conexiones:
+            registrar_auditoria_en(conexiones[None].cursor(), usuario_id, accion,
+                                   "reservas_equipos", programadas[0][1], ip_origen)
+        for conn in conexiones.values():
+            integridad.cerrar_escritura(conn)
+            conn.commit()
+    except Exception:
+        for conn in conexiones.values():
+            conn.rollback()
+        raise
+    finally:
+        for conn in conexiones.values():
+            conn.close()
+    cache_consultas.invalidar(escritas)
+    return programadas, []
+
+
+@equipments_bp.route("/equipreserve/bulk", methods=["POST"])
+def bulk_reserva():
+    # JSON: {"reservas": [{"equipo", "fecha_inicio", "fecha_fin"}, ...]}
+    #   o   {"equipo", "fecha_inicio", "fecha_fin",
+    #        "recurrencia": {"frecuencia", "intervalo", "hasta" | "cantidad"}}
+    # También lo usa el formulario de nueva reserva cuando se pide repetir.
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    es_json = request.is_json
+    datos = request.get_json(silent=True) or {}
+    try:
+        if es_json and "reservas" in datos:
+            reservas = [(r.get("equipo"), r.get("fecha_inicio"), r.get("fecha_fin")) for r in datos["reservas"]]
+        else:
+            if not es_json:
+                datos = request.form
+                regla = {k: datos.get(k) for k in ("frecuencia", "intervalo", "hasta", "cantidad") if datos.get(k)}
+            else:
+                regla = datos.get("recurrencia") or {}
+            equipo = datos.get("equipo")
+            ocurrencias = expandir_recurrencia(datos.get("fecha_inicio"), datos.get("fecha_fin"), **regla)
+            reservas = [(equipo, ini, fin) for ini, fin in ocurrencias]
+        ids, conflictos = reservar_lote(reservas, session["usuario_id"], request.remote_addr)
+    except (ValueError, TypeError) as e:
+        if es_json:
+            return jsonify({"error": str(e)}), 400
+        flash(str(e), "error")
+        return redirect(url_for("equipments_bp.equipreserve"))
+
+    if conflictos:
+        if es_json:
+            return jsonify({"error": "Hay turnos superpuestos; no se reservó ninguno.", "conflictos": conflictos}), 409
+        primeros = ", ".join(c["fecha_inicio"].replace("T", " ") for c in conflictos[:3])
+        flash(f"{len(conflictos)} turnos se superponen con otras reservas ({primeros}...). No se reservó ninguno.", "error")
+        return redirect(url_for("equipments_bp.equipreserve"))
+
+    from servidor import socketio
+    socketio.emit("refresh_calendar", {})
+    if es_json:
+        return jsonify({"creadas": len(ids), "ids": [encode_id(i) for i in ids]}), 201
+    flash(f"Se reservaron {len(ids)} turnos.", "success")
+    return redirect(url_for("equipments_bp.equipreserve"))
@@ -0,0 +1,260 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import cache_consultas
+import integridad
+import metricas
+
+
+# ========================================
+#  ESCRITOR ÚNICO POR ARCHIVO
+# ========================================
+# SQLite admite un solo escritor por archivo. Cuando los requests, los hilos
+# de post-proceso y los recálculos del admin abrían cada uno su transacción,
+# se peleaban el lock y las que esperaban más de DB_TIMEOUT terminaban en
+# "database is locked".
+#
+# Ahora cada archivo (la BD compartida y cada shard) tiene un hilo escritor
+# dueño de la única conexión de escritura del proceso. Escribir es mandarle
+# un trabajo: una función que recibe un cursor ya dentro de la transacción
+# y NO hace commit.
+#
+# - Group commit: el hilo toma los trabajos que ya estén esperando (hasta
+#   MAX_LOTE) y los confirma en una sola transacción. Cada uno corre en su
+#   SAVEPOINT: si falla se deshace solo ese y los demás se confirman.
+# - enviar() devuelve un Future que se resuelve después del COMMIT;
+#   ejecutar() lo espera y devuelve el resultado del trabajo (o relanza su
+#   excepción).
+# - Contrapresión: la cola tiene tope. Si está llena el llamador espera
+#   hasta DB_TIMEOUT y después recibe EscritorSaturado.
+# - Un trabajo que vuelve a escribir en el mismo archivo (p. ej. llama a
+#   ejecutar_insert) corre directo dentro de la transacción en curso.
+# - Métricas: enviar() se lleva la medición del request que encarga el
+#   trabajo y sus sentencias, filas y tiempo se le suman a ese request
+#   (SQL/req y la columna "escritor" de /admin/metricas).
+# - Cada transacción va dentro de una sesión de escritura de integridad.py:
+#   los bloques que tocan los trabajos se pliegan en el árbol de Merkle y
+#   los que quedaron pendientes de antes se informan como sospechosos.
+#
+# Las lecturas siguen con sus conexiones propias (WAL). Entre procesos
+# distintos sigue mediando busy_timeout. Solo las transacciones que abarcan
+# varios archivos a la vez no pasan por acá, porque cada escritor es dueño
+# de un solo archivo. Esas transacciones abren su propia conexión, su
+# sesión de integridad en cada BD que escriben e invalidan la cache a mano
+# con cache_consultas.vigilar()/invalidar():
+# - reservar_lote con equipos de varios laboratorios;
+# - alícuotas en un shard (la clausura va a la BD compartida);
+# - shards.mover().
+# Tampoco pasan por acá la creación del esquema y la migración a shards
+# (al arrancar / por consola) ni la restauración de respaldos, que vacía
+# la cache entera.
+ACTIVO = os.environ.get("BIOLABHUB_ESCRITOR", "1") != "0"
+MAX_COLA = int(os.environ.get("BIOLABHUB_ESCRITOR_COLA", "1000"))
+MAX_LOTE = int(os.environ.get("BIOLABHUB_ESCRITOR_LOTE", "64"))
+# Reintentos de BEGIN/COMMIT cuando el lock lo tiene otro proceso.
+REINTENTOS = 10
+
+
+class EscritorSaturado(sqlite3.OperationalError):
+    pass
+
+
+def _ocupado(error):
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+
+class Escritor:
+    def __init__(self, ruta=None):
+        self.ruta = ruta
+        self.trabajos = 0
+        self.transacciones = 0
+        self._cola = queue.Queue(MAX_COLA)
+        self._conn = None
+        self._hilo = threading.Thread(
+            target=self._bucle, name=f"escritor-{os.path.basename(ruta) if ruta else 'global'}", daemon=True
+        )
+        self._hilo.start()
+
+    # ---------- productores ----------
+    def enviar(self, funcion, *args, agrupable=True):
+        futuro = Future()
+        if threading.current_thread() is self._hilo:
+            try:
+                futuro.set_result(funcion(self._conn.cursor(), *args))
+            except Exception as e:
+                futuro.set_exception(e)
+            return futuro
+        from db import DB_TIMEOUT
+        try:
+            self._cola.put((funcion, args, futuro, agrupable, metricas.medicion_actual()), timeout=DB_TIMEOUT)
+        except queue.Full:
+            metricas.incrementar("escritor_saturado")
+            raise EscritorSaturado(f"La cola de escritura está llena ({MAX_COLA} trabajos pendientes).")
+        return futuro
+
+    def pendientes(self):
+        return self._cola.qsize()
+
+    # ---------- hilo escritor ----------
+    def _bucle(self):
+        siguiente = None
+        while True:
+            lote = [siguiente or self._cola.get()]
+            siguiente = None
+            # Un trabajo no agrupable (largo, como recalcular una tabla
+            # entera) va solo en su transacción.
+            while lote[0][3] and len(lote) < MAX_LOTE:
+                try:
+                    trabajo = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                if not trabajo[3]:
+                    siguiente = trabajo
+                    break
+                lote.append(trabajo)
+            try:
+                self._correr(lote)
+            except Exception as e:
+                print("Error en el escritor de la base de datos:", e)
+                for _, _, futuro, _, _ in lote:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                self._reconectar()
+
+    def _conectar(self):
+        from db import conectar_bd
+        if self._conn is None:
+            conn = conectar_bd(self.ruta, adjuntar_global=False)
+            if conn is None:
+                raise sqlite3.OperationalError("No se pudo abrir la conexión de escritura.")
+            # Las transacciones se abren y cierran a mano.
+            conn.isolation_level = None
+            self._conn = metricas.instrumentar_escritor(conn)
+        return self._conn
+
+    def _archivo(self):
+        from db import DB_PATH
+        return self.ruta or DB_PATH
+
+    def _reconectar(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+        self._conn = None
+
+    def _con_reintentos(self, conn, sentencia):
+        for intento in range(REINTENTOS):
+            try:
+                conn.execute(sentencia)
+                return
+            except sqlite3.OperationalError as e:
+                if not _ocupado(e) or intento == REINTENTOS - 1:
+                    raise
+                metricas.incrementar("escritor_reintentos")
+                time.sleep(0.05 * (intento + 1))
+
+    def _correr(self, lote):
+        conn = self._conectar()
+        escritas = cache_consultas.vigilar(conn, self._archivo())
+        self._con_reintentos(conn, "BEGIN IMMEDIATE")
+        resultados = []
+        try:
+            integridad.abrir_escritura(conn)
+            for funcion, args, futuro, _, medicion in lote:
+                conn.execute("SAVEPOINT trabajo")
+                try:
+                    with metricas.atribuir(medicion):
+                        resultados.append((futuro, funcion(conn.cursor(), *args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO trabajo")
+                    resultados.append((futuro, None, e))
+                conn.execute("RELEASE trabajo")
+            integridad.cerrar_escritura(conn)
+            self._con_reintentos(conn, "COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        # Recién confirmado: las lecturas en cache de esas tablas ya son viejas.
+        cache_consultas.invalidar(escritas)
+        self.trabajos += len(lote)
+        self.transacciones += 1
+        metricas.incrementar("escritor_trabajos", len(lote))
+        metricas.incrementar("escritor_transacciones")
+        for futuro, resultado, error in resultados:
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(resultado)
+
+
+# ========================================
+#  API
+# ========================================
+_escritores = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def escritor_de(bd=None):
+    global _pid
+    from db import DB_PATH
+    ruta = None if bd == DB_PATH else bd
+    with _lock:
+        if _pid != os.getpid():
+            # Proceso hijo (fork de gunicorn): los hilos del padre no existen acá.
+            _escritores.clear()
+            _pid = os.getpid()
+        if ruta not in _escritores:
+            _escritores[ruta] = Escritor(ruta)
+        return _escritores[ruta]
+
+
+def enviar(funcion, *args, bd=None, agrupable=True):
+    return escritor_de(bd).enviar(funcion, *args, agrupable=agrupable)
+
+
+def ejecutar(funcion, *args, bd=None, agrupable=True):
+    # funcion(cursor, *args) dentro de una transacción; devuelve lo que
+    # devuelva funcion una vez confirmado.
+    if not ACTIVO:
+        return _ejecutar_directo(funcion, args, bd)
+    return enviar(funcion, *args, bd=bd, agrupable=agrupable).result()
+
+
+def _ejecutar_directo(funcion, args, bd):
+    # BIOLABHUB_ESCRITOR=0: cada llamador con su conexión, como antes.
+    from db import conectar_bd, DB_PATH
+    conn = conectar_bd(bd, adjuntar_global=False)
+    escritas = cache_consultas.vigilar(conn, bd or DB_PATH)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        integridad.abrir_escritura(conn)
+        with metricas.medir("escritor"):
+            resultado = funcion(conn.cursor(), *args)
+        integridad.cerrar_escritura(conn)
+        conn.commit()
+        cache_consultas.invalidar(escritas)
+        return resultado
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def estado():
+    with _lock:
+        return {
+            os.path.basename(ruta) if ruta else "global": {
+                "pendientes": e.pendientes(), "trabajos": e.trabajos, "transacciones": e.transacciones,
+            }
+            for ruta, e in _escritores.items()
+        }
@@ -0,0 +1,216 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import time
+
+from flask import current_app, request, send_from_directory
+
+from db import BASE_DIR
+
+
+# ========================================
+#  ESTÁTICOS CON HUELLA
+# ========================================
+# Al arrancar se recorre frontend/static y cada archivo se copia a DIST con
+# el hash de su contenido en el nombre (socket.js -> socket.3f2a9c1b0d4e.js),
+# junto con una versión .gz si comprime. url_for('static', ...) devuelve
+# siempre el nombre con huella, así que esas URLs se pueden cachear para
+# siempre: si el archivo cambia, cambia la URL.
+#
+# - Los url() de los CSS se reescriben a los nombres con huella.
+# - Con BIOLABHUB_STATIC_ANCHOS="320,640" y Pillow instalado se generan
+#   además versiones reducidas de PNG/JPG (asset_srcset() en las plantillas).
+# - En producción conviene que nginx sirva DIST directo (ver produccion.py)
+#   y los workers de Python no vean esos requests; sin nginx los sirve
+#   servir() con cache inmutable y el .gz ya comprimido.
+#
+# Lo ya generado no se vuelve a escribir: un arranque sin cambios solo
+# hashea los archivos.
+DIST = os.environ.get("BIOLABHUB_STATIC_DIST", os.path.join(BASE_DIR, "frontend", "static_dist"))
+ANCHOS = tuple(int(a) for a in os.environ.get("BIOLABHUB_STATIC_ANCHOS", "").split(",") if a.strip())
+COMPRIMIBLES = (".css", ".js", ".svg", ".ico", ".json", ".txt", ".html")
+IMAGENES = (".png", ".jpg", ".jpeg")
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+# Las versiones viejas se conservan un tiempo para las páginas ya abiertas
+# (o los workers que todavía no reiniciaron) que las siguen pidiendo.
+CONSERVAR_VIEJOS_SEG = 7 * 86400
+
+_URL_CSS = re.compile(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)")
+
+manifiesto = {"archivos": {}, "gzip": [], "variantes": {}}
+_servibles = set()
+_con_gzip = set()
+
+
+def _con_huella(ruta, huella, sufijo=""):
+    base, ext = posixpath.splitext(ruta)
+    return f"{base}.{huella}{sufijo}{ext}"
+
+
+def _escribir(ruta, datos):
+    if os.path.exists(ruta):
+        os.utime(ruta)
+        return
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(datos)
+    os.replace(temporal, ruta)
+
+
+def _reescribir_css(ruta, datos, archivos):
+    carpeta = posixpath.dirname(ruta)
+
+    def reemplazar(m):
+        ref = m.group(2).strip()
+        if ref.startswith(("data:", "http:", "https:", "//", "#")):
+            return m.group(0)
+        limpia = ref.split("?")[0].split("#")[0]
+        if limpia.startswith("/static/"):
+            destino = archivos.get(limpia[len("/static/"):])
+            return f"url('/static/{destino}')" if destino else m.group(0)
+        destino = archivos.get(posixpath.normpath(posixpath.join(carpeta, limpia)))
+        return f"url('{posixpath.relpath(destino, carpeta or '.')}')" if destino else m.group(0)
+
+    return _URL_CSS.sub(reemplazar, datos.decode("utf-8")).encode("utf-8")
+
+
+def _variantes(ruta, datos, huella, destino):
+    # Pillow es opcional: sin él no hay versiones reducidas.
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    imagen = Image.open(io.BytesIO(datos))
+    anchos = {}
+    for ancho in ANCHOS:
+        if ancho >= imagen.width:
+            continue
+        nombre = _con_huella(ruta, huella, f".w{ancho}")
+        archivo = os.path.join(destino, nombre)
+        if not os.path.exists(archivo):
+            reducida = imagen.resize((ancho, round(imagen.height * ancho / imagen.width)), Image.LANCZOS)
+            salida = io.BytesIO()
+            reducida.save(salida, format=imagen.format, optimize=True)
+            _escribir(archivo, salida.getvalue())
+        else:
+            os.utime(archivo)
+        anchos[ancho] = nombre
+    return {"ancho": imagen.width, "anchos": anchos}
+
+
+def construir(origen, destino=DIST):
+    archivos, con_gzip, variantes = {}, [], {}
+    rutas = []
+    for raiz, _, nombres in os.walk(origen):
+        for nombre in nombres:
+            rutas.append(os.path.relpath(os.path.join(raiz, nombre), origen).replace(os.sep, "/"))
+    # Los CSS al final: sus url() apuntan a los nombres con huella del resto.
+    for ruta in sorted(rutas, key=lambda r: (r.endswith(".css"), r)):
+        with open(os.path.join(origen, ruta), "rb") as f:
+            datos = f.read()
+        if ruta.endswith(".css"):
+            datos = _reescribir_css(ruta, datos, archivos)
+        huella = hashlib.sha256(datos).hexdigest()[:12]
+        final = _con_huella(ruta, huella)
+        archivo = os.path.join(destino, final)
+        _escribir(archivo, datos)
+        archivos[ruta] = final
+
+        extension = posixpath.splitext(ruta)[1].lower()
+        if extension in COMPRIMIBLES:
+            if os.path.exists(archivo + ".gz"):
+                os.utime(archivo + ".gz")
+                con_gzip.append(final)
+            else:
+                comprimido = gzip.compress(datos, 9, mtime=0)
+                # Si no ahorra al menos un 10 % no vale el Content-Encoding.
+                if len(comprimido) < len(datos) * 0.9:
+                    _escribir(archivo + ".gz", comprimido)
+                    con_gzip.append(final)
+        if ANCHOS and extension in IMAGENES:
+            reducidas = _variantes(ruta, datos, huella, destino)
+            if reducidas:
+                variantes[ruta] = reducidas
+
+    nuevo = {"archivos": archivos, "gzip": con_gzip, "variantes": variantes}
+    _escribir_manifiesto(destino, nuevo)
+    _podar(destino)
+    return nuevo
+
+
+def _escribir_manifiesto(destino, datos):
+    ruta = os.path.join(destino, "manifest.json")
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, indent=1, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _podar(destino):
+    # Lo que no se tocó en este arranque es de versiones anteriores.
+    limite = time.time() - CONSERVAR_VIEJOS_SEG
+    for raiz, _, nombres in os.walk(destino):
+        for nombre in nombres:
+            ruta = os.path.join(raiz, nombre)
+            if nombre != "manifest.json" and os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+
+
+# ========================================
+#  FLASK
+# ========================================
+def _url_con_huella(endpoint, values):
+    if endpoint == "static" and "filename" in values:
+        values["filename"] = manifiesto["archivos"].get(values["filename"], values["filename"])
+
+
+def servir(filename):
+    if filename not in _servibles and not os.path.isfile(os.path.join(DIST, filename)):
+        # Nombre sin huella (un enlace viejo o un archivo nuevo sin
+        # reiniciar): el handler normal de Flask, con su cache corto.
+        return current_app.send_static_file(filename)
+    gz = filename in _con_gzip and "gzip" in request.headers.get("Accept-Encoding", "")
+    respuesta = send_from_directory(
+        DIST, filename + ".gz" if gz else filename,
+        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        max_age=31536000,
+    )
+    if gz:
+        respuesta.headers["Content-Encoding"] = "gzip"
+    respuesta.headers["Cache-Control"] = CACHE_INMUTABLE
+    respuesta.headers["Vary"] = "Accept-Encoding"
+    return respuesta
+
+
+def asset_srcset(filename):
+    # "url 320w, url 640w, url <ancho original>w" para <img srcset>; vacío si
+    # no hay versiones reducidas.
+    from flask import url_for
+    info = manifiesto["variantes"].get(filename)
+    if not info:
+        return ""
+    anchos = [(info["ancho"], filename)] + [(int(a), nombre) for a, nombre in info["anchos"].items()]
+    return ", ".join(f"{url_for('static', filename=nombre)} {ancho}w" for ancho, nombre in sorted(anchos))
+
+
+def init_app(app):
+    global manifiesto, _servibles, _con_gzip
+    try:
+        manifiesto = construir(app.static_folder)
+    except OSError as e:
+        # Sin permisos de escritura se sigue con los estáticos tal cual.
+        print("No se pudieron generar los estáticos con huella:", e)
+        return
+    _servibles = set(manifiesto["archivos"].values()) | {
+        n for v in manifiesto["variantes"].values() for n in v["anchos"].values()
+    }
+    _con_gzip = set(manifiesto["gzip"])
+    app.url_defaults(_url_con_huella)
+    app.view_functions["static"] = servir
+    app.jinja_env.globals.update(estaticos=manifiesto, asset_srcset=asset_srcset)
@@ -1,34 +1,48 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify, make_response
+from markupsafe import Markup
 import os
 import sqlite3
+import threading
 from werkzeug.utils import secure_filename
 
 from db import (
+    DB_PATH,
+    DB_TIMEOUT,
     registrar_auditoria,
     recalcular_dvv,
+    siguiente_revision,
+    revision_actual,
 )
+from busqueda import indexar_protocolo
+import escritor
+import flujo_json
+from metricas import instrumentar_conexion
 
 experiments_bp = Blueprint("experiments_bp", __name__, url_prefix="/experiments")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "..", "uploads", "protocolos")
 
-if not os.path.exists(UPLOAD_FOLDER):
+
+def guardar_protocolo(archivo):
+    # La carpeta se crea con el primer archivo subido, no al importar.
+    nombre = secure_filename(archivo.filename)
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    archivo.save(os.path.join(UPLOAD_FOLDER, nombre))
+    return nombre
 
 
 # -----------------------------
 # CONEXIÓN SEGURA PARA CADA HILO
 # -----------------------------
 def conectar_bd():
-    ruta = os.path.join(BASE_DIR, "..", "biolabhub.db")
-    conn = sqlite3.connect(ruta)
+    conn = sqlite3.connect(DB_PATH, timeout=DB_TIMEOUT)
     conn.row_factory = sqlite3.Row
-    return conn
+    return instrumentar_conexion(conn)
 
 
 
-def post_proceso_experimento(accion, registro_id, datos, ip, usuario_id):
+def post_proceso_experimento(accion, registro_id, datos, ip, usuario_id, revision=None):
     
     try:
        
@@ -59,7 +73,7 @@ def post_proceso_experimento(accion, registro_id, datos, ip, usuario_id):
         
         try:
             print("EMITIENDO EVENTO a admin panel:", texto)
-            socketio.emit("experimento_actualizado", {"mensaje": texto} )
+            socketio.emit("experimento_actualizado", {"mensaje": texto, "revision": revision})
         except Exception as e:
             print("Error emitiendo 'experimento_actualizado':", e)
 
@@ -70,15 +84,25 @@ def post_proceso_experimento(accion, registro_id, datos, ip, usuario_id):
 # -----------------------------
 # LISTADO
 # -----------------------------
-@experiments_bp.route("/")
-def experiments():
-    if "usuario_id" not in session:
-        flash("Debes iniciar sesión.", "error")
-        return redirect(url_for("login_bp.login"))
+# La tabla de experimentos no depende de la sesión, así que se renderiza una
+# vez por revisión de "experimentos" y de "usuarios" (nombres de los
+# responsables) y se reutiliza hasta la próxima escritura.
+_tabla_cache = {"revision": None, "html": None}
+_tabla_lock = threading.Lock()
+
+
+def _revisiones():
+    return revision_actual("experimentos"), revision_actual("usuarios")
+
+
+def _tabla_experimentos(revision):
+    # revision: (experimentos, usuarios), ver _revisiones()
+    with _tabla_lock:
+        if _tabla_cache["revision"] == revision:
+            return _tabla_cache["html"]
 
     conn = conectar_bd()
     cur = conn.cursor()
-
     cur.execute("""
         SELECT e.id, e.titulo, e.descripcion, e.fecha_inicio, e.fecha_fin, 
                e.estado, e.protocolo_archivo, u.nombre AS responsable, e.responsable_id
@@ -88,19 +112,115 @@ def experiments():
         ORDER BY e.id DESC
     """)
     experimentos = cur.fetchall()
+    conn.close()
+
+    html = Markup(render_template("experiments/_tabla_experimentos.html", experimentos=experimentos))
+    with _tabla_lock:
+        # si otra escritura avanzó la revisión mientras tanto, no pisarla
+        if _tabla_cache["revision"] is None or revision >= _tabla_cache["revision"]:
+            _tabla_cache["revision"] = revision
+            _tabla_cache["html"] = html
+    return html
+
+
+def _etag_listado(revision):
+    # La página completa sí depende del usuario (nombre, rol, formulario) y,
+    # para el admin, del selector de responsables (revisión de usuarios).
+    return f"exp-{revision[0]}-{revision[1]}-{session.get('usuario_id')}-{session.get('rol')}"
+
+
+@experiments_bp.route("/")
+def experiments():
+    if "usuario_id" not in session:
+        flash("Debes iniciar sesión.", "error")
+        return redirect(url_for("login_bp.login"))
+
+    revision = _revisiones()
+    # Con mensajes flash pendientes la página cambia aunque la revisión no.
+    condicional = "_flashes" not in session
+    etag = _etag_listado(revision)
+    if condicional and request.if_none_match.contains_weak(etag):
+        respuesta = make_response("", 304)
+        respuesta.set_etag(etag, weak=True)
+        return respuesta
 
     usuarios = []
     if session.get("rol") == "admin":
+        conn = conectar_bd()
+        cur = conn.cursor()
         cur.execute("SELECT id, nombre FROM usuarios WHERE estado_logico = 0 OR estado_logico IS NULL ORDER BY nombre ASC")
         usuarios = cur.fetchall()
+        conn.close()
 
-    conn.close()
-
-    return render_template(
+    respuesta = make_response(render_template(
         "experiments/Experiments.html",
-        experimentos=experimentos,
+        tabla_experimentos=_tabla_experimentos(revision),
+        revision=revision[0],
         usuarios=usuarios
-    )
+    ))
+    if condicional:
+        respuesta.set_etag(etag, weak=True)
+        respuesta.headers["Cache-Control"] = "private, no-cache"
+    return respuesta
+
+
+@experiments_bp.route("/tabla")
+def experiments_tabla():
+    # Fragmento HTML de la tabla, para refrescarla sin recargar la página.
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+
+    revision = _revisiones()
+    etag = f"tabla-{revision[0]}-{revision[1]}"
+    if request.if_none_match.contains_weak(etag):
+        respuesta = make_response("", 304)
+    else:
+        respuesta = make_response(_tabla_experimentos(revision))
+        respuesta.headers["X-Revision"] = str(revision[0])
+    respuesta.set_etag(etag, weak=True)
+    respuesta.headers["Cache-Control"] = "private, no-cache"
+    return respuesta
+
+
+@experiments_bp.route("/cambios")
+def experiments_cambios():
+    # Delta para clientes: solo lo que cambió desde ?desde=<revision>.
+    # Los borrados lógicos vienen con "eliminado": true.
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+
+    desde = request.args.get("desde", 0, type=int)
+    conn = conectar_bd()
+    cur = conn.cursor()
+    cur.execute("SELECT revision FROM revisiones WHERE tabla = 'experimentos'")
+    fila = cur.fetchone()
+    revision = fila["revision"] if fila else 0
+    cur.execute("""
+        SELECT e.id, e.titulo, e.descripcion, e.fecha_inicio, e.fecha_fin,
+               e.estado, e.protocolo_archivo, u.nombre AS responsable, e.responsable_id,
+               e.revision, e.estado_logico
+        FROM experimentos e
+        LEFT JOIN usuarios u ON e.responsable_id = u.id
+        WHERE e.revision > ? AND e.revision <= ?
+        UNION ALL
+        -- los ya compactados siguen contando como borrados (compactacion.py)
+        SELECT a.id, a.titulo, a.descripcion, a.fecha_inicio, a.fecha_fin,
+               a.estado, a.protocolo_archivo, u.nombre AS responsable, a.responsable_id,
+               a.revision, 1 AS estado_logico
+        FROM experimentos_archivo a
+        LEFT JOIN usuarios u ON a.responsable_id = u.id
+        WHERE a.revision > ? AND a.revision <= ?
+        ORDER BY revision ASC
+    """, (desde, revision, desde, revision))
+    filas = cur.fetchall()
+    conn.close()
+
+    cambios = []
+    for f in filas:
+        exp = dict(f)
+        exp["eliminado"] = exp.pop("estado_logico") == 1
+        cambios.append(exp)
+    return jsonify({"revision": revision, "desde": desde, "experimentos": cambios})
 
 
 # -----------------------------
@@ -125,30 +245,7 @@ def add_experiment():
     archivo_nombre = None
 
     if archivo and archivo.filename:
-        archivo_nombre = secure_filename(archivo.filename)
-        archivo.save(os.path.join(UPLOAD_FOLDER, archivo_nombre))
-
-    conn = conectar_bd()
-    cur = conn.cursor()
-
-    cur.execute("""
-        INSERT INTO experimentos 
-        (titulo, descripcion, fecha_inicio, fecha_fin, estado, responsable_id, protocolo_archivo, dvh)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        titulo,
-        descripcion,
-        fecha_inicio,
-        fecha_fin,
-        estado,
-        responsable,
-        archivo_nombre,
-        0
-    ))
-
-    conn.commit()
-    nuevo_id = cur.lastrowid
-    conn.close()
+        archivo_nombre = guardar_protocolo(archivo)
 
     datos = {
         "titulo": titulo,
@@ -162,11 +259,17 @@ def add_experiment():
 
     dvh = sum(len(str(v)) for v in datos.values())
 
-    conn = conectar_bd()
-    cur = conn.cursor()
-    cur.execute("UPDATE experimentos SET dvh = ? WHERE id = ?", (dvh, nuevo_id))
-    conn.commit()
-    conn.close()
+    # Revisión y alta con su DVH en un solo trabajo del escritor.
+    def insertar(cur):
+        revision = siguiente_revision(cur, "experimentos")
+        cur.execute("""
+            INSERT INTO experimentos 
+            (titulo, descripcion, fecha_inicio, fecha_fin, estado, responsable_id, protocolo_archivo, dvh, revision)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (*datos.values(), dvh, revision))
+        return cur.lastrowid, revision
+
+    nuevo_id, revision = escritor.ejecutar(insertar)
 
     lanzar_tarea_en_segundo_plano(
         post_proceso_experimento,
@@ -174,9 +277,13 @@ def add_experiment():
         nuevo_id,
         datos,
         request.remote_addr,
-        session.get("usuario_id")
+        session.get("usuario_id"),
+        revision
     )
 
+    if archivo_nombre:
+        lanzar_tarea_en_segundo_plano(indexar_protocolo, nuevo_id, archivo_nombre, UPLOAD_FOLDER)
+
     flash("Experimento agregado correctamente.", "success")
     return redirect(url_for("experiments_bp.experiments"))
 
@@ -191,7 +298,7 @@ def get_experiment(id):
     cur = conn.cursor()
 
     cur.execute("""
-        SELECT id, titulo, descripcion, fecha_inicio, fecha_fin, estado, protocolo_archivo, responsable_id
+        SELECT id, titulo, descripcion, fecha_inicio, fecha_fin, estado, protocolo_archivo, responsable_id, version
         FROM experimentos
         WHERE id = ? AND (estado_logico = 0 OR estado_logico IS NULL)
     """, (id,))
@@ -217,6 +324,24 @@ def get_experiment(id):
 
 
 
+def quiere_json():
+    return request.accept_mimetypes.best == "application/json" or request.headers.get("X-Requested-With") == "XMLHttpRequest"
+
+
+def conflicto_experimento(actual):
+    # 409 con la fila vigente para clientes JSON; el formulario vuelve al
+    # listado, que ya muestra los datos nuevos.
+    if quiere_json():
+        if actual is None or actual["estado_logico"]:
+            return jsonify({"error": "El experimento fue eliminado."}), 409
+        return jsonify({
+            "error": "El experimento fue modificado por otro usuario.",
+            "actual": dict(actual),
+        }), 409
+    flash("El experimento fue modificado por otro usuario mientras lo editabas. Revisá los cambios y volvé a intentar.", "error")
+    return redirect(url_for("experiments_bp.experiments"))
+
+
 @experiments_bp.route("/update/<int:id>", methods=["POST"])
 def update_experiment(id):
     from servidor import lanzar_tarea_en_segundo_plano
@@ -228,7 +353,9 @@ def update_experiment(id):
     conn = conectar_bd()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM experimentos WHERE id = ?", (id,))
+    # Lectura fuera de transacción: no toma ningún lock mientras se procesa
+    # el formulario (y el archivo, si hay).
+    cur.execute("SELECT * FROM experimentos WHERE id = ? AND (estado_logico = 0 OR estado_logico IS NULL)", (id,))
     row = cur.fetchone()
 
     if not row:
@@ -241,6 +368,12 @@ def update_experiment(id):
         flash("No tenés permiso para editar este experimento.", "error")
         return redirect(url_for("experiments_bp.experiments"))
 
+    # Versión que vio el usuario al abrir el formulario (sin ella, la leída recién).
+    version = request.form.get("version", type=int) or row["version"]
+    conn.close()
+    if version != row["version"]:
+        return conflicto_experimento(row)
+
     titulo = request.form.get("titulo")
     descripcion = request.form.get("descripcion")
     fecha_inicio = request.form.get("fecha_inicio")
@@ -256,16 +389,7 @@ def update_experiment(id):
     protocolo_nombre = row["protocolo_archivo"]
 
     if archivo and archivo.filename:
-        protocolo_nombre = secure_filename(archivo.filename)
-        archivo.save(os.path.join(UPLOAD_FOLDER, protocolo_nombre))
-
-    cur.execute("""
-        UPDATE experimentos
-        SET titulo = ?, descripcion = ?, fecha_inicio = ?, fecha_fin = ?, estado = ?, responsable_id = ?, protocolo_archivo = ?
-        WHERE id = ?
-    """, (titulo, descripcion, fecha_inicio, fecha_fin, estado, responsable, protocolo_nombre, id))
-
-    conn.commit()
+        protocolo_nombre = guardar_protocolo(archivo)
 
     datos = {
         "titulo": titulo,
@@ -279,9 +403,30 @@ def update_experiment(id):
 
     dvh = sum(len(str(v)) for v in datos.values())
 
-    cur.execute("UPDATE experimentos SET dvh = ? WHERE id = ?", (dvh, id))
-    conn.commit()
-    conn.close()
+    # Compare-and-swap: un solo trabajo del escritor (revisión + UPDATE con
+    # DVH incluido). Si otro guardó antes, la versión ya no coincide y no
+    # se pisa nada.
+    def actualizar(cur):
+        cur.execute("SAVEPOINT cas")
+        revision = siguiente_revision(cur, "experimentos")
+        cur.execute("""
+            UPDATE experimentos
+            SET titulo = ?, descripcion = ?, fecha_inicio = ?, fecha_fin = ?, estado = ?, responsable_id = ?, protocolo_archivo = ?,
+                revision = ?, dvh = ?, version = version + 1
+            WHERE id = ? AND version = ? AND (estado_logico = 0 OR estado_logico IS NULL)
+        """, (titulo, descripcion, fecha_inicio, fecha_fin, estado, responsable, protocolo_nombre, revision, dvh, id, version))
+        if cur.rowcount == 0:
+            # Sin cambios no se gasta la revisión.
+            cur.execute("ROLLBACK TO cas")
+            cur.execute("RELEASE cas")
+            cur.execute("SELECT * FROM experimentos WHERE id = ?", (id,))
+            return None, cur.fetchone()
+        cur.execute("RELEASE cas")
+        return revision, None
+
+    revision, actual = escritor.ejecutar(actualizar)
+    if revision is None:
+        return conflicto_experimento(actual)
 
     lanzar_tarea_en_segundo_plano(
         post_proceso_experimento,
@@ -289,9 +434,13 @@ def update_experiment(id):
         id,
         datos,
         request.remote_addr,
-        session.get("usuario_id")
+        session.get("usuario_id"),
+        revision
     )
 
+    if archivo and archivo.filename:
+        lanzar_tarea_en_segundo_plano(indexar_protocolo, id, protocolo_nombre, UPLOAD_FOLDER)
+
     flash("Experimento actualizado correctamente.", "success")
     return redirect(url_for("experiments_bp.experiments"))
 
@@ -301,16 +450,14 @@ def update_experiment(id):
 def delete_experiment(id):
     from servidor import lanzar_tarea_en_segundo_plano
 
-    conn = conectar_bd()
-    cur = conn.cursor()
+    def eliminar(cur):
+        cur.execute("SELECT titulo FROM experimentos WHERE id = ?", (id,))
+        row = cur.fetchone()
+        revision = siguiente_revision(cur, "experimentos")
+        cur.execute("UPDATE experimentos SET estado_logico = 1, revision = ? WHERE id = ?", (revision, id))
+        return row["titulo"] if row else "(desconocido)", revision
 
-    cur.execute("SELECT titulo FROM experimentos WHERE id = ?", (id,))
-    row = cur.fetchone()
-    titulo = row["titulo"] if row else "(desconocido)"
-
-    cur.execute("UPDATE experimentos SET estado_logico = 1 WHERE id = ?", (id,))
-    conn.commit()
-    conn.close()
+    titulo, revision = escritor.ejecutar(eliminar)
 
     datos = {"titulo": titulo}
 
@@ -320,7 +467,8 @@ def delete_experiment(id):
         id,
         datos,
         request.remote_addr,
-        session.get("usuario_id")
+        session.get("usuario_id"),
+        revision
     )
 
     flash("Experimento eliminado correctamente.", "success")
@@ -336,26 +484,21 @@ def descargar_protocolo(filename):
 
 @experiments_bp.route("/events")
 def experiments_events():
-    conn = conectar_bd()
-    cur = conn.cursor()
-
-    cur.execute("""
+    # Con muchos años de experimentos el calendario pide miles de filas:
+    # se mandan en streaming (ver flujo_json.py).
+    query = """
         SELECT id, titulo, descripcion, fecha_inicio, fecha_fin
         FROM experimentos
         WHERE estado_logico = 0 OR estado_logico IS NULL
-    """)
+    """
+    return flujo_json.responder([(None, query, ())], _evento_calendario)
 
-    rows = cur.fetchall()
-    conn.close()
 
-    eventos = []
-    for r in rows:
-        eventos.append({
-            "id": r["id"],
-            "title": r["titulo"],
-            "start": r["fecha_inicio"],
-            "end": r["fecha_fin"],
-            "description": r["descripcion"]
-        })
-
-    return jsonify(eventos)
+def _evento_calendario(r):
+    return {
+        "id": r["id"],
+        "title": r["titulo"],
+        "start": r["fecha_inicio"],
+        "end": r["fecha_fin"],
+        "description": r["descripcion"]
+    }
@@ -0,0 +1,85 @@
+import json
+import os
+import zlib
+
+from flask import Response, request, stream_with_context
+
+import metricas
+from db import conectar_bd
+
+
+# ========================================
+#  RESPUESTAS JSON EN STREAMING
+# ========================================
+# Para listados que pueden tener decenas de miles de filas (calendarios,
+# bitácora). Con fetchall() + lista de dicts + jsonify el resultado está
+# tres veces en memoria antes de mandar el primer byte. Acá se recorre el
+# cursor con fetchmany, cada tanda se serializa y sale como un chunk de la
+# respuesta (comprimido con gzip si el cliente lo acepta): la memoria queda
+# acotada a una tanda y el primer byte sale apenas está la primera.
+#
+# Ojo:
+# - El cursor mantiene abierta una transacción de lectura mientras dura el
+#   envío (con WAL no frena a los escritores).
+# - Un error después del primer chunk ya no puede cambiar el código de
+#   estado: la respuesta queda cortada (JSON inválido) y se ve en el log.
+TANDA = int(os.environ.get("BIOLABHUB_JSON_TANDA", "500"))
+NIVEL_GZIP = 6
+
+_codificar = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def _tandas(consultas, tanda):
+    # consultas: (ruta, query, parametros) por BD; una conexión por vez.
+    for ruta, query, parametros in consultas:
+        conn = conectar_bd(ruta)
+        try:
+            cursor = conn.execute(query, parametros)
+            while True:
+                filas = cursor.fetchmany(tanda)
+                if not filas:
+                    break
+                yield filas
+        finally:
+            conn.close()
+
+
+def _json(tandas, transformar):
+    # El "[" sale con la primera tanda: el primer chunk ya trae filas.
+    separador = "["
+    for filas in tandas:
+        # Una lista por tanda, sin los corchetes: "{...},{...}"
+        trozo = _codificar([transformar(f) for f in filas])[1:-1]
+        if not trozo:
+            continue
+        yield separador + trozo
+        separador = ","
+    yield "]" if separador == "," else "[]"
+
+
+def _gzip(partes):
+    compresor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 31)
+    for parte in partes:
+        # SYNC_FLUSH por tanda: el cliente puede ir descomprimiendo lo que llega.
+        datos = compresor.compress(parte.encode()) + compresor.flush(zlib.Z_SYNC_FLUSH)
+        if datos:
+            yield datos
+    yield compresor.flush()
+
+
+def responder(consultas, transformar=dict, tanda=None):
+    # Devuelve un Response con el array JSON de transformar(fila) para las
+    # filas de todas las consultas, en orden. metricas.py cuenta las
+    # consultas y el tiempo del envío completo.
+    partes = _json(_tandas(consultas, tanda or TANDA), transformar)
+    gz = "gzip" in request.headers.get("Accept-Encoding", "")
+    if gz:
+        partes = _gzip(partes)
+    else:
+        partes = (parte.encode() for parte in partes)
+    metricas.diferir_fin()
+    respuesta = Response(stream_with_context(partes), mimetype="application/json")
+    respuesta.headers["Vary"] = "Accept-Encoding"
+    if gz:
+        respuesta.headers["Content-Encoding"] = "gzip"
+    return respuesta
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, session, redirect, url_for, flash
 from db import ejecutar_select
+import shards
 \
 home_bp = Blueprint("home_bp", __name__)
 \
@@ -19,29 +20,29 @@ def home():
           AND estado_logico = 0
         ORDER BY fecha_inicio DESC
         LIMIT 5
-    """, (usuario_id,))
+    """, (usuario_id,), cache=True)
     \
 \
-    muestras = ejecutar_select("""
-        SELECT id, nombre, tipo, estado, ubicacion
+    muestras = shards.consultar_todos("""
+        SELECT id, nombre, tipo, estado, ubicacion, fecha_ingreso
         FROM muestras
         WHERE responsable_id = ?
           AND estado_logico = 0
         ORDER BY fecha_ingreso DESC
         LIMIT 5
-    """, (usuario_id,))
+    """, (usuario_id,), clave=lambda m: m["fecha_ingreso"] or "", desc=True, limite=5)
     \
 \
-    equipos = ejecutar_select("""
+    equipos = shards.consultar_todos("""
         SELECT r.id, r.equipo, r.fecha_inicio, r.fecha_fin, r.estado
         FROM reservas_equipos r
         WHERE r.usuario_id = ?
           AND r.estado_logico = 0
         ORDER BY r.fecha_inicio DESC
-    """, (usuario_id,))
+    """, (usuario_id,), clave=lambda r: r["fecha_inicio"], desc=True)
     \
     return render_template(\
-        "home/Home.html",\
+        "Home/Home.html",\
         experimentos=experimentos,\
         muestras=muestras,\
         equipos=equipos\
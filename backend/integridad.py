@@ -0,0 +1,394 @@
+# ========================================
+#  INTEGRIDAD: ÁRBOLES DE MERKLE POR TABLA
+# ========================================
+# Cada tabla con DVH se parte en bloques fijos de ids (BLOQUE filas). La
+# hoja de un bloque es el sha256 de sus filas; cada nodo interno, el
+# sha256 de sus dos hijos, hasta la raíz.
+#
+# - Triggers (SQL puro) anotan en merkle_pendientes qué bloques tocó cada
+#   escritura, venga de donde venga, y si fue dentro de una sesión de
+#   escritura de la app: una fila en merkle_sesion que abrir_escritura()
+#   inserta después del BEGIN y cerrar_escritura() borra antes del COMMIT.
+#   Ninguna otra conexión llega a verla, así que una edición por fuera
+#   (consola sqlite3, otro programa) queda anotada como ajena.
+# - Los caminos de escritura de la app terminan siempre actualizando el DVV
+#   (recalcular_dvv / sumar_dvv): ahí se rehacen solo las hojas que tocó la
+#   transacción en curso y sus caminos a la raíz, O(BLOQUE + log n) por
+#   bloque.
+# - Un bloque ajeno nunca se pliega: queda pendiente y verificar() lo
+#   informa como sospechoso, aunque después lo toque una escritura legítima.
+#   Solo construir() (recalcular desde el panel) lo acepta.
+# - verificar() recalcula las hojas en paralelo y baja desde la raíz solo
+#   por los nodos distintos: cada bloque alterado se ubica con O(log n)
+#   comparaciones.
+#
+# Con sharding, muestras y reservas (y sus archivos) tienen su árbol en cada
+# lab_<id>.db: verificar_todo() y resumen() recorren también esos archivos
+# (ver bases()).
+#
+# Este módulo no importa db al cargarse (db lo importa a él); las
+# funciones que abren conexiones lo hacen adentro.
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+BLOQUE = 128
+HILOS_VERIFICACION = int(os.environ.get("BIOLABHUB_HILOS_VERIFICACION", str(min(8, os.cpu_count() or 1))))
+VACIO = hashlib.sha256(b"").hexdigest()
+
+TABLAS = (
+    "usuarios", "muestras", "reactivos", "experimentos",
+    "laboratorios", "reservas_equipos", "equipos", "audits_logs",
+    "movimientos_reactivos", "muestras_archivo", "experimentos_archivo",
+    "reservas_equipos_archivo",
+)
+
+
+def crear_merkle(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'merkle_nodos'")
+    existia = cursor.fetchone() is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS merkle_nodos (
+            tabla TEXT NOT NULL,
+            nivel INTEGER NOT NULL,
+            posicion INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (tabla, nivel, posicion)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS merkle_raices (
+            tabla TEXT PRIMARY KEY,
+            altura INTEGER NOT NULL DEFAULT 0,
+            raiz TEXT,
+            hojas INTEGER NOT NULL DEFAULT 0,
+            estado TEXT,
+            detalle TEXT,
+            verificado_en TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS merkle_pendientes (
+            tabla TEXT NOT NULL,
+            bloque INTEGER NOT NULL,
+            propio INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (tabla, bloque)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("PRAGMA table_info(merkle_pendientes)")
+    if "propio" not in [col[1] for col in cursor.fetchall()]:
+        # Lo que ya estaba pendiente antes de la sesión de escritura no se
+        # sabe quién lo escribió: queda como ajeno.
+        cursor.execute("ALTER TABLE merkle_pendientes ADD COLUMN propio INTEGER NOT NULL DEFAULT 0")
+    crear_sesion(cursor)
+    for tabla in TABLAS:
+        # Se recrean siempre: las de versiones anteriores no miraban la sesión.
+        for sufijo, evento, filas in (("ai", "INSERT", ("new",)), ("au", "UPDATE", ("old", "new")),
+                                      ("ad", "DELETE", ("old",))):
+            cuerpo = " ".join(_marcar(tabla, fila) for fila in filas)
+            cursor.execute(f"DROP TRIGGER IF EXISTS merkle_{tabla}_{sufijo}")
+            cursor.execute(f"CREATE TRIGGER merkle_{tabla}_{sufijo} AFTER {evento} ON {tabla} BEGIN {cuerpo} END")
+    if not existia:
+        for tabla in TABLAS:
+            construir(cursor, tabla)
+
+
+def _marcar(tabla, fila):
+    # propio = 1 solo si la fila se anota dentro de una sesión de la app y
+    # el bloque no tenía ya una marca ajena.
+    return (
+        f"INSERT INTO merkle_pendientes (tabla, bloque, propio) "
+        f"VALUES ('{tabla}', {fila}.id / {BLOQUE}, EXISTS (SELECT 1 FROM merkle_sesion)) "
+        f"ON CONFLICT (tabla, bloque) DO UPDATE SET propio = MIN(propio, excluded.propio);"
+    )
+
+
+# ----------------------------------------
+#  SESIÓN DE ESCRITURA
+# ----------------------------------------
+# Toda transacción de la app que escribe tablas con árbol abre la sesión
+# después del BEGIN y la cierra antes del COMMIT, en cada BD que escribe
+# (esquema "main" o "global" cuando hay un shard con la compartida adjunta).
+# Si la cierra antes de tiempo o se olvida de abrirla, sus bloques quedan
+# como ajenos: una falsa alarma, nunca una edición aceptada en silencio.
+def crear_sesion(cursor):
+    cursor.execute("CREATE TABLE IF NOT EXISTS merkle_sesion (id INTEGER PRIMARY KEY)")
+
+
+def abrir_escritura(cursor, esquema="main"):
+    cursor.execute(f"INSERT OR IGNORE INTO {esquema}.merkle_sesion (id) VALUES (1)")
+
+
+def cerrar_escritura(cursor, esquema="main"):
+    cursor.execute(f"DELETE FROM {esquema}.merkle_sesion")
+
+
+# ----------------------------------------
+#  HASHES
+# ----------------------------------------
+def _hash_filas(filas):
+    h = hashlib.sha256()
+    for fila in filas:
+        h.update(repr(tuple(fila)).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+def _padre(izq, der):
+    if izq == VACIO and der == VACIO:
+        return VACIO
+    return hashlib.sha256((izq + der).encode()).hexdigest()
+
+
+def _hojas_de(cursor, tabla, desde_bloque=0, hasta_bloque=None):
+    # {bloque: hash} para los bloques con filas en [desde, hasta)
+    if hasta_bloque is None:
+        cursor.execute(f"SELECT id, * FROM {tabla} WHERE id >= ? ORDER BY id", (desde_bloque * BLOQUE,))
+    else:
+        cursor.execute(f"SELECT id, * FROM {tabla} WHERE id >= ? AND id < ? ORDER BY id",
+                       (desde_bloque * BLOQUE, hasta_bloque * BLOQUE))
+    hojas = {}
+    actual, filas = None, []
+    for fila in cursor:
+        bloque = fila[0] // BLOQUE
+        if bloque != actual and filas:
+            hojas[actual] = _hash_filas(filas)
+            filas = []
+        actual = bloque
+        filas.append(fila)
+    if filas:
+        hojas[actual] = _hash_filas(filas)
+    return hojas
+
+
+def _altura(hojas):
+    return max(hojas).bit_length() if hojas else 0
+
+
+def _arbol(hojas, altura):
+    # Niveles completos en memoria: {nivel: {posicion: hash}} sin los VACIO
+    niveles = {0: dict(hojas)}
+    for nivel in range(1, altura + 1):
+        hijos = niveles[nivel - 1]
+        padres = {}
+        for pos in {p // 2 for p in hijos}:
+            h = _padre(hijos.get(2 * pos, VACIO), hijos.get(2 * pos + 1, VACIO))
+            if h != VACIO:
+                padres[pos] = h
+        niveles[nivel] = padres
+    return niveles
+
+
+def _raiz(niveles, altura):
+    return niveles[altura].get(0, VACIO) if niveles[0] else VACIO
+
+
+# ----------------------------------------
+#  MANTENIMIENTO
+# ----------------------------------------
+def construir(cursor, tabla):
+    hojas = _hojas_de(cursor, tabla)
+    altura = _altura(hojas)
+    niveles = _arbol(hojas, altura)
+    cursor.execute("DELETE FROM merkle_nodos WHERE tabla = ?", (tabla,))
+    cursor.executemany(
+        "INSERT INTO merkle_nodos (tabla, nivel, posicion, hash) VALUES (?, ?, ?, ?)",
+        [(tabla, nivel, pos, h) for nivel, nodos in niveles.items() for pos, h in nodos.items()],
+    )
+    cursor.execute("DELETE FROM merkle_pendientes WHERE tabla = ?", (tabla,))
+    _guardar_raiz(cursor, tabla, altura, _raiz(niveles, altura), len(hojas))
+
+
+def _guardar_raiz(cursor, tabla, altura, raiz, hojas):
+    cursor.execute("""
+        INSERT INTO merkle_raices (tabla, altura, raiz, hojas) VALUES (?, ?, ?, ?)
+        ON CONFLICT(tabla) DO UPDATE SET
+            altura = excluded.altura, raiz = excluded.raiz, hojas = excluded.hojas
+    """, (tabla, altura, raiz, hojas))
+
+
+def _nodo(cursor, tabla, nivel, posicion):
+    cursor.execute("SELECT hash FROM merkle_nodos WHERE tabla = ? AND nivel = ? AND posicion = ?",
+                   (tabla, nivel, posicion))
+    fila = cursor.fetchone()
+    return fila[0] if fila else VACIO
+
+
+def _escribir_nodo(cursor, tabla, nivel, posicion, h):
+    if h == VACIO:
+        cursor.execute("DELETE FROM merkle_nodos WHERE tabla = ? AND nivel = ? AND posicion = ?",
+                       (tabla, nivel, posicion))
+    else:
+        cursor.execute("INSERT OR REPLACE INTO merkle_nodos (tabla, nivel, posicion, hash) VALUES (?, ?, ?, ?)",
+                       (tabla, nivel, posicion, h))
+
+
+def aplicar_pendientes(cursor, tabla):
+    # Se llama desde recalcular_dvv()/sumar_dvv(), dentro de la transacción
+    # de la escritura. Solo pliega los bloques propios; los ajenos quedan
+    # pendientes para verificar().
+    if tabla not in TABLAS:
+        return
+    cursor.execute("SELECT bloque FROM merkle_pendientes WHERE tabla = ? AND propio = 1", (tabla,))
+    bloques = [fila[0] for fila in cursor.fetchall()]
+    if not bloques:
+        return
+    for bloque in bloques:
+        hoja = _hojas_de(cursor, tabla, bloque, bloque + 1).get(bloque, VACIO)
+        _escribir_nodo(cursor, tabla, 0, bloque, hoja)
+    cursor.execute("DELETE FROM merkle_pendientes WHERE tabla = ? AND propio = 1", (tabla,))
+
+    cursor.execute("SELECT MAX(posicion), COUNT(*) FROM merkle_nodos WHERE tabla = ? AND nivel = 0", (tabla,))
+    max_hoja, n_hojas = cursor.fetchone()
+    altura = (max_hoja or 0).bit_length() if n_hojas else 0
+    cursor.execute("SELECT altura FROM merkle_raices WHERE tabla = ?", (tabla,))
+    fila = cursor.fetchone()
+    if not fila or fila[0] != altura:
+        # Cambió la altura (el árbol creció o se achicó): se rehacen los
+        # niveles internos desde las hojas guardadas.
+        cursor.execute("SELECT posicion, hash FROM merkle_nodos WHERE tabla = ? AND nivel = 0", (tabla,))
+        hojas = dict(cursor.fetchall())
+        niveles = _arbol(hojas, altura)
+        cursor.execute("DELETE FROM merkle_nodos WHERE tabla = ? AND nivel > 0", (tabla,))
+        cursor.executemany(
+            "INSERT INTO merkle_nodos (tabla, nivel, posicion, hash) VALUES (?, ?, ?, ?)",
+            [(tabla, nivel, pos, h) for nivel, nodos in niveles.items() if nivel > 0 for pos, h in nodos.items()],
+        )
+        _guardar_raiz(cursor, tabla, altura, _raiz(niveles, altura), n_hojas)
+        return
+
+    # Misma altura: solo los caminos de las hojas tocadas, nivel por nivel.
+    posiciones = set(bloques)
+    for nivel in range(1, altura + 1):
+        posiciones = {p // 2 for p in posiciones}
+        for pos in posiciones:
+            h = _padre(_nodo(cursor, tabla, nivel - 1, 2 * pos), _nodo(cursor, tabla, nivel - 1, 2 * pos + 1))
+            _escribir_nodo(cursor, tabla, nivel, pos, h)
+    raiz = _nodo(cursor, tabla, altura, 0) if n_hojas else VACIO
+    _guardar_raiz(cursor, tabla, altura, raiz, n_hojas)
+
+
+# ----------------------------------------
+#  VERIFICACIÓN
+# ----------------------------------------
+def _hojas_en_paralelo(tabla, max_bloque, bd=None):
+    # Reparte los bloques en tramos contiguos; cada hilo usa su conexión
+    # (sqlite suelta el GIL mientras lee, hashlib mientras hashea).
+    from db import conectar_bd
+
+    def tramo(rango):
+        conn = conectar_bd(bd, adjuntar_global=False)
+        try:
+            return _hojas_de(conn.cursor(), tabla, *rango)
+        finally:
+            conn.close()
+
+    total = max_bloque + 1
+    partes = max(1, min(HILOS_VERIFICACION, total))
+    paso = -(-total // partes)
+    rangos = [(i, min(i + paso, total)) for i in range(0, total, paso)]
+    hojas = {}
+    with ThreadPoolExecutor(max_workers=partes) as ejecutor:
+        for parcial in ejecutor.map(tramo, rangos):
+            hojas.update(parcial)
+    return hojas
+
+
+def _localizar(guardado, actual, altura):
+    # Baja desde la raíz solo por los hijos que difieren.
+    distintos = []
+    frontera = [(altura, 0)]
+    comparaciones = 0
+    while frontera:
+        nivel, pos = frontera.pop()
+        comparaciones += 1
+        if guardado.get(nivel, {}).get(pos, VACIO) == actual.get(nivel, {}).get(pos, VACIO):
+            continue
+        if nivel == 0:
+            distintos.append(pos)
+        else:
+            frontera.extend([(nivel - 1, 2 * pos), (nivel - 1, 2 * pos + 1)])
+    return sorted(distintos), comparaciones
+
+
+def bases():
+    # [(bd, tablas)]: la BD compartida con todas las tablas y, con sharding,
+    # cada archivo de laboratorio con las que viven ahí.
+    import shards
+    propias = tuple(t for t in TABLAS if t.removesuffix("_archivo") in shards.TABLAS)
+    return [(None, TABLAS)] + [(ruta, propias) for ruta in shards.todas() if ruta is not None]
+
+
+def verificar(tabla, bd=None):
+    from db import conectar_bd
+
+    conn = conectar_bd(bd, adjuntar_global=False)
+    cursor = conn.cursor()
+    cursor.execute("SELECT nivel, posicion, hash FROM merkle_nodos WHERE tabla = ?", (tabla,))
+    guardado = {}
+    for nivel, pos, h in cursor.fetchall():
+        guardado.setdefault(nivel, {})[pos] = h
+    cursor.execute(f"SELECT MAX(id) FROM {tabla}")
+    max_id = cursor.fetchone()[0] or 0
+    cursor.execute("SELECT bloque FROM merkle_pendientes WHERE tabla = ? ORDER BY bloque", (tabla,))
+    sospechosos = [fila[0] for fila in cursor.fetchall()]
+    conn.close()
+
+    max_guardado = max(guardado.get(0, {0: None}))
+    hojas = _hojas_en_paralelo(tabla, max(max_id // BLOQUE, max_guardado), bd)
+    altura = max(_altura(hojas), _altura(guardado.get(0, {})))
+    actual = _arbol(hojas, altura)
+    # El árbol guardado se recompone a la misma altura para comparar nodo a nodo.
+    guardado = _arbol(guardado.get(0, {}), altura) if altura != max(guardado, default=0) else guardado
+    distintos, comparaciones = _localizar(guardado, actual, altura)
+
+    resultado = {
+        "tabla": tabla,
+        "archivo": os.path.basename(bd) if bd else None,
+        "estado": "ok" if not distintos and not sospechosos else "alterada",
+        "rangos": [[b * BLOQUE, (b + 1) * BLOQUE - 1] for b in distintos],
+        # Escritos por fuera de la app: no se plegaron, se informan aunque
+        # la hoja hoy coincida (la escritura pudo haberse deshecho a mano).
+        "sospechosos": [[b * BLOQUE, (b + 1) * BLOQUE - 1] for b in sospechosos],
+        "comparaciones": comparaciones,
+        "hojas": len(hojas),
+    }
+    import escritor
+    escritor.ejecutar(lambda cursor: cursor.execute("""
+        UPDATE merkle_raices SET estado = ?, detalle = ?, verificado_en = ? WHERE tabla = ?
+    """, (resultado["estado"], json.dumps(resultado), datetime.now().strftime("%Y-%m-%d %H:%M:%S"), tabla)), bd=bd)
+    return resultado
+
+
+def verificar_todo():
+    return [verificar(tabla, bd) for bd, tablas in bases() for tabla in tablas]
+
+
+def resumen():
+    # Para el panel: solo lo guardado, sin recorrer ninguna tabla.
+    from db import ejecutar_select
+
+    salida = []
+    for bd, tablas in bases():
+        sospechosos = {
+            f["tabla"]: f["n"] for f in ejecutar_select(
+                "SELECT tabla, COUNT(*) AS n FROM main.merkle_pendientes GROUP BY tabla", bd=bd
+            )
+        }
+        filas = {f["tabla"]: dict(f) for f in ejecutar_select("""
+            SELECT r.tabla, r.raiz, r.hojas, r.estado, r.detalle, r.verificado_en, v.dvv
+            FROM main.merkle_raices r
+            LEFT JOIN main.verificaciones_verticales v ON v.tabla = r.tabla
+        """, bd=bd)}
+        for tabla in tablas:
+            fila = filas.get(tabla, {"tabla": tabla, "raiz": None, "hojas": 0, "estado": None,
+                                     "detalle": None, "verificado_en": None, "dvv": None})
+            detalle = json.loads(fila["detalle"]) if fila["detalle"] else {}
+            fila["archivo"] = os.path.basename(bd) if bd else None
+            fila["rangos"] = detalle.get("rangos", [])
+            fila["sospechosos"] = sospechosos.get(tabla, 0)
+            fila["ok"] = fila["estado"] != "alterada" and not fila["sospechosos"]
+            salida.append(fila)
+    return salida
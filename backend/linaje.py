@@ -0,0 +1,159 @@
+# ========================================
+#  LINAJE DE MUESTRAS (ALÍCUOTAS / DERIVADOS)
+# ========================================
+# Cada muestra guarda su padre directo (padre_id) y linaje_muestras guarda
+# la clausura: un par (ancestro, descendiente, profundidad) por cada
+# relación, directa o no. Al crear un hijo se copian los pares del padre
+# con profundidad + 1, así que:
+#   - descendientes de X: rango de la PK (ancestro_id = X)
+#   - ancestros de X:     rango de idx_linaje_descendiente
+# sin consultas recursivas, por profunda que sea la cadena.
+#
+# El linaje no se edita (una alícuota no cambia de madre) y se conserva
+# aunque las muestras se archiven: ancestros() y descendientes() leen
+# también muestras_archivo y marcan esas filas con archivada = True.
+#
+# linaje_muestras vive en la BD compartida; en modo sharding las
+# conexiones a un shard la ven a través de la BD adjunta "global".
+import json
+
+from db import DB_PATH, dvh_fila, conectar_bd, sumar_dvv, registrar_auditoria, registrar_auditoria_en
+import cache_consultas
+import escritor
+import integridad
+import shards
+
+RELACIONES = ("alícuota", "derivado")
+MAX_ALICUOTAS = 1000
+
+COLUMNAS = """
+    m.id, m.nombre, m.tipo, m.estado, m.ubicacion, m.fecha_ingreso,
+    m.padre_id, m.relacion, m.estado_logico, l.profundidad
+"""
+
+
+def crear_alicuotas(padre_id, cantidad, usuario_id, ip_origen, relacion="alícuota",
+                    nombre=None, tipo=None, estado=None, ubicacion=None):
+    # Crea `cantidad` hijos de padre_id en una sola transacción (un trabajo
+    # del escritor sin sharding): filas, DVH, clausura, DVV y auditoría. Devuelve la lista de filas nuevas, o
+    # None si el padre no existe.
+    if relacion not in RELACIONES:
+        raise ValueError(f"Relación inválida: {relacion}")
+    if not 1 <= cantidad <= MAX_ALICUOTAS:
+        raise ValueError(f"La cantidad debe estar entre 1 y {MAX_ALICUOTAS}.")
+
+    conn = conectar_bd(shards.bd_de_id("muestras", padre_id))
+    padre = conn.execute("SELECT * FROM muestras WHERE id = ? AND estado_logico = 0", (padre_id,)).fetchone()
+    conn.close()
+    if padre is None:
+        return None
+
+    base = nombre or padre["nombre"]
+    ubicacion = ubicacion or padre["ubicacion"]
+    bd = shards.bd_de_ubicacion(ubicacion)
+    accion = f"CREAR {relacion.upper()}S ({cantidad}) DE {padre_id}"
+
+    def crear(cursor):
+        cursor.execute(
+            "SELECT COUNT(*) FROM linaje_muestras WHERE ancestro_id = ? AND profundidad = 1", (padre_id,)
+        )
+        desde = cursor.fetchone()[0] + 1
+        nuevas = []
+        for i in range(desde, desde + cantidad):
+            cursor.execute("""
+                INSERT INTO muestras (nombre, tipo, estado, responsable_id, ubicacion, estado_logico, padre_id, relacion)
+                VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+                RETURNING *
+            """, (f"{base}-{i}", tipo or padre["tipo"], estado or padre["estado"], usuario_id,
+                  ubicacion, padre_id, relacion))
+            nuevas.append(dict(cursor.fetchone()))
+        # Mismo DVH que add_sample(): todas las columnas menos dvh.
+        for fila in nuevas:
+            fila["dvh"] = dvh_fila(fila)
+        cursor.executemany("UPDATE muestras SET dvh = ? WHERE id = ?", [(f["dvh"], f["id"]) for f in nuevas])
+
+        ids = json.dumps([f["id"] for f in nuevas])
+        cursor.execute("""
+            INSERT INTO linaje_muestras (ancestro_id, descendiente_id, profundidad)
+            SELECT ?, value, 1 FROM json_each(?)
+        """, (padre_id, ids))
+        cursor.execute("""
+            INSERT INTO linaje_muestras (ancestro_id, descendiente_id, profundidad)
+            SELECT l.ancestro_id, n.value, l.profundidad + 1
+            FROM linaje_muestras l, json_each(?) n
+            WHERE l.descendiente_id = ?
+        """, (ids, padre_id))
+
+        sumar_dvv(cursor, "muestras", sum(f["dvh"] for f in nuevas))
+        if bd is None:
+            registrar_auditoria_en(cursor, usuario_id, accion, "muestras", padre_id, ip_origen)
+        return nuevas
+
+    if bd is None:
+        return escritor.ejecutar(crear)
+
+    # En un shard las muestras van al archivo del laboratorio y la clausura
+    # a la BD compartida (adjunta como "global"): una transacción que abarca
+    # dos archivos, que el escritor (un hilo por archivo) no puede dar. Va
+    # con su propia conexión y la cache de consultas se invalida a mano.
+    conn = conectar_bd(bd)
+    escritas = cache_consultas.vigilar(conn, bd, DB_PATH)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        for esquema in ("main", "global"):
+            integridad.abrir_escritura(cursor, esquema)
+        nuevas = crear(cursor)
+        for esquema in ("main", "global"):
+            integridad.cerrar_escritura(cursor, esquema)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    cache_consultas.invalidar(escritas)
+    registrar_auditoria(usuario_id, accion, "muestras", padre_id, ip_origen)
+    return nuevas
+
+
+def _relacionadas(columna, condicion, parametros, orden, clave):
+    # La misma consulta sobre muestras y muestras_archivo (UNION ALL por
+    # separado: cada rama usa la PK de su tabla para el JOIN).
+    ramas = [f"""
+        SELECT {COLUMNAS}, {archivada} AS archivada
+        FROM linaje_muestras l
+        JOIN {tabla} m ON m.id = l.{columna}
+        WHERE {condicion}
+    """ for tabla, archivada in (("muestras", 0), ("muestras_archivo", 1))]
+    filas = shards.consultar_todos(
+        " UNION ALL ".join(ramas) + f" ORDER BY {orden}", parametros * 2, clave=clave
+    )
+    return [dict(f, archivada=bool(f["archivada"])) for f in filas]
+
+
+def ancestros(muestra_id):
+    # Del padre a la raíz.
+    return _relacionadas("ancestro_id", "l.descendiente_id = ?", (muestra_id,),
+                         "profundidad", lambda f: f["profundidad"])
+
+
+def descendientes(muestra_id, profundidad_max=None):
+    # Todas las muestras que salen de muestra_id (por generación), p. ej.
+    # para rastrear un stock contaminado, incluidas las archivadas.
+    condicion, parametros = "l.ancestro_id = ?", (muestra_id,)
+    if profundidad_max:
+        condicion, parametros = "l.ancestro_id = ? AND l.profundidad <= ?", (muestra_id, profundidad_max)
+    return _relacionadas("descendiente_id", condicion, parametros,
+                         "profundidad, id", lambda f: (f["profundidad"], f["id"]))
+
+
+def estadisticas():
+    conn = conectar_bd()
+    fila = conn.execute("""
+        SELECT COUNT(DISTINCT ancestro_id) AS con_derivadas,
+               COALESCE(MAX(profundidad), 0) AS generaciones
+        FROM linaje_muestras
+    """).fetchone()
+    conn.close()
+    return dict(fila)
@@ -3,6 +3,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, sessio
 from datetime import datetime
 import bcrypt
 from db import ejecutar_select, ejecutar_insert, ejecutar_update, registrar_auditoria, recalcular_dvv
+from metricas import medir
 \
 \
 template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "pages", "login")
@@ -33,7 +34,10 @@ def login():
 \
         hash_bd = usuario["contraseña_hash"]
         \
-        if bcrypt.checkpw(contraseña.encode("utf-8"), hash_bd.encode("utf-8")):
+        with medir("bcrypt"):
+            password_ok = bcrypt.checkpw(contraseña.encode("utf-8"), hash_bd.encode("utf-8"))
+        \
+        if password_ok:
             \
             session["usuario_id"] = usuario["id"]
             session["nombre"] = usuario["nombre"]
@@ -67,10 +71,11 @@ def register():
         if existe:
             flash("Este email ya está registrado.", "error")
             return render_template("register.html")
-        contraseña_hash = bcrypt.hashpw(\
-            contraseña.encode("utf-8"),\
-            bcrypt.gensalt()\
-        ).decode("utf-8")
+        with medir("bcrypt"):
+            contraseña_hash = bcrypt.hashpw(\
+                contraseña.encode("utf-8"),\
+                bcrypt.gensalt()\
+            ).decode("utf-8")
         \
 \
         query = """
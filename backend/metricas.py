@@ -0,0 +1,358 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import request, session, template_rendered, before_render_template, Response
+
+
+# ========================================
+#  CONFIGURACIÓN
+# ========================================
+# Límites (en ms) de los buckets del histograma de latencia.
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Fracción de requests que se perfilan con cProfile (0 = desactivado).
+PROFILE_MUESTREO = float(os.environ.get("BIOLABHUB_PROFILE_MUESTREO", "0"))
+# Solo se guarda el perfil si el request tardó al menos esto.
+PROFILE_UMBRAL_MS = float(os.environ.get("BIOLABHUB_PROFILE_UMBRAL_MS", "500"))
+PROFILE_MAX_GUARDADOS = 20
+
+# Token opcional para que Prometheus pueda leer /metrics sin sesión.
+METRICS_TOKEN = os.environ.get("BIOLABHUB_METRICS_TOKEN")
+
+# "escritor": lo que corrieron los trabajos del request en el hilo escritor.
+CATEGORIAS_TIEMPO = ("bcrypt", "fernet", "plantillas", "escritor")
+
+
+# ========================================
+#  ESTRUCTURAS
+# ========================================
+class Histograma:
+    def __init__(self, limites=BUCKETS_MS):
+        self.limites = limites
+        self.cuentas = [0] * (len(limites) + 1)
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.limites):
+            if valor <= limite:
+                self.cuentas[i] += 1
+                break
+        else:
+            self.cuentas[-1] += 1
+        self.suma += valor
+        self.total += 1
+
+    def percentil(self, p):
+        # Aproximación por bucket: devuelve el límite superior del bucket
+        # donde cae el percentil pedido.
+        if not self.total:
+            return 0
+        objetivo = self.total * p / 100.0
+        acumulado = 0
+        for i, cuenta in enumerate(self.cuentas):
+            acumulado += cuenta
+            if acumulado >= objetivo:
+                return self.limites[i] if i < len(self.limites) else float("inf")
+        return float("inf")
+
+
+class MetricasEndpoint:
+    def __init__(self):
+        self.latencia = Histograma()
+        self.requests = 0
+        self.errores = 0
+        self.sql = 0
+        self.conexiones = 0
+        self.filas = 0
+        self.tiempos = {c: 0.0 for c in CATEGORIAS_TIEMPO}
+
+
+class MedicionRequest:
+    def __init__(self):
+        self.inicio = time.perf_counter()
+        self.sql = 0
+        self.conexiones = 0
+        self.filas = 0
+        self.tiempos = {c: 0.0 for c in CATEGORIAS_TIEMPO}
+        self.plantillas_inicio = []
+        self.profiler = None
+        self.diferido = False
+
+
+_lock = threading.Lock()
+_profile_lock = threading.Lock()
+_por_endpoint = {}
+_perfiles = deque(maxlen=PROFILE_MAX_GUARDADOS)
+_contadores_extra = {}
+_local = threading.local()
+
+
+def _actual():
+    return getattr(_local, "medicion", None)
+
+
+# ========================================
+#  HOOKS PARA EL RESTO DE LOS MÓDULOS
+# ========================================
+def instrumentar_conexion(conn):
+    # Se llama desde conectar_bd(); fuera de un request medido no hace nada.
+    m = _actual()
+    if m is None or conn is None:
+        return conn
+    m.conexiones += 1
+
+    def contar_sql(_sentencia):
+        m.sql += 1
+
+    conn.set_trace_callback(contar_sql)
+
+    fabrica = conn.row_factory
+
+    def contar_fila(cursor, fila):
+        m.filas += 1
+        return fabrica(cursor, fila) if fabrica else fila
+
+    conn.row_factory = contar_fila
+    return conn
+
+
+def instrumentar_escritor(conn):
+    # La conexión del hilo escritor vive más que cualquier request: cuenta
+    # en la medición del trabajo que esté corriendo (ver atribuir()).
+    def contar_sql(_sentencia):
+        m = _actual()
+        if m is not None:
+            m.sql += 1
+
+    conn.set_trace_callback(contar_sql)
+
+    fabrica = conn.row_factory
+
+    def contar_fila(cursor, fila):
+        m = _actual()
+        if m is not None:
+            m.filas += 1
+        return fabrica(cursor, fila) if fabrica else fila
+
+    conn.row_factory = contar_fila
+    return conn
+
+
+def medicion_actual():
+    # Para pasar la medición del request a otro hilo (escritor.enviar()).
+    return _actual()
+
+
+@contextmanager
+def atribuir(m):
+    # Corre el bloque en otro hilo sumando sus SQL, filas y tiempo
+    # ("escritor") a la medición m del request que lo encargó.
+    if m is None:
+        yield
+        return
+    anterior = _actual()
+    _local.medicion = m
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        m.tiempos["escritor"] = m.tiempos.get("escritor", 0.0) + (time.perf_counter() - inicio) * 1000
+        _local.medicion = anterior
+
+
+@contextmanager
+def medir(categoria):
+    m = _actual()
+    if m is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        m.tiempos[categoria] = m.tiempos.get(categoria, 0.0) + (time.perf_counter() - inicio) * 1000
+
+
+def diferir_fin():
+    # Respuestas en streaming (flujo_json.py): las consultas corren después
+    # de que vuelve la vista. stream_with_context vuelve a correr los
+    # teardown al terminar el envío; la medición se cierra recién ahí.
+    m = _actual()
+    if m is not None:
+        m.diferido = True
+
+
+def incrementar(nombre, cantidad=1):
+    # Contadores sueltos (no asociados a un endpoint) que se publican en /metrics.
+    with _lock:
+        _contadores_extra[nombre] = _contadores_extra.get(nombre, 0) + cantidad
+
+
+# ========================================
+#  CICLO DEL REQUEST
+# ========================================
+def _antes_del_request():
+    m = MedicionRequest()
+    _local.medicion = m
+    if PROFILE_MUESTREO > 0 and random.random() < PROFILE_MUESTREO:
+        # cProfile no admite dos perfiles activos a la vez: si otro request
+        # ya se está perfilando, este se salta.
+        if _profile_lock.acquire(blocking=False):
+            m.profiler = cProfile.Profile()
+            m.profiler.enable()
+
+
+def _fin_del_request(error=None):
+    m = _actual()
+    if m is None:
+        return
+    if m.diferido:
+        m.diferido = False
+        return
+    _local.medicion = None
+    duracion_ms = (time.perf_counter() - m.inicio) * 1000
+    endpoint = request.endpoint or "<sin_endpoint>"
+
+    if m.profiler is not None:
+        m.profiler.disable()
+        _profile_lock.release()
+        if duracion_ms >= PROFILE_UMBRAL_MS:
+            salida = io.StringIO()
+            pstats.Stats(m.profiler, stream=salida).sort_stats("cumulative").print_stats(30)
+            _perfiles.appendleft({
+                "endpoint": endpoint,
+                "ruta": request.path,
+                "duracion_ms": round(duracion_ms, 2),
+                "fecha": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "texto": salida.getvalue(),
+            })
+
+    with _lock:
+        agregado = _por_endpoint.get(endpoint)
+        if agregado is None:
+            agregado = _por_endpoint[endpoint] = MetricasEndpoint()
+        agregado.latencia.observar(duracion_ms)
+        agregado.requests += 1
+        if error is not None:
+            agregado.errores += 1
+        agregado.sql += m.sql
+        agregado.conexiones += m.conexiones
+        agregado.filas += m.filas
+        for categoria, valor in m.tiempos.items():
+            agregado.tiempos[categoria] = agregado.tiempos.get(categoria, 0.0) + valor
+
+
+def _antes_de_plantilla(sender, template, context, **extra):
+    m = _actual()
+    if m is not None:
+        m.plantillas_inicio.append(time.perf_counter())
+
+
+def _plantilla_renderizada(sender, template, context, **extra):
+    m = _actual()
+    if m is not None and m.plantillas_inicio:
+        inicio = m.plantillas_inicio.pop()
+        m.tiempos["plantillas"] += (time.perf_counter() - inicio) * 1000
+
+
+def init_app(app):
+    app.before_request(_antes_del_request)
+    app.teardown_request(_fin_del_request)
+    before_render_template.connect(_antes_de_plantilla, app)
+    template_rendered.connect(_plantilla_renderizada, app)
+    app.add_url_rule("/metrics", "metrics", metrics_prometheus)
+
+
+# ========================================
+#  CONSULTA Y EXPORTACIÓN
+# ========================================
+def resumen():
+    with _lock:
+        filas = []
+        for endpoint, a in sorted(_por_endpoint.items()):
+            n = a.requests or 1
+            filas.append({
+                "endpoint": endpoint,
+                "requests": a.requests,
+                "errores": a.errores,
+                "promedio_ms": round(a.latencia.suma / n, 2),
+                "p50_ms": a.latencia.percentil(50),
+                "p95_ms": a.latencia.percentil(95),
+                "p99_ms": a.latencia.percentil(99),
+                "sql_por_request": round(a.sql / n, 2),
+                "conexiones_por_request": round(a.conexiones / n, 2),
+                "filas_por_request": round(a.filas / n, 2),
+                "bcrypt_ms": round(a.tiempos["bcrypt"] / n, 2),
+                "fernet_ms": round(a.tiempos["fernet"] / n, 2),
+                "plantillas_ms": round(a.tiempos["plantillas"] / n, 2),
+                "escritor_ms": round(a.tiempos["escritor"] / n, 2),
+            })
+        return filas
+
+
+def perfiles():
+    with _lock:
+        return list(_perfiles)
+
+
+def contadores():
+    with _lock:
+        return dict(_contadores_extra)
+
+
+def formato_prometheus():
+    lineas = []
+    with _lock:
+        items = sorted(_por_endpoint.items())
+        extra = sorted(_contadores_extra.items())
+
+    lineas.append("# HELP biolabhub_request_duration_ms Duración de los requests por endpoint.")
+    lineas.append("# TYPE biolabhub_request_duration_ms histogram")
+    for endpoint, a in items:
+        acumulado = 0
+        for limite, cuenta in zip(a.latencia.limites, a.latencia.cuentas):
+            acumulado += cuenta
+            lineas.append(f'biolabhub_request_duration_ms_bucket{{endpoint="{endpoint}",le="{limite}"}} {acumulado}')
+        lineas.append(f'biolabhub_request_duration_ms_bucket{{endpoint="{endpoint}",le="+Inf"}} {a.latencia.total}')
+        lineas.append(f'biolabhub_request_duration_ms_sum{{endpoint="{endpoint}"}} {a.latencia.suma:.3f}')
+        lineas.append(f'biolabhub_request_duration_ms_count{{endpoint="{endpoint}"}} {a.latencia.total}')
+
+    contadores_endpoint = (
+        ("biolabhub_request_errors_total", "errores"),
+        ("biolabhub_sql_statements_total", "sql"),
+        ("biolabhub_db_connections_total", "conexiones"),
+        ("biolabhub_db_rows_fetched_total", "filas"),
+    )
+    for nombre, atributo in contadores_endpoint:
+        lineas.append(f"# TYPE {nombre} counter")
+        for endpoint, a in items:
+            lineas.append(f'{nombre}{{endpoint="{endpoint}"}} {getattr(a, atributo)}')
+
+    lineas.append("# TYPE biolabhub_time_spent_ms_total counter")
+    for endpoint, a in items:
+        for categoria, valor in a.tiempos.items():
+            lineas.append(f'biolabhub_time_spent_ms_total{{endpoint="{endpoint}",categoria="{categoria}"}} {valor:.3f}')
+
+    for nombre, valor in extra:
+        lineas.append(f"# TYPE biolabhub_{nombre} counter")
+        lineas.append(f"biolabhub_{nombre} {valor}")
+
+    return "\n".join(lineas) + "\n"
+
+
+def metrics_prometheus():
+    autorizado = session.get("rol") == "admin"
+    if not autorizado and METRICS_TOKEN:
+        autorizado = request.headers.get("Authorization") == f"Bearer {METRICS_TOKEN}"
+    if not autorizado:
+        return Response("No autorizado\n", status=403, mimetype="text/plain")
+    return Response(formato_prometheus(), mimetype="text/plain; version=0.0.4")
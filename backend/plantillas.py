@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from db import BASE_DIR
+
+
+# ========================================
+#  CACHE DE PLANTILLAS
+# ========================================
+# Bytecode: cada worker nuevo compilaba de cero todas las plantillas. Con
+# FileSystemBytecodeCache el código compilado queda en disco y se reusa
+# mientras el fuente no cambie (Jinja compara el checksum).
+#
+# Fragmentos: {% cache "grupo", ttl, extra... %} ... {% endcache %} guarda
+# el HTML del bloque en memoria. El grupo se invalida con los mismos
+# broadcasts Socket.IO que ya avisan a los clientes de cada escritura (ver
+# GRUPOS_POR_EVENTO; se llaman después del commit) o a mano con
+# invalidar(). El ttl acota lo viejo que puede quedar un fragmento cuando
+# la escritura vino de otro worker, que no pasa por nuestro emit().
+#
+# Para que un fragmento en cache ahorre también las consultas, la vista
+# pasa los datos envueltos en Perezoso: la consulta corre recién si la
+# plantilla los usa.
+BYTECODE_DIR = os.environ.get("BIOLABHUB_JINJA_CACHE", os.path.join(BASE_DIR, "frontend", ".jinja_cache"))
+CACHE_FRAGMENTOS = os.environ.get("BIOLABHUB_CACHE_FRAGMENTOS", "1") != "0"
+MAX_FRAGMENTOS = 256
+
+GRUPOS_POR_EVENTO = {
+    "nuevo_evento": ("muestras", "auditoria", "integridad"),
+    "refresh_calendar": ("auditoria", "integridad"),
+    "experimento_actualizado": ("auditoria", "integridad"),
+}
+
+_generaciones = {}
+_fragmentos = OrderedDict()
+_lock = threading.Lock()
+
+
+def invalidar(*grupos):
+    # Cambiar la generación deja inalcanzables las claves viejas; el LRU
+    # las termina sacando.
+    with _lock:
+        for grupo in grupos:
+            _generaciones[grupo] = _generaciones.get(grupo, 0) + 1
+
+
+def invalidar_por_evento(evento):
+    grupos = GRUPOS_POR_EVENTO.get(evento)
+    if grupos:
+        invalidar(*grupos)
+
+
+class Perezoso:
+    # Secuencia que ejecuta `consulta` la primera vez que se la recorre.
+    def __init__(self, consulta):
+        self._consulta = consulta
+        self._filas = None
+
+    def _cargar(self):
+        if self._filas is None:
+            self._filas = self._consulta()
+        return self._filas
+
+    def __iter__(self):
+        return iter(self._cargar())
+
+    def __len__(self):
+        return len(self._cargar())
+
+    def __bool__(self):
+        return bool(self._cargar())
+
+    def __getitem__(self, i):
+        return self._cargar()[i]
+
+
+class ExtensionCache(Extension):
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        # Plantilla y línea identifican el bloque: dos bloques con el mismo
+        # grupo no se pisan.
+        args = [nodes.Const(f"{parser.name}:{lineno}"), parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        cuerpo = parser.parse_statements(["name:endcache"], drop_needle=True)
+        return nodes.CallBlock(self.call_method("_renderizar", [nodes.List(args)]), [], [], cuerpo).set_lineno(lineno)
+
+    def _renderizar(self, args, caller):
+        bloque, grupo, ttl, *extra = args
+        if not CACHE_FRAGMENTOS:
+            return caller()
+        ahora = time.monotonic()
+        with _lock:
+            clave = (bloque, grupo, _generaciones.get(grupo, 0), *extra)
+            guardado = _fragmentos.get(clave)
+            if guardado and guardado[0] > ahora:
+                _fragmentos.move_to_end(clave)
+                return guardado[1]
+        html = caller()
+        with _lock:
+            _fragmentos[clave] = (ahora + ttl, html)
+            _fragmentos.move_to_end(clave)
+            while len(_fragmentos) > MAX_FRAGMENTOS:
+                _fragmentos.popitem(last=False)
+        return html
+
+
+def init_app(app):
+    try:
+        os.makedirs(BYTECODE_DIR, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(BYTECODE_DIR)
+    except OSError as e:
+        print("Sin cache de bytecode de plantillas:", e)
+    app.jinja_env.add_extension(ExtensionCache)
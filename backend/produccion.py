@@ -0,0 +1,155 @@
+# ========================================
+#  LANZADOR DE PRODUCCIÓN
+# ========================================
+# python servidor.py levanta el servidor de desarrollo (debug + reloader).
+# Para producción:
+#
+#   python produccion.py --async-mode gevent --port 5000
+#   python produccion.py --async-mode eventlet --workers 4 --message-queue redis://localhost:6379/0
+#
+# Con --workers N se levantan N procesos en puertos consecutivos
+# (5000, 5001, ...). Socket.IO necesita sesiones pegajosas, así que delante
+# va un balanceador con ip_hash (nginx) y todos comparten la cola de mensajes
+# para que los broadcasts lleguen a los clientes de cualquier worker. El
+# diario de eventos de Socket.IO va a la BD (ver diario.py) para que el seq
+# sea el mismo en todos.
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+MODOS = ("threading", "gevent", "eventlet")
+
+
+def _parsear_argumentos():
+    parser = argparse.ArgumentParser(description="BioLabHub en modo producción")
+    parser.add_argument("--async-mode", choices=MODOS,
+                        default=os.environ.get("BIOLABHUB_ASYNC_MODE", "threading"))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("BIOLABHUB_WORKERS", "1")))
+    parser.add_argument("--host", default=os.environ.get("BIOLABHUB_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("BIOLABHUB_PORT", "5000")))
+    parser.add_argument("--message-queue", default=os.environ.get("BIOLABHUB_MESSAGE_QUEUE"))
+    parser.add_argument("--drenado", type=float, default=float(os.environ.get("BIOLABHUB_DRENADO", "30")),
+                        help="segundos máximos para terminar tareas en segundo plano al apagar")
+    parser.add_argument("--verificar-cola", action="store_true",
+                        help="probar el reparto de broadcasts con la cola en memoria y salir")
+    return parser.parse_args()
+
+
+def _parchear(modo):
+    # El monkey patching tiene que ocurrir antes de importar Flask/servidor.
+    if modo == "gevent":
+        from gevent import monkey
+        monkey.patch_all()
+    elif modo == "eventlet":
+        import eventlet
+        eventlet.monkey_patch()
+
+
+def servir(args):
+    os.environ["BIOLABHUB_ASYNC_MODE"] = args.async_mode
+    if args.message_queue:
+        os.environ["BIOLABHUB_MESSAGE_QUEUE"] = args.message_queue
+    if args.async_mode != "threading":
+        # En modo green una espera de lock de sqlite frena el proceso entero:
+        # con WAL los lectores nunca esperan y el timeout de escritura es corto.
+        os.environ.setdefault("BIOLABHUB_DB_TIMEOUT", "1")
+    _parchear(args.async_mode)
+
+    import servidor
+    from db import activar_wal
+
+    app = servidor.obtener_app()
+    print(f" journal_mode={activar_wal()} async_mode={servidor.socketio.async_mode}")
+
+    def apagar(signum, frame):
+        print(f" Señal {signum} recibida. Esperando tareas en segundo plano...")
+        if not servidor.esperar_tareas_pendientes(args.drenado):
+            print(" Quedaron tareas sin terminar al vencer el tiempo de drenado.")
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, apagar)
+    signal.signal(signal.SIGINT, apagar)
+
+    opciones = {}
+    if args.async_mode == "threading":
+        # werkzeug con hilos; para más carga conviene gevent o eventlet
+        opciones["allow_unsafe_werkzeug"] = True
+    servidor.socketio.run(
+        app,
+        host=args.host,
+        port=args.port,
+        debug=False,
+        use_reloader=False,
+        log_output=False,
+        **opciones
+    )
+
+
+def lanzar_workers(args):
+    if not args.message_queue or args.message_queue.startswith("memoria://"):
+        sys.exit("Con más de un worker hace falta --message-queue compartida (redis://, amqp://...).")
+
+    hijos = []
+    for i in range(args.workers):
+        comando = [
+            sys.executable, os.path.abspath(__file__),
+            "--async-mode", args.async_mode,
+            "--workers", "1",
+            "--host", args.host,
+            "--port", str(args.port + i),
+            "--message-queue", args.message_queue,
+            "--drenado", str(args.drenado),
+        ]
+        entorno = dict(os.environ, BIOLABHUB_WORKER=str(i), BIOLABHUB_DIARIO_PERSISTENTE="1")
+        hijos.append(subprocess.Popen(comando, env=entorno))
+        print(f" Worker {i} (pid {hijos[-1].pid}) en {args.host}:{args.port + i}")
+
+    print(" upstream biolabhub { ip_hash; " +
+          " ".join(f"server 127.0.0.1:{args.port + i};" for i in range(args.workers)) + " }")
+    # Los estáticos con huella los sirve nginx directo desde DIST: nunca
+    # llegan a los workers.
+    from estaticos import DIST, CACHE_INMUTABLE
+    print(f" location ^~ /static/ {{ alias {DIST}/; gzip_static on; "
+          f"add_header Cache-Control \"{CACHE_INMUTABLE}\"; add_header Vary Accept-Encoding; }}")
+
+    def apagar(signum, frame):
+        for hijo in hijos:
+            if hijo.poll() is None:
+                hijo.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, apagar)
+    signal.signal(signal.SIGINT, apagar)
+
+    # Si un worker muere se apagan todos: el orquestador (systemd, docker)
+    # se encarga de reiniciar el conjunto.
+    while all(h.poll() is None for h in hijos):
+        time.sleep(0.5)
+    apagar(signal.SIGTERM, None)
+
+    limite = time.time() + args.drenado + 5
+    for hijo in hijos:
+        try:
+            hijo.wait(max(0, limite - time.time()))
+        except subprocess.TimeoutExpired:
+            hijo.kill()
+    sys.exit(max((h.returncode or 0) for h in hijos))
+
+
+def main():
+    args = _parsear_argumentos()
+    if args.verificar_cola:
+        from cola_mensajes import verificar_cola_local
+        ok = verificar_cola_local()
+        print(" Broadcast entre workers:", "OK" if ok else "FALLÓ")
+        sys.exit(0 if ok else 1)
+    if args.workers > 1:
+        lanzar_workers(args)
+    else:
+        servir(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+import heapq
+import os
+import uuid
+from datetime import date, datetime, timedelta
+from threading import Event, Lock
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+
+from db import (
+    conectar_bd,
+    ejecutar_select,
+    calcular_dvh,
+    sumar_dvv,
+    registrar_auditoria_en,
+)
+import escritor
+
+reactivos_bp = Blueprint("reactivos_bp", __name__)
+
+# Días de anticipación para avisar que un reactivo está por vencer.
+AVISO_CADUCIDAD_DIAS = int(os.environ.get("BIOLABHUB_AVISO_CADUCIDAD_DIAS", "15"))
+# Cada cuánto se vuelcan los movimientos nuevos a saldos_reactivos.
+MATERIALIZAR_CADA = int(os.environ.get("BIOLABHUB_MATERIALIZAR_CADA", "300"))
+# Cada cuánto se vuelve a consultar el índice de caducidad.
+RECARGAR_CADA = 3600
+
+
+# ========================================
+#  SALDOS
+# ========================================
+# Stock = saldo materializado + movimientos posteriores a hasta_movimiento.
+# El índice (reactivo_id, id) hace que la parte no materializada sea un
+# rango corto, así que leer el stock no depende del largo del libro.
+STOCK_SQL = """
+    COALESCE(s.saldo, 0) + COALESCE((
+        SELECT SUM(m.cantidad) FROM movimientos_reactivos m
+        WHERE m.reactivo_id = r.id AND m.id > COALESCE(s.hasta_movimiento, 0)
+    ), 0)
+"""
+
+
+def listar_reactivos():
+    return ejecutar_select(f"""
+        SELECT r.id, r.nombre, r.fecha_caducidad, r.proovedor, r.stock_minimo,
+               {STOCK_SQL} AS stock
+        FROM reactivos r
+        LEFT JOIN saldos_reactivos s ON s.reactivo_id = r.id
+        WHERE r.estado_logico = 0
+        ORDER BY r.nombre ASC
+    """)
+
+
+def stock_de(cursor, ids):
+    marcas = ", ".join("?" * len(ids))
+    cursor.execute(f"""
+        SELECT r.id, r.nombre, r.stock_minimo, {STOCK_SQL} AS stock
+        FROM reactivos r
+        LEFT JOIN saldos_reactivos s ON s.reactivo_id = r.id
+        WHERE r.estado_logico = 0 AND r.id IN ({marcas})
+    """, tuple(ids))
+    return {fila["id"]: fila for fila in cursor.fetchall()}
+
+
+def por_vencer(dias, conn=None):
+    # Usa idx_reactivos_caducidad (índice parcial sobre estado_logico = 0).
+    limite = (date.today() + timedelta(days=dias)).isoformat()
+    propia = conn is None
+    conn = conn or conectar_bd()
+    filas = conn.execute("""
+        SELECT id, nombre, fecha_caducidad FROM reactivos
+        WHERE estado_logico = 0 AND fecha_caducidad IS NOT NULL AND fecha_caducidad <= ?
+        ORDER BY fecha_caducidad ASC
+    """, (limite,)).fetchall()
+    if propia:
+        conn.close()
+    return filas
+
+
+def materializar_saldos():
+    escritor.ejecutar(lambda cursor: cursor.execute("""
+        INSERT INTO saldos_reactivos (reactivo_id, saldo, hasta_movimiento)
+        SELECT m.reactivo_id, COALESCE(s.saldo, 0) + SUM(m.cantidad), MAX(m.id)
+        FROM movimientos_reactivos m
+        LEFT JOIN saldos_reactivos s ON s.reactivo_id = m.reactivo_id
+        WHERE m.id > COALESCE(s.hasta_movimiento, 0)
+        GROUP BY m.reactivo_id
+        ON CONFLICT(reactivo_id) DO UPDATE SET
+            saldo = excluded.saldo, hasta_movimiento = excluded.hasta_movimiento
+    """))
+
+
+# ========================================
+#  MOVIMIENTOS (INGRESO / CONSUMO EN LOTE)
+# ========================================
+def _fila_movimiento(reactivo_id, tipo, cantidad, lote, operacion, usuario_id, fecha):
+    datos = {
+        "reactivo_id": reactivo_id,
+        "tipo": tipo,
+        "cantidad": cantidad,
+        "lote": lote,
+        "operacion": operacion,
+        "usuario_id": usuario_id,
+        "fecha": fecha,
+    }
+    return (*datos.values(), calcular_dvh(datos))
+
+
+def registrar_movimientos(tipo, items, usuario_id, ip_origen):
+    # items: [(reactivo_id, cantidad, lote), ...]. Todo en una transacción:
+    # o entran todos los movimientos o ninguno. Un solo registro de
+    # auditoría y una sola actualización de DVV por operación.
+    if not items:
+        raise ValueError("No se indicaron reactivos.")
+    for _, cantidad, _ in items:
+        if cantidad <= 0:
+            raise ValueError("Las cantidades deben ser positivas.")
+    signo = 1 if tipo == "INGRESO" else -1
+    ids = sorted({reactivo_id for reactivo_id, _, _ in items})
+    operacion = uuid.uuid4().hex
+    fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    def mover(cursor):
+        # El trabajo corre con el lock de escritura ya tomado antes de leer
+        # el stock, así dos consumos simultáneos no pueden dejarlo negativo.
+        stock = stock_de(cursor, ids)
+        faltantes = [i for i in ids if i not in stock]
+        if faltantes:
+            raise ValueError(f"Reactivos inexistentes: {', '.join(map(str, faltantes))}")
+
+        pedido = {}
+        for reactivo_id, cantidad, _ in items:
+            pedido[reactivo_id] = pedido.get(reactivo_id, 0) + cantidad
+        if signo < 0:
+            insuficientes = [stock[i]["nombre"] for i, c in pedido.items() if stock[i]["stock"] < c]
+            if insuficientes:
+                raise ValueError(f"Stock insuficiente: {', '.join(insuficientes)}")
+
+        filas = [
+            _fila_movimiento(reactivo_id, tipo, signo * cantidad, lote, operacion, usuario_id, fecha)
+            for reactivo_id, cantidad, lote in items
+        ]
+        cursor.executemany("""
+            INSERT INTO movimientos_reactivos
+                (reactivo_id, tipo, cantidad, lote, operacion, usuario_id, fecha, dvh)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, filas)
+        sumar_dvv(cursor, "movimientos_reactivos", sum(f[-1] for f in filas))
+        cursor.execute("SELECT MIN(id) FROM movimientos_reactivos WHERE operacion = ?", (operacion,))
+        primer_id = cursor.fetchone()[0]
+        registrar_auditoria_en(
+            cursor, usuario_id, f"{tipo} REACTIVOS ({len(filas)})",
+            "movimientos_reactivos", primer_id, ip_origen,
+        )
+        return stock, pedido, filas
+
+    stock, pedido, filas = escritor.ejecutar(mover)
+
+    nuevos = {i: stock[i]["stock"] + signo * c for i, c in pedido.items()}
+    planificador.revisar_stock([(i, stock[i]["nombre"], nuevos[i], stock[i]["stock_minimo"]) for i in nuevos])
+    return {"operacion": operacion, "movimientos": len(filas), "stock": nuevos}
+
+
+def crear_reactivo(nombre, stock_inicial, fecha_caducidad, proovedor, stock_minimo, usuario_id, ip_origen):
+    def insertar(cursor):
+        cursor.execute("""
+            INSERT INTO reactivos (nombre, stock, fecha_caducidad, proovedor, responsable_id, stock_minimo, estado_logico)
+            VALUES (?, ?, ?, ?, ?, ?, 0)
+        """, (nombre, stock_inicial, fecha_caducidad, proovedor, usuario_id, stock_minimo))
+        nuevo_id = cursor.lastrowid
+        cursor.execute("SELECT * FROM reactivos WHERE id = ?", (nuevo_id,))
+        datos = {k: v for k, v in dict(cursor.fetchone()).items() if k not in ("id", "dvh")}
+        dvh = calcular_dvh(datos)
+        cursor.execute("UPDATE reactivos SET dvh = ? WHERE id = ?", (dvh, nuevo_id))
+        sumar_dvv(cursor, "reactivos", dvh)
+        # El stock inicial entra como primer movimiento del libro.
+        cursor.execute("INSERT INTO saldos_reactivos (reactivo_id, saldo, hasta_movimiento) VALUES (?, 0, 0)", (nuevo_id,))
+        if stock_inicial:
+            fila = _fila_movimiento(nuevo_id, "INGRESO", stock_inicial, None, uuid.uuid4().hex, usuario_id,
+                                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            cursor.execute("""
+                INSERT INTO movimientos_reactivos
+                    (reactivo_id, tipo, cantidad, lote, operacion, usuario_id, fecha, dvh)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, fila)
+            sumar_dvv(cursor, "movimientos_reactivos", fila[-1])
+        registrar_auditoria_en(cursor, usuario_id, "CREAR REACTIVO", "reactivos", nuevo_id, ip_origen)
+        return nuevo_id
+
+    nuevo_id = escritor.ejecutar(insertar)
+    planificador.recargar_pronto()
+    return nuevo_id
+
+
+# ========================================
+#  ALERTAS DE CADUCIDAD Y STOCK BAJO
+# ========================================
+class PlanificadorAlertas:
+    # Cola de prioridad (heap) de tareas por momento de ejecución: avisos de
+    # caducidad en la fecha en que corresponden y las tareas periódicas de
+    # materializar saldos y recargar caducidades. Un único hilo en segundo
+    # plano duerme hasta la próxima.
+    def __init__(self):
+        self._heap = []
+        self._secuencia = 0
+        self._lock = Lock()
+        self._despertar = Event()
+        self._avisados = set()
+        self._activo = False
+        self._socketio = None
+
+    def programar(self, momento, tarea, *args):
+        if not self._activo:
+            return
+        with self._lock:
+            self._secuencia += 1
+            heapq.heappush(self._heap, (momento, self._secuencia, tarea, args))
+        self._despertar.set()
+
+    def recargar_pronto(self):
+        # Recarga suelta (reactivo nuevo): no reprograma, la periódica sigue aparte.
+        self.programar(datetime.now(), "recargar", False)
+
+    def revisar_stock(self, reactivos):
+        # reactivos: [(id, nombre, stock, stock_minimo), ...] tras un movimiento.
+        # Se avisa directo desde el worker que hizo el movimiento (el
+        # planificador solo corre en el worker 0); la cola de mensajes lo
+        # reparte a todos los clientes.
+        for reactivo_id, nombre, stock, minimo in reactivos:
+            if minimo and stock <= minimo:
+                if ("stock_bajo", reactivo_id) in self._avisados:
+                    continue
+                self._avisados.add(("stock_bajo", reactivo_id))
+                self._emitir("stock_bajo", reactivo_id, f"Stock bajo de '{nombre}': {stock} (mínimo {minimo}).",
+                             stock=stock, stock_minimo=minimo)
+            else:
+                self._avisados.discard(("stock_bajo", reactivo_id))
+
+    def iniciar(self, socketio):
+        if self._activo:
+            return
+        self._activo = True
+        self._socketio = socketio
+        ahora = datetime.now()
+        self.programar(ahora, "recargar", True)
+        self.programar(ahora + timedelta(seconds=MATERIALIZAR_CADA), "materializar")
+        socketio.start_background_task(self._bucle)
+
+    def _bucle(self):
+        while True:
+            with self._lock:
+                espera = (self._heap[0][0] - datetime.now()).total_seconds() if self._heap else RECARGAR_CADA
+            if espera > 0:
+                self._despertar.wait(min(espera, RECARGAR_CADA))
+                self._despertar.clear()
+                continue
+            with self._lock:
+                _, _, tarea, args = heapq.heappop(self._heap)
+            try:
+                getattr(self, f"_tarea_{tarea}")(*args)
+            except Exception as e:
+                print(f"Error en tarea de reactivos '{tarea}':", e)
+
+    def _emitir(self, tipo, reactivo_id, mensaje, **extra):
+        socketio = self._socketio
+        if socketio is None:
+            from servidor import socketio
+        socketio.emit("alerta_reactivo", {"tipo": tipo, "reactivo_id": reactivo_id, "mensaje": mensaje, **extra})
+
+    def _tarea_materializar(self):
+        materializar_saldos()
+        self.programar(datetime.now() + timedelta(seconds=MATERIALIZAR_CADA), "materializar")
+
+    def _tarea_recargar(self, periodica):
+        hoy = date.today()
+        for fila in por_vencer(AVISO_CADUCIDAD_DIAS):
+            caducidad = date.fromisoformat(str(fila["fecha_caducidad"])[:10])
+            if caducidad > hoy:
+                if self._avisar_una_vez("por_vencer", fila["id"], fila["fecha_caducidad"],
+                                        f"'{fila['nombre']}' vence el {caducidad.isoformat()}."):
+                    self.programar(datetime.combine(caducidad, datetime.min.time()), "vencido", fila["id"])
+            else:
+                self._tarea_vencido(fila["id"])
+        # Los reactivos que entran en la ventana de aviso después del
+        # arranque se toman en la próxima pasada.
+        if periodica:
+            self.programar(datetime.now() + timedelta(seconds=RECARGAR_CADA), "recargar", True)
+
+    def _tarea_vencido(self, reactivo_id):
+        # Se relee la fila: puede haberse dado de baja o cambiado la fecha.
+        filas = ejecutar_select(
+            "SELECT nombre, fecha_caducidad FROM reactivos WHERE id = ? AND estado_logico = 0", (reactivo_id,)
+        )
+        if not filas or str(filas[0]["fecha_caducidad"])[:10] > date.today().isoformat():
+            return
+        self._avisar_una_vez("vencido", reactivo_id, filas[0]["fecha_caducidad"],
+                             f"'{filas[0]['nombre']}' está vencido.")
+
+    def _avisar_una_vez(self, tipo, reactivo_id, fecha, mensaje):
+        clave = (tipo, reactivo_id, fecha)
+        if clave in self._avisados:
+            return False
+        self._avisados.add(clave)
+        self._emitir(tipo, reactivo_id, mensaje, fecha_caducidad=fecha)
+        return True
+
+
+planificador = PlanificadorAlertas()
+
+
+def iniciar_alertas(socketio):
+    # Con varios workers (produccion.py) las alertas salen de uno solo, si
+    # no cada cliente las recibiría repetidas por la cola de mensajes.
+    if os.environ.get("BIOLABHUB_WORKER", "0") == "0":
+        planificador.iniciar(socketio)
+
+
+# ========================================
+#  RUTAS
+# ========================================
+def _leer_items():
+    # JSON: {"items": [{"reactivo_id": 1, "cantidad": 5, "lote": "L-01"}, ...]}
+    # Formulario: reactivo_id, cantidad y lote repetidos, uno por fila.
+    if request.is_json:
+        crudos = (request.get_json(silent=True) or {}).get("items") or []
+    else:
+        ids = request.form.getlist("reactivo_id")
+        cantidades = request.form.getlist("cantidad")
+        lotes = request.form.getlist("lote") + [""] * len(ids)
+        crudos = [
+            {"reactivo_id": r, "cantidad": c, "lote": l}
+            for r, c, l in zip(ids, cantidades, lotes)
+            if r and c
+        ]
+    try:
+        return [(int(i["reactivo_id"]), int(i["cantidad"]), (i.get("lote") or None)) for i in crudos]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Formato de items inválido.")
+
+
+def _operacion(tipo):
+    if "usuario_id" not in session:
+        if request.is_json:
+            return jsonify({"error": "No autenticado."}), 401
+        flash("Debes iniciar sesión primero.", "error")
+        return redirect(url_for("login_bp.login"))
+    try:
+        resultado = registrar_movimientos(tipo, _leer_items(), session["usuario_id"], request.remote_addr)
+    except ValueError as e:
+        if request.is_json:
+            return jsonify({"error": str(e)}), 400
+        flash(str(e), "error")
+        return redirect(url_for("reactivos_bp.reagents"))
+
+    from servidor import socketio
+    socketio.emit("nuevo_evento", f"{tipo.capitalize()} de reactivos: {resultado['movimientos']} movimiento(s).")
+    if request.is_json:
+        return jsonify(resultado)
+    flash("Movimientos registrados correctamente.", "success")
+    return redirect(url_for("reactivos_bp.reagents"))
+
+
+@reactivos_bp.route("/reagents")
+def reagents():
+    if "usuario_id" not in session:
+        flash("Debes iniciar sesión primero.", "error")
+        return redirect(url_for("login_bp.login"))
+    return render_template(
+        "reagents/Reagents.html",
+        reactivos=listar_reactivos(),
+        por_vencer=por_vencer(AVISO_CADUCIDAD_DIAS),
+        aviso_dias=AVISO_CADUCIDAD_DIAS,
+    )
+
+
+@reactivos_bp.route("/reagents/add", methods=["POST"])
+def add_reagent():
+    if "usuario_id" not in session:
+        flash("Debes iniciar sesión primero.", "error")
+        return redirect(url_for("login_bp.login"))
+    nombre = request.form.get("nombre", "").strip()
+    if not nombre:
+        flash("El nombre es obligatorio.", "error")
+        return redirect(url_for("reactivos_bp.reagents"))
+    crear_reactivo(
+        nombre,
+        max(request.form.get("stock", 0, type=int), 0),
+        request.form.get("fecha_caducidad") or None,
+        request.form.get("proovedor"),
+        max(request.form.get("stock_minimo", 0, type=int), 0),
+        session["usuario_id"],
+        request.remote_addr,
+    )
+    from servidor import socketio
+    socketio.emit("nuevo_evento", f"Nuevo reactivo: {nombre}")
+    flash("Reactivo creado correctamente.", "success")
+    return redirect(url_for("reactivos_bp.reagents"))
+
+
+@reactivos_bp.route("/reagents/receive", methods=["POST"])
+def receive_reagents():
+    return _operacion("INGRESO")
+
+
+@reactivos_bp.route("/reagents/consume", methods=["POST"])
+def consume_reagents():
+    return _operacion("CONSUMO")
+
+
+@reactivos_bp.route("/reagents/expiring")
+def expiring_reagents():
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    dias = min(max(request.args.get("dias", AVISO_CADUCIDAD_DIAS, type=int), 0), 3650)
+    return jsonify([dict(f) for f in por_vencer(dias)])
+
+
+@reactivos_bp.route("/reagents/<int:id>/movements")
+def reagent_movements(id):
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    limite = min(max(request.args.get("limite", 100, type=int), 1), 1000)
+    antes_de = request.args.get("antes_de", type=int)
+    filas = ejecutar_select("""
+        SELECT m.id, m.tipo, m.cantidad, m.lote, m.operacion, m.fecha, u.nombre AS usuario
+        FROM movimientos_reactivos m
+        LEFT JOIN usuarios u ON u.id = m.usuario_id
+        WHERE m.reactivo_id = ? AND m.id < ?
+        ORDER BY m.id DESC
+        LIMIT ?
+    """, (id, antes_de or 2 ** 62, limite))
+    return jsonify([dict(f) for f in filas])
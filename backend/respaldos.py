@@ -0,0 +1,350 @@
+# ========================================
+#  RESPALDOS EN LÍNEA
+# ========================================
+# Copia la BD con la API de backup de SQLite mientras el servidor atiende:
+# se copian PAGINAS_POR_PASO páginas por paso con una pausa entre pasos,
+# así ningún lock se sostiene más que un paso.
+#
+# - Con WAL la conexión de origen mantiene abierta una transacción de
+#   lectura durante toda la copia: todos los pasos leen la misma foto y
+#   los escritores siguen commiteando en el WAL sin reiniciar la copia.
+# - Sin WAL una escritura de otra conexión reinicia la copia desde cero;
+#   después de MAX_REINICIOS se copia de una sola vez (bloquea escrituras
+#   lo que dure esa copia).
+#
+# Cada snapshot es un manifiesto JSON que lista bloques de BLOQUE_PAGINAS
+# páginas guardados por su SHA-256: los bloques que no cambiaron desde el
+# snapshot anterior no se vuelven a escribir, así un snapshot nuevo ocupa
+# solo lo que cambió. Antes de guardarse cada copia pasa PRAGMA quick_check
+# y se recalcula el DVV de cada tabla contra verificaciones_verticales.
+#
+# En modo sharding se respalda además cada lab_<id>.db (cada archivo es una
+# foto propia; no hay una foto atómica del conjunto).
+#
+#   python respaldos.py respaldar
+#   python respaldos.py listar
+#   python respaldos.py verificar 20260105-030000
+#   python respaldos.py restaurar 20260105-030000 [--destino DIR]
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from db import BASE_DIR, DB_PATH, DB_TIMEOUT
+import shards
+
+RESPALDO_DIR = os.environ.get("BIOLABHUB_BACKUP_DIR", os.path.join(BASE_DIR, "respaldos"))
+PAGINAS_POR_PASO = int(os.environ.get("BIOLABHUB_BACKUP_PAGINAS", "256"))
+PAUSA_ENTRE_PASOS = float(os.environ.get("BIOLABHUB_BACKUP_PAUSA", "0.005"))
+MAX_REINICIOS = 5
+BLOQUE_PAGINAS = 64
+# Snapshots programados: cada cuántas horas (0 = solo a mano) y cuántos se conservan.
+CADA_H = float(os.environ.get("BIOLABHUB_BACKUP_CADA_H", "0"))
+CONSERVAR = int(os.environ.get("BIOLABHUB_BACKUP_CONSERVAR", "7"))
+
+
+class CopiaReiniciada(Exception):
+    pass
+
+
+def _dir(*partes):
+    ruta = os.path.join(RESPALDO_DIR, *partes)
+    os.makedirs(ruta, exist_ok=True)
+    return ruta
+
+
+def _archivos():
+    # (nombre en el manifiesto, ruta real)
+    return [
+        (os.path.basename(bd) if bd else "principal", bd or DB_PATH)
+        for bd in shards.todas()
+    ]
+
+
+def _ruta_real(nombre):
+    return DB_PATH if nombre == "principal" else os.path.join(shards.SHARD_DIR, nombre)
+
+
+# ----------------------------------------
+#  COPIA
+# ----------------------------------------
+def copiar_en_linea(origen, destino, paginas=PAGINAS_POR_PASO, pausa=PAUSA_ENTRE_PASOS):
+    src = sqlite3.connect(origen, timeout=DB_TIMEOUT, isolation_level=None)
+    dst = sqlite3.connect(destino)
+    estado = {"pasos": 0, "reinicios": 0, "modo": "pasos"}
+    restantes = [None]
+
+    def progreso(status, remaining, total):
+        estado["pasos"] += 1
+        if restantes[0] is not None and remaining > restantes[0]:
+            estado["reinicios"] += 1
+            if estado["reinicios"] > MAX_REINICIOS:
+                raise CopiaReiniciada()
+        restantes[0] = remaining
+
+    try:
+        wal = src.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        if wal:
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            estado["modo"] = "foto_wal"
+        try:
+            src.backup(dst, pages=paginas, progress=progreso, sleep=pausa)
+        except CopiaReiniciada:
+            estado["modo"] = "completa"
+            src.backup(dst)
+        if wal:
+            src.execute("COMMIT")
+        # La copia queda en modo rollback: un archivo suelto, sin -wal/-shm.
+        dst.execute("PRAGMA journal_mode=DELETE")
+        estado["paginas"] = dst.execute("PRAGMA page_count").fetchone()[0]
+        estado["tamano_pagina"] = dst.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    return estado
+
+
+def verificar_copia(ruta):
+    # Devuelve la lista de problemas (vacía si la copia está bien).
+    conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+    try:
+        problemas = [f"quick_check: {r[0]}" for r in conn.execute("PRAGMA quick_check") if r[0] != "ok"]
+        tablas = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "verificaciones_verticales" not in tablas:
+            return problemas
+        for tabla, registrado in conn.execute("SELECT tabla, dvv FROM verificaciones_verticales").fetchall():
+            if tabla not in tablas:
+                continue
+            calculado = conn.execute(
+                f'SELECT COALESCE(SUM(dvh), 0) FROM "{tabla}" WHERE dvh IS NOT NULL'
+            ).fetchone()[0]
+            if calculado != (registrado or 0):
+                problemas.append(f"DVV de {tabla}: registrado {registrado}, calculado {calculado}")
+        return problemas
+    finally:
+        conn.close()
+
+
+# ----------------------------------------
+#  BLOQUES
+# ----------------------------------------
+def _ruta_bloque(digest):
+    return os.path.join(RESPALDO_DIR, "bloques", digest[:2], digest)
+
+
+def _guardar_bloques(ruta, tamano_pagina):
+    ancho = tamano_pagina * BLOQUE_PAGINAS
+    bloques, nuevos = [], 0
+    with open(ruta, "rb") as f:
+        while True:
+            datos = f.read(ancho)
+            if not datos:
+                break
+            digest = hashlib.sha256(datos).hexdigest()
+            destino = _ruta_bloque(digest)
+            if not os.path.exists(destino):
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                with open(destino + ".tmp", "wb") as salida:
+                    salida.write(datos)
+                os.replace(destino + ".tmp", destino)
+                nuevos += len(datos)
+            bloques.append(digest)
+    return bloques, nuevos
+
+
+def _armar(bloques, destino):
+    with open(destino, "wb") as salida:
+        for digest in bloques:
+            with open(_ruta_bloque(digest), "rb") as f:
+                datos = f.read()
+            if hashlib.sha256(datos).hexdigest() != digest:
+                raise ValueError(f"Bloque {digest[:12]} dañado.")
+            salida.write(datos)
+
+
+# ----------------------------------------
+#  SNAPSHOTS
+# ----------------------------------------
+def tomar_snapshot(paginas=PAGINAS_POR_PASO, pausa=PAUSA_ENTRE_PASOS):
+    inicio = time.perf_counter()
+    nombre = datetime.now().strftime("%Y%m%d-%H%M%S")
+    manifiesto = {"nombre": nombre, "fecha": datetime.now().isoformat(timespec="seconds"), "archivos": {}}
+    total, nuevos = 0, 0
+    for clave, ruta in _archivos():
+        fd, temporal = tempfile.mkstemp(suffix=".db", dir=_dir("tmp"))
+        os.close(fd)
+        try:
+            copia = copiar_en_linea(ruta, temporal, paginas, pausa)
+            problemas = verificar_copia(temporal)
+            bloques, escritos = _guardar_bloques(temporal, copia["tamano_pagina"])
+            tamano = os.path.getsize(temporal)
+        finally:
+            os.remove(temporal)
+        manifiesto["archivos"][clave] = {
+            "tamano": tamano,
+            "tamano_pagina": copia["tamano_pagina"],
+            "bloques": bloques,
+            "modo": copia["modo"],
+            "reinicios": copia["reinicios"],
+            "problemas": problemas,
+        }
+        total += tamano
+        nuevos += escritos
+
+    segundos = time.perf_counter() - inicio
+    manifiesto.update({
+        "verificado": not any(a["problemas"] for a in manifiesto["archivos"].values()),
+        "bytes": total,
+        "bytes_nuevos": nuevos,
+        "segundos": round(segundos, 3),
+        "mb_por_segundo": round(total / 1048576 / max(segundos, 1e-6), 1),
+    })
+    ruta = os.path.join(_dir("snapshots"), f"{nombre}.json")
+    with open(ruta + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifiesto, f, indent=1)
+    os.replace(ruta + ".tmp", ruta)
+    aplicar_retencion()
+    return manifiesto
+
+
+def listar():
+    carpeta = _dir("snapshots")
+    snapshots = []
+    for archivo in sorted(os.listdir(carpeta)):
+        if archivo.endswith(".json"):
+            with open(os.path.join(carpeta, archivo), encoding="utf-8") as f:
+                snapshots.append(json.load(f))
+    return snapshots
+
+
+def leer(nombre):
+    ruta = os.path.join(RESPALDO_DIR, "snapshots", f"{nombre}.json")
+    if not os.path.exists(ruta):
+        raise ValueError(f"No existe el snapshot {nombre}.")
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def aplicar_retencion(conservar=CONSERVAR):
+    # Borra los snapshots más viejos y los bloques que ya nadie usa.
+    snapshots = listar()
+    for viejo in snapshots[:-conservar] if conservar > 0 else []:
+        os.remove(os.path.join(RESPALDO_DIR, "snapshots", f"{viejo['nombre']}.json"))
+    en_uso = {d for s in snapshots[-conservar:] for a in s["archivos"].values() for d in a["bloques"]}
+    borrados = 0
+    for raiz, _, archivos in os.walk(_dir("bloques")):
+        for archivo in archivos:
+            if archivo not in en_uso:
+                os.remove(os.path.join(raiz, archivo))
+                borrados += 1
+    return borrados
+
+
+def verificar_snapshot(nombre):
+    # Rearma cada archivo del snapshot y repite las verificaciones.
+    problemas = {}
+    for clave, archivo in leer(nombre)["archivos"].items():
+        fd, temporal = tempfile.mkstemp(suffix=".db", dir=_dir("tmp"))
+        os.close(fd)
+        try:
+            _armar(archivo["bloques"], temporal)
+            problemas[clave] = verificar_copia(temporal)
+        except ValueError as e:
+            problemas[clave] = [str(e)]
+        finally:
+            os.remove(temporal)
+    return problemas
+
+
+def restaurar(nombre, destino_dir=None):
+    # Sin destino_dir se pisa la BD en uso (conviene con el servidor
+    # detenido); la escritura va por la API de backup, así que un WAL
+    # existente queda consistente. Con destino_dir solo se rearman los
+    # archivos ahí.
+    manifiesto = leer(nombre)
+    restaurados = []
+    for clave, archivo in manifiesto["archivos"].items():
+        fd, temporal = tempfile.mkstemp(suffix=".db", dir=_dir("tmp"))
+        os.close(fd)
+        try:
+            _armar(archivo["bloques"], temporal)
+            problemas = verificar_copia(temporal)
+            if problemas:
+                raise ValueError(f"{clave}: " + "; ".join(problemas))
+            if destino_dir:
+                os.makedirs(destino_dir, exist_ok=True)
+                destino = os.path.join(destino_dir, "biolabhub.db" if clave == "principal" else clave)
+            else:
+                destino = _ruta_real(clave)
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+            src = sqlite3.connect(temporal)
+            dst = sqlite3.connect(destino, timeout=DB_TIMEOUT)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+                src.close()
+            restaurados.append(destino)
+        finally:
+            os.remove(temporal)
+    if not destino_dir:
+        import cache_consultas
+        cache_consultas.vaciar()
+    return restaurados
+
+
+# ----------------------------------------
+#  PROGRAMACIÓN
+# ----------------------------------------
+def _bucle():
+    while True:
+        time.sleep(CADA_H * 3600)
+        try:
+            m = tomar_snapshot()
+            print(f" Respaldo {m['nombre']}: {m['bytes_nuevos']} bytes nuevos, "
+                  f"{m['mb_por_segundo']} MB/s, verificado={m['verificado']}")
+        except Exception as e:
+            print("Error tomando respaldo:", e)
+
+
+def iniciar_respaldos(socketio):
+    # Como las alertas de reactivos: un solo worker toma los snapshots.
+    if CADA_H > 0 and os.environ.get("BIOLABHUB_WORKER", "0") == "0":
+        socketio.start_background_task(_bucle)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Respaldos en línea de BioLabHub")
+    parser.add_argument("accion", choices=("respaldar", "listar", "verificar", "restaurar"))
+    parser.add_argument("snapshot", nargs="?")
+    parser.add_argument("--destino", help="restaurar en este directorio en vez de pisar la BD")
+    args = parser.parse_args()
+
+    if args.accion == "respaldar":
+        m = tomar_snapshot()
+        print(f" {m['nombre']}: {m['bytes']} bytes ({m['bytes_nuevos']} nuevos) en {m['segundos']} s, "
+              f"{m['mb_por_segundo']} MB/s")
+        for clave, archivo in m["archivos"].items():
+            for problema in archivo["problemas"]:
+                print(f"   {clave}: {problema}")
+        sys.exit(0 if m["verificado"] else 1)
+    elif args.accion == "listar":
+        for m in listar():
+            print(f" {m['nombre']}  {m['bytes']:>12} bytes  {m['bytes_nuevos']:>12} nuevos  "
+                  f"{'ok' if m['verificado'] else 'CON PROBLEMAS'}")
+    elif not args.snapshot:
+        parser.error("falta el nombre del snapshot")
+    elif args.accion == "verificar":
+        problemas = verificar_snapshot(args.snapshot)
+        for clave, lista in problemas.items():
+            print(f" {clave}: {'ok' if not lista else '; '.join(lista)}")
+        sys.exit(1 if any(problemas.values()) else 0)
+    else:
+        for ruta in restaurar(args.snapshot, args.destino):
+            print(f" Restaurado {ruta}")
@@ -1,13 +1,18 @@
+import json
 import os
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, Response
 from db import (\
     ejecutar_select,\
-    ejecutar_insert,\
-    ejecutar_update,\
     registrar_auditoria,\
-    recalcular_dvv,\
-    calcular_dvh\
+    dvh_fila,\
+    conectar_bd,\
+    sumar_dvv,\
+    registrar_auditoria_en\
 )
+import escritor
+import shards
+import linaje
+from plantillas import Perezoso
 \
 template_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "frontend", "pages", "samples")
 samples_bp = Blueprint("samples_bp", __name__, template_folder=template_dir, static_folder=template_dir)
@@ -26,70 +31,134 @@ def samples():
 \
 \
 \
-    muestras = ejecutar_select("""
+    # En modo sharding cada laboratorio devuelve su parte ya ordenada y se
+    # intercalan (ver shards.py); sin sharding es una sola consulta.
+    # Perezoso: si la tabla está en cache de fragmentos (ver plantillas.py)
+    # la consulta no corre.
+    muestras = Perezoso(lambda: shards.consultar_todos("""
         SELECT m.id, m.nombre, m.tipo, m.estado, m.ubicacion,
-               u.nombre AS responsable, m.fecha_ingreso
+               u.nombre AS responsable, m.fecha_ingreso, m.version,
+               m.padre_id, m.relacion,
+               (SELECT COUNT(*) FROM linaje_muestras l WHERE l.ancestro_id = m.id) AS descendientes
         FROM muestras m
         LEFT JOIN usuarios u ON m.responsable_id = u.id
         WHERE m.estado_logico = 0
         ORDER BY m.fecha_ingreso DESC
-    """)
+    """, clave=lambda m: m["fecha_ingreso"] or "", desc=True))
     \
     laboratorios = ejecutar_select(\
-        "SELECT nombre FROM laboratorios WHERE estado_logico = 0 ORDER BY nombre ASC"\
+        "SELECT nombre FROM laboratorios WHERE estado_logico = 0 ORDER BY nombre ASC",\
+        cache=True\
     )
     \
 \
 \
 \
-    total_activos = ejecutar_select(\
-        "SELECT COUNT(*) AS c FROM muestras WHERE estado_logico = 0"\
-    )[0]["c"]
-    \
-    en_analisis = ejecutar_select(\
-        "SELECT COUNT(*) AS c FROM muestras WHERE estado_logico = 0 AND estado = 'En análisis'"\
-    )[0]["c"]
-    \
-    en_almacenamiento = ejecutar_select(\
-        "SELECT COUNT(*) AS c FROM muestras WHERE estado_logico = 0 AND estado = 'En almacenamiento'"\
-    )[0]["c"]
-    \
-    descartadas = ejecutar_select(\
-        "SELECT COUNT(*) AS c FROM muestras WHERE estado_logico = 0 AND estado = 'Descartada'"\
-    )[0]["c"]
-    \
-\
-    mis_muestras = ejecutar_select(\
-        "SELECT COUNT(*) AS c FROM muestras WHERE estado_logico = 0 AND responsable_id = ?",\
-        (usuario_id,),\
-    )[0]["c"]
+    conteos = shards.sumar_todos("""
+        SELECT COUNT(*) AS total_activos,
+               SUM(estado = 'En análisis') AS en_analisis,
+               SUM(estado = 'En almacenamiento') AS en_almacenamiento,
+               SUM(estado = 'Descartada') AS descartadas,
+               SUM(responsable_id = ?) AS mis_muestras,
+               SUM(padre_id IS NOT NULL) AS derivadas
+        FROM muestras
+        WHERE estado_logico = 0
+    """, (usuario_id,))
     \
     stats = {\
-        "total_activos": total_activos,\
-        "en_analisis": en_analisis,\
-        "en_almacenamiento": en_almacenamiento,\
-        "descartadas": descartadas,\
-        "mis_muestras": mis_muestras\
+        "total_activos": conteos["total_activos"],\
+        "en_analisis": conteos["en_analisis"],\
+        "en_almacenamiento": conteos["en_almacenamiento"],\
+        "descartadas": conteos["descartadas"],\
+        "mis_muestras": conteos["mis_muestras"],\
+        "derivadas": conteos["derivadas"],\
+        **linaje.estadisticas()\
     }
     \
-    return render_template("samples/samples.html",\
+    return render_template("samples/Samples.html",\
                            muestras=muestras,\
                            laboratorios=laboratorios,\
                            stats=stats)
+# Columnas que se pueden pedir en los detalles (?campos=nombre,estado).
+# El id va siempre primero.
+CAMPOS_DETALLE = (
+    "id", "nombre", "tipo", "estado", "ubicacion", "fecha_ingreso", "responsable_id",
+    "origen", "condiciones", "observaciones", "version", "padre_id", "relacion",
+)
+MAX_IDS_DETALLE = 500
+def _campos_pedidos(valor):
+    if not valor:
+        return CAMPOS_DETALLE
+    pedidos = valor.split(",") if isinstance(valor, str) else list(valor)
+    pedidos = [c.strip() for c in pedidos if c and c.strip()]
+    invalidos = [c for c in pedidos if c not in CAMPOS_DETALLE]
+    if invalidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(invalidos)}")
+    return ("id", *dict.fromkeys(c for c in pedidos if c != "id"))
+def detalles_muestras(ids, campos=CAMPOS_DETALLE):
+    # Una consulta por archivo (una sola sin sharding) con los ids en un
+    # parámetro JSON; las filas quedan como tuplas, en el orden de campos.
+    por_bd = {}
+    for i in ids:
+        por_bd.setdefault(shards.bd_de_id("muestras", i), []).append(i)
+    filas = {}
+    for bd, ids_bd in por_bd.items():
+        conn = conectar_bd(bd, adjuntar_global=False)
+        conn.row_factory = None
+        for fila in conn.execute(f"""
+            SELECT {", ".join(campos)} FROM muestras
+            WHERE id IN (SELECT value FROM json_each(?)) AND estado_logico = 0
+        """, (json.dumps(ids_bd),)):
+            filas[fila[0]] = fila
+        conn.close()
+    return [filas[i] for i in ids if i in filas]
+def _json_compacto(datos, status=200):
+    return Response(json.dumps(datos, ensure_ascii=False, separators=(",", ":"), default=str),
+                    status=status, mimetype="application/json")
 @samples_bp.route("/samples/detail/<int:id>")
 def sample_detail(id):
-    \
-    sample = ejecutar_select("""
-        SELECT id, nombre, tipo, estado, ubicacion, fecha_ingreso,
-               responsable_id,
-               origen, condiciones, observaciones
-        FROM muestras
-        WHERE id = ? AND estado_logico = 0
-    """, (id,))
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    try:
+        campos = _campos_pedidos(request.args.get("campos"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    sample = detalles_muestras([id], campos)
     \
     if not sample:
         return jsonify({"error": "Muestra no encontrada"}), 404
-    return jsonify(sample[0])
+    return _json_compacto(dict(zip(campos, sample[0])))
+@samples_bp.route("/samples/details", methods=["GET", "POST"])
+def samples_details():
+    # Detalle de varias muestras en un pedido:
+    #   GET  /samples/details?ids=1,2,3&campos=nombre,estado
+    #   POST {"ids": [1, 2, 3], "campos": ["nombre", "estado"]}
+    # Respuesta: {"campos": [...], "muestras": [[valores en ese orden], ...],
+    # "faltantes": [ids inexistentes o eliminados]}.
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    datos = (request.get_json(silent=True) or {}) if request.method == "POST" else request.args
+    try:
+        ids = datos.get("ids") or []
+        if isinstance(ids, str):
+            ids = ids.split(",")
+        ids = list(dict.fromkeys(int(i) for i in ids))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Lista de ids inválida."}), 400
+    try:
+        campos = _campos_pedidos(datos.get("campos"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not 1 <= len(ids) <= MAX_IDS_DETALLE:
+        return jsonify({"error": f"Se pueden pedir entre 1 y {MAX_IDS_DETALLE} muestras por vez."}), 400
+    \
+    filas = detalles_muestras(ids, campos)
+    encontradas = {f[0] for f in filas}
+    return _json_compacto({
+        "campos": campos,
+        "muestras": filas,
+        "faltantes": [i for i in ids if i not in encontradas],
+    })
 @samples_bp.route("/samples/add", methods=["POST"])
 def add_sample():
     if "usuario_id" not in session:
@@ -99,29 +168,30 @@ def add_sample():
     tipo = request.form.get("tipo")
     estado = request.form.get("estado")
     ubicacion = request.form.get("ubicacion")
+    metadatos = tuple(request.form.get(c) or None for c in ("origen", "condiciones", "observaciones"))
     responsable_id = session["usuario_id"]
+    ip_origen = request.remote_addr
+    bd = shards.bd_de_ubicacion(ubicacion)
     \
 \
-    new_id = ejecutar_insert("""
-        INSERT INTO muestras (nombre, tipo, estado, responsable_id, ubicacion, estado_logico)
-        VALUES (?, ?, ?, ?, ?, 0)
-    """, (nombre, tipo, estado, responsable_id, ubicacion))
-    \
-\
-    fila = ejecutar_select("SELECT * FROM muestras WHERE id = ?", (new_id,))[0]
-    \
-\
-    datos_fila = {k: fila[k] for k in fila.keys() if k != "dvh"}
-    \
-\
-    dvh = calcular_dvh(datos_fila)
-    ejecutar_update("UPDATE muestras SET dvh = ? WHERE id = ?", (dvh, new_id))
-    \
-\
-    registrar_auditoria(responsable_id, "CREAR MUESTRA", "muestras", new_id, request.remote_addr)
-    \
-\
-    recalcular_dvv("muestras")
+    # Alta, DVH, DVV y (en la BD compartida) auditoría en un solo trabajo
+    # del escritor: una transacción en vez de cuatro.
+    def insertar(cursor):
+        cursor.execute("""
+            INSERT INTO muestras (nombre, tipo, estado, responsable_id, ubicacion, origen, condiciones, observaciones, estado_logico)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+            RETURNING *
+        """, (nombre, tipo, estado, responsable_id, ubicacion, *metadatos))
+        fila = cursor.fetchone()
+        dvh = dvh_fila(fila)
+        cursor.execute("UPDATE muestras SET dvh = ? WHERE id = ?", (dvh, fila["id"]))
+        sumar_dvv(cursor, "muestras", dvh)
+        if bd is None:
+            registrar_auditoria_en(cursor, responsable_id, "CREAR MUESTRA", "muestras", fila["id"], ip_origen)
+        return fila["id"]
+    new_id = escritor.ejecutar(insertar, bd=bd)
+    if bd is not None:
+        registrar_auditoria(responsable_id, "CREAR MUESTRA", "muestras", new_id, ip_origen)
     \
 \
     from servidor import socketio
@@ -136,51 +206,145 @@ def update_sample(id):
     tipo = request.form.get("tipo")
     estado = request.form.get("estado")
     ubicacion = request.form.get("ubicacion")
+    version = request.form.get("version", type=int)
+    # Los metadatos que no vienen en el formulario se conservan.
+    metadatos = tuple(request.form.get(c) for c in ("origen", "condiciones", "observaciones"))
+    bd = shards.bd_de_id("muestras", id)
+    destino = shards.bd_de_ubicacion(ubicacion)
+    if ubicacion and destino != bd:
+        # Cambió de laboratorio: la fila pasa a su nuevo archivo y el
+        # compare-and-swap se hace ahí. mover() controla la versión antes de
+        # copiar: una edición rechazada no muda la muestra.
+        if not shards.mover("muestras", id, bd, destino, version):
+            actual = ejecutar_select("SELECT * FROM muestras WHERE id = ? AND estado_logico = 0", (id,), bd=bd)
+            return conflicto_muestra(actual[0] if actual else None)
+        bd = destino
     \
 \
-    ejecutar_update("""
-        UPDATE muestras
-        SET nombre=?, tipo=?, estado=?, ubicacion=?
-        WHERE id=?
-    """, (nombre, tipo, estado, ubicacion, id))
-    \
-\
-    fila = ejecutar_select("SELECT * FROM muestras WHERE id = ?", (id,))[0]
-    \
-    datos_fila = {k: fila[k] for k in fila.keys() if k != "dvh"}
-    \
-\
-    dvh = calcular_dvh(datos_fila)
-    ejecutar_update("UPDATE muestras SET dvh = ? WHERE id = ?", (dvh, id))
-    \
-\
-    registrar_auditoria(session["usuario_id"], "ACTUALIZAR MUESTRA", "muestras", id, request.remote_addr)
-    recalcular_dvv("muestras")
+    # Todo en un trabajo del escritor: compare-and-swap sobre la versión,
+    # DVH de la fila nueva, DVV incremental y auditoría. Si otro usuario
+    # guardó antes, la versión ya no coincide y no se pisa su cambio.
+    # (En un shard la auditoría va a la BD compartida después del commit.)
+    usuario_id = session["usuario_id"]
+    ip_origen = request.remote_addr
+    def actualizar(cursor):
+        cursor.execute("SELECT * FROM muestras WHERE id = ? AND estado_logico = 0", (id,))
+        anterior = cursor.fetchone()
+        if anterior is None or (version is not None and version != anterior["version"]):
+            return False, anterior
+        cursor.execute("""
+            UPDATE muestras
+            SET nombre=?, tipo=?, estado=?, ubicacion=?,
+                origen = COALESCE(?, origen), condiciones = COALESCE(?, condiciones),
+                observaciones = COALESCE(?, observaciones), version = version + 1
+            WHERE id=? AND version=?
+        """, (nombre, tipo, estado, ubicacion, *metadatos, id, anterior["version"]))
+        \
+        cursor.execute("SELECT * FROM muestras WHERE id = ?", (id,))
+        fila = cursor.fetchone()
+        dvh = dvh_fila(fila)
+        cursor.execute("UPDATE muestras SET dvh = ? WHERE id = ?", (dvh, id))
+        sumar_dvv(cursor, "muestras", dvh - (anterior["dvh"] or 0))
+        if bd is None:
+            registrar_auditoria_en(cursor, usuario_id, "ACTUALIZAR MUESTRA", "muestras", id, ip_origen)
+        return True, fila
+    guardada, fila = escritor.ejecutar(actualizar, bd=bd)
+    if not guardada:
+        return conflicto_muestra(fila)
+    if bd is not None:
+        registrar_auditoria(usuario_id, "ACTUALIZAR MUESTRA", "muestras", id, ip_origen)
     \
 \
     from servidor import socketio
     socketio.emit("nuevo_evento", f"Muestra '{nombre}' actualizada.")
     \
+    if quiere_json():
+        return jsonify({"id": id, "version": fila["version"]})
     flash("Muestra actualizada correctamente.", "success")
     return redirect(url_for("samples_bp.samples"))
-@samples_bp.route("/samples/delete/<int:id>")
-def delete_sample(id):
-    \
-\
-    ejecutar_update("UPDATE muestras SET estado_logico=1 WHERE id=?", (id,))
-    \
-\
-    fila = ejecutar_select("SELECT * FROM muestras WHERE id = ?", (id,))[0]
+def quiere_json():
+    return request.accept_mimetypes.best == "application/json" or request.headers.get("X-Requested-With") == "XMLHttpRequest"
+def conflicto_muestra(actual):
+    if quiere_json():
+        if actual is None:
+            return jsonify({"error": "La muestra fue eliminada."}), 409
+        return jsonify({\
+            "error": "La muestra fue modificada por otro usuario.",\
+            "actual": dict(actual)\
+        }), 409
+    if actual is None:
+        flash("La muestra fue eliminada por otro usuario.", "error")
+    else:
+        flash(f"La muestra '{actual['nombre']}' fue modificada por otro usuario mientras la editabas. Revisá los datos y volvé a guardar.", "error")
+    return redirect(url_for("samples_bp.samples"))
+@samples_bp.route("/samples/<int:id>/aliquots", methods=["POST"])
+def create_aliquots(id):
+    if "usuario_id" not in session:
+        flash("Debes iniciar sesión primero.", "error")
+        return redirect(url_for("login_bp.login"))
+    datos = request.get_json(silent=True) or request.form
+    try:
+        nuevas = linaje.crear_alicuotas(\
+            id,\
+            int(datos.get("cantidad", 1)),\
+            session["usuario_id"],\
+            request.remote_addr,\
+            relacion=datos.get("relacion") or "alícuota",\
+            nombre=datos.get("nombre") or None,\
+            tipo=datos.get("tipo") or None,\
+            estado=datos.get("estado") or None,\
+            ubicacion=datos.get("ubicacion") or None\
+        )
+    except ValueError as e:
+        if quiere_json():
+            return jsonify({"error": str(e)}), 400
+        flash(str(e), "error")
+        return redirect(url_for("samples_bp.samples"))
+    if nuevas is None:
+        if quiere_json():
+            return jsonify({"error": "Muestra no encontrada"}), 404
+        flash("Muestra no encontrada.", "error")
+        return redirect(url_for("samples_bp.samples"))
     \
-    datos_fila = {k: fila[k] for k in fila.keys() if k != "dvh"}
+    from servidor import socketio
+    socketio.emit("nuevo_evento", f"{len(nuevas)} muestras derivadas de la muestra ID {id}.")
     \
-\
-    dvh = calcular_dvh(datos_fila)
-    ejecutar_update("UPDATE muestras SET dvh = ? WHERE id = ?", (dvh, id))
+    if quiere_json():
+        return jsonify([{"id": f["id"], "nombre": f["nombre"]} for f in nuevas]), 201
+    flash(f"Se crearon {len(nuevas)} muestras derivadas.", "success")
+    return redirect(url_for("samples_bp.samples"))
+@samples_bp.route("/samples/<int:id>/lineage")
+def sample_lineage(id):
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    return jsonify({\
+        "id": id,\
+        "ancestros": linaje.ancestros(id),\
+        "descendientes": linaje.descendientes(id, request.args.get("profundidad", type=int))\
+    })
+@samples_bp.route("/samples/delete/<int:id>")
+def delete_sample(id):
     \
+    bd = shards.bd_de_id("muestras", id)
 \
-    registrar_auditoria(session["usuario_id"], "ELIMINAR MUESTRA", "muestras", id, request.remote_addr)
-    recalcular_dvv("muestras")
+    usuario_id = session["usuario_id"]
+    ip_origen = request.remote_addr
+    def eliminar(cursor):
+        cursor.execute("UPDATE muestras SET estado_logico=1 WHERE id=? RETURNING *", (id,))
+        fila = cursor.fetchone()
+        if fila is None:
+            return False
+        dvh = dvh_fila(fila)
+        cursor.execute("UPDATE muestras SET dvh = ? WHERE id = ?", (dvh, id))
+        sumar_dvv(cursor, "muestras", dvh - (fila["dvh"] or 0))
+        if bd is None:
+            registrar_auditoria_en(cursor, usuario_id, "ELIMINAR MUESTRA", "muestras", id, ip_origen)
+        return True
+    if not escritor.ejecutar(eliminar, bd=bd):
+        flash("Muestra no encontrada.", "error")
+        return redirect(url_for("samples_bp.samples"))
+    if bd is not None:
+        registrar_auditoria(usuario_id, "ELIMINAR MUESTRA", "muestras", id, ip_origen)
     \
 \
     from servidor import socketio
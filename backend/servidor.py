@@ -1,65 +1,174 @@
 from flask import Flask, render_template, redirect, url_for, session, flash
 import os
-from db import crear_bd
-from login import login_bp
-from experiments import experiments_bp
-from samples import samples_bp
-from equipments import equipments_bp
-from admin import admin_bp
-from home import home_bp
+import sys
+import metricas
+import admision
+import estaticos
+import plantillas
+from diario import diario, EVENTOS as EVENTOS_DIARIO
+from cola_mensajes import opciones_socketio
 
 from flask_socketio import SocketIO, emit
 
 # 🟦 NUEVO: para usar hilos
-from threading import Thread
+from threading import Condition, Lock
 import time   # opcional, para simular tareas largas
 
 
 # ========================================
 #  FLASK + SOCKET.IO
 # ========================================
-app = Flask(
-    __name__,
-    template_folder="../frontend/pages",
-    static_folder="../frontend/static"
-)
-
-app.secret_key = "clave_super_segura_para_biolabhub"
-
-socketio = SocketIO(app, cors_allowed_origins="*")
+# socketio se crea sin app para que los blueprints puedan importarlo
+# (from servidor import socketio); se enlaza en create_app().
+class SocketIOConDiario(SocketIO):
+    # Los broadcasts de EVENTOS_DIARIO quedan en el diario (ver diario.py) y
+    # llevan su seq como segundo argumento; los handlers del front que
+    # reciben uno solo siguen funcionando igual.
+    def emit(self, event, *args, **kwargs):
+        # Mismos eventos, mismos fragmentos de plantilla vencidos.
+        plantillas.invalidar_por_evento(event)
+        if event in EVENTOS_DIARIO and len(args) == 1 and not (kwargs.get("to") or kwargs.get("room")):
+            args = ((args[0], diario.registrar(event, args[0])),)
+        return super().emit(event, *args, **kwargs)
+
+
+socketio = SocketIOConDiario()
+
+_app = None
+_app_lock = Lock()
+
+
+def create_app(verificar_esquema=True):
+    # Los blueprints se importan acá y no al importar el módulo: así
+    # "import servidor" es barato y cada subsistema se inicializa recién
+    # cuando hace falta.
+    from login import login_bp
+    from experiments import experiments_bp
+    from samples import samples_bp
+    from equipments import equipments_bp
+    from admin import admin_bp
+    from home import home_bp
+    from busqueda import busqueda_bp
+    from reactivos import reactivos_bp, iniciar_alertas
+    from analitica import analitica_bp
+    from telemetria import telemetria_bp, iniciar_telemetria, recibir_lecturas_socket
+    from respaldos import iniciar_respaldos
+    from ciclo_reservas import iniciar_ciclo_reservas
+
+    app = Flask(
+        __name__,
+        template_folder="../frontend/pages",
+        static_folder="../frontend/static"
+    )
+
+    app.secret_key = "clave_super_segura_para_biolabhub"
+
+    # threading / gevent / eventlet. Sin definir, Flask-SocketIO elige según lo instalado.
+    async_mode = os.environ.get("BIOLABHUB_ASYNC_MODE") or None
+    # redis://..., amqp://... o memoria:// (solo un proceso, para pruebas)
+    message_queue = os.environ.get("BIOLABHUB_MESSAGE_QUEUE")
+
+    socketio.init_app(
+        app,
+        cors_allowed_origins="*",
+        async_mode=async_mode,
+        **opciones_socketio(message_queue)
+    )
+
+    # Latencia, SQL, bcrypt/Fernet y plantillas por endpoint (ver /admin/metricas)
+    metricas.init_app(app)
+    # Token buckets por usuario/IP y topes de concurrencia (ver admision.py);
+    # después de metricas para que los 429/503 también se midan.
+    admision.init_app(app)
+    # Estáticos con hash en el nombre, .gz y cache inmutable (ver estaticos.py)
+    estaticos.init_app(app)
+    # Bytecode de Jinja en disco y {% cache %} de fragmentos (ver plantillas.py)
+    plantillas.init_app(app)
+
+    app.register_blueprint(home_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(login_bp)
+    app.register_blueprint(experiments_bp)
+    app.register_blueprint(samples_bp)
+    app.register_blueprint(equipments_bp)
+    app.register_blueprint(busqueda_bp)
+    app.register_blueprint(reactivos_bp)
+    app.register_blueprint(analitica_bp)
+    app.register_blueprint(telemetria_bp)
+    socketio.on_event("telemetria", recibir_lecturas_socket)
+
+    app.add_url_rule("/", "index", index)
+    app.add_url_rule("/equipment", "equipment", equipment)
+
+    if verificar_esquema:
+        preparar_bd()
+        # Avisos de caducidad / stock bajo y materialización de saldos
+        iniciar_alertas(socketio)
+        # Volcado de lecturas de equipos (cada worker vacía su propio buffer)
+        iniciar_telemetria(socketio)
+        # Snapshots programados con BIOLABHUB_BACKUP_CADA_H (ver respaldos.py)
+        iniciar_respaldos(socketio)
+        # En espera / En curso / Finalizada / No presentado (ver ciclo_reservas.py)
+        iniciar_ciclo_reservas(socketio)
+
+    return app
+
+
+def obtener_app():
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app
+
+
+def __getattr__(nombre):
+    # Compatibilidad con "from servidor import app": la app se construye
+    # la primera vez que alguien la pide.
+    if nombre == "app":
+        return obtener_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {nombre!r}")
+
+
+# Tareas en segundo plano en curso; el apagado ordenado espera a que terminen.
+_tareas_pendientes = 0
+_tareas_cond = Condition()
+
+
+def _ejecutar_tarea(func, args, kwargs):
+    global _tareas_pendientes
+    try:
+        func(*args, **kwargs)
+    finally:
+        with _tareas_cond:
+            _tareas_pendientes -= 1
+            _tareas_cond.notify_all()
 
 
 def lanzar_tarea_en_segundo_plano(func, *args, **kwargs):
-    hilo = Thread(target=func, args=args, kwargs=kwargs, daemon=True)
-    hilo.start()
-    return hilo
-
-
-
-app.register_blueprint(home_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(login_bp)
-app.register_blueprint(experiments_bp)
-app.register_blueprint(samples_bp)
-app.register_blueprint(equipments_bp)
-
-
-
+    global _tareas_pendientes
+    with _tareas_cond:
+        _tareas_pendientes += 1
+    # start_background_task usa hilos o greenlets según el async_mode
+    return socketio.start_background_task(_ejecutar_tarea, func, args, kwargs)
 
 
+def esperar_tareas_pendientes(timeout=None):
+    # Devuelve True si todas las tareas terminaron antes del timeout.
+    with _tareas_cond:
+        return _tareas_cond.wait_for(lambda: _tareas_pendientes == 0, timeout)
 
 
 # ========================================
 #  RUTAS PRINCIPALES
 # ========================================
-@app.route("/")
 def index():
     if "usuario_id" in session:
         return redirect(url_for("home_bp.home"))
     return render_template("landingpage/landingpage.html")
 
 
-@app.route("/equipment")
 def equipment():
     if "usuario_id" not in session:
         flash("Debes iniciar sesión primero.", "error")
@@ -67,14 +176,6 @@ def equipment():
     return "<h2>Página de Equipos (en construcción)</h2>"
 
 
-@app.route("/reagents")
-def reagents():
-    if "usuario_id" not in session:
-        flash("Debes iniciar sesión primero.", "error")
-        return redirect(url_for("login_bp.login"))
-    return "<h2>Página de Reactivos (en construcción)</h2>"
-
-
 # WebSocket events
 @socketio.on("connect")
 def handle_connect():
@@ -87,14 +188,29 @@ def handle_disconnect():
     print(" Cliente desconectado")
 
 
+@socketio.on("reanudar")
+def handle_reanudar(datos=None):
+    # El ack lleva los eventos perdidos desde el último seq del cliente.
+    datos = datos or {}
+    return diario.reanudar(datos.get("desde"), datos.get("epoca"))
+
+
 # ========================================
 #  MAIN: CREAR BD Y LEVANTAR SERVIDOR
 # ========================================
-if __name__ == "__main__":
-    if not os.path.exists(os.path.join(os.path.dirname(__file__), "..", "biolabhub.db")):
-        print(" Base de datos no encontrada. Creándola...")
-        crear_bd()
-    else:
-        print(" Base de datos encontrada.")
+def preparar_bd():
+    # Si la versión de esquema guardada coincide no se vuelve a recorrer
+    # crear_bd(); ver db.verificar_bd().
+    from db import verificar_bd
+    import shards
+    verificar_bd()
+    # Con BIOLABHUB_SHARDS=1, un archivo por laboratorio con el esquema al día.
+    shards.preparar()
 
-    socketio.run(app, debug=True)
+
+# Modo producción: python produccion.py (ver ese archivo)
+if __name__ == "__main__":
+    # Los blueprints hacen "from servidor import socketio": sin esto se
+    # importaría una segunda copia del módulo con un socketio sin enlazar.
+    sys.modules.setdefault("servidor", sys.modules[__name__])
+    socketio.run(obtener_app(), debug=True)
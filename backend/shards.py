@@ -0,0 +1,374 @@
+# ========================================
+#  SHARDING POR LABORATORIO (OPCIONAL)
+# ========================================
+# Con BIOLABHUB_SHARDS=1 las muestras y las reservas de equipos viven en un
+# archivo por laboratorio (shards/lab_<id>.db): cada laboratorio tiene su
+# propio lock de escritura. Usuarios, auditoría, experimentos, reactivos y
+# el resto siguen en la BD compartida (DB_PATH), que cada conexión a un
+# shard adjunta como "global".
+#
+# - Muestras: por ubicacion (nombre del laboratorio).
+# - Reservas: por la ubicacion del equipo reservado.
+# - Lo que no corresponde a ningún laboratorio queda en la BD compartida.
+#
+# Los ids nuevos de cada shard arrancan en laboratorio_id << BITS_ID, así
+# el id alcanza para saber dónde está la fila. Las excepciones (filas
+# migradas con su id original o que cambiaron de laboratorio) se anotan en
+# directorio_ids.
+#
+#   BIOLABHUB_SHARDS=1 python shards.py migrar   # partir una BD existente
+import argparse
+import heapq
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from db import (
+    BASE_DIR,
+    DB_PATH,
+    SCHEMA_VERSION,
+    conectar_bd,
+    recalcular_dvv,
+)
+from integridad import TABLAS as TABLAS_MERKLE, abrir_escritura, cerrar_escritura, construir as construir_merkle
+import cache_consultas
+
+ACTIVO = os.environ.get("BIOLABHUB_SHARDS") == "1"
+SHARD_DIR = os.environ.get("BIOLABHUB_SHARD_DIR", os.path.join(BASE_DIR, "shards"))
+BITS_ID = 40
+TABLAS = ("muestras", "reservas_equipos")
+# Tablas que acompañan a las de TABLAS en cada shard (archivo, texto
+# completo e integridad), con sus índices y triggers.
+SOPORTE = (
+    "muestras_archivo", "reservas_equipos_archivo", "muestras_fts",
+    "verificaciones_verticales", "merkle_nodos", "merkle_raices", "merkle_pendientes",
+    "merkle_sesion",
+)
+
+
+# ----------------------------------------
+#  RUTEO
+# ----------------------------------------
+@lru_cache(maxsize=None)
+def _laboratorios():
+    conn = conectar_bd()
+    labs = {f["nombre"]: f["id"] for f in conn.execute("SELECT id, nombre FROM laboratorios WHERE estado_logico = 0")}
+    equipos = {f["nombre"]: f["ubicacion"] for f in conn.execute("SELECT nombre, ubicacion FROM equipos")}
+    conn.close()
+    return labs, equipos
+
+
+def ruta_laboratorio(laboratorio_id):
+    return os.path.join(SHARD_DIR, f"lab_{laboratorio_id}.db") if laboratorio_id else None
+
+
+def laboratorio_de_ruta(ruta):
+    return int(os.path.basename(ruta)[len("lab_"):-len(".db")]) if ruta else 0
+
+
+def laboratorio_de_ubicacion(ubicacion):
+    labs, _ = _laboratorios()
+    if ubicacion not in labs:
+        # Laboratorio creado después de cargar el mapa.
+        _laboratorios.cache_clear()
+        labs, _ = _laboratorios()
+    return labs.get(ubicacion, 0)
+
+
+def laboratorio_de_equipo(equipo):
+    _, equipos = _laboratorios()
+    if equipo not in equipos:
+        _laboratorios.cache_clear()
+        _, equipos = _laboratorios()
+    return laboratorio_de_ubicacion(equipos.get(equipo))
+
+
+def bd_de_ubicacion(ubicacion):
+    # None = BD compartida (también con el sharding apagado).
+    return ruta_laboratorio(laboratorio_de_ubicacion(ubicacion)) if ACTIVO else None
+
+
+def bd_de_equipo(equipo):
+    return ruta_laboratorio(laboratorio_de_equipo(equipo)) if ACTIVO else None
+
+
+def bd_de_id(tabla, registro_id):
+    if not ACTIVO or tabla not in TABLAS:
+        return None
+    conn = conectar_bd()
+    fila = conn.execute(
+        "SELECT laboratorio_id FROM directorio_ids WHERE tabla = ? AND id = ?", (tabla, registro_id)
+    ).fetchone()
+    conn.close()
+    return ruta_laboratorio(fila[0] if fila else registro_id >> BITS_ID)
+
+
+def todas():
+    if not ACTIVO:
+        return [None]
+    # Un laboratorio sin archivo todavía (antes de preparar()) no tiene filas.
+    rutas = [ruta_laboratorio(lab_id) for lab_id in sorted(_laboratorios()[0].values())]
+    return [None] + [ruta for ruta in rutas if os.path.exists(ruta)]
+
+
+# ----------------------------------------
+#  CONSULTAS SOBRE TODOS LOS SHARDS
+# ----------------------------------------
+def _en_cada(funcion):
+    rutas = todas()
+    if len(rutas) == 1:
+        return [funcion(rutas[0])]
+    with ThreadPoolExecutor(max_workers=len(rutas)) as ejecutor:
+        return list(ejecutor.map(funcion, rutas))
+
+
+def consultar_todos(query, parametros=(), clave=None, desc=False, limite=None):
+    # Corre la consulta en cada shard en paralelo. Si cada shard devuelve
+    # sus filas ordenadas por `clave`, el resultado se intercala en orden
+    # sin reordenar todo; `limite` corta después de intercalar.
+    def consultar(ruta):
+        conn = conectar_bd(ruta)
+        try:
+            return conn.execute(query, parametros).fetchall()
+        finally:
+            conn.close()
+
+    partes = _en_cada(consultar)
+    if clave is None:
+        filas = [f for parte in partes for f in parte]
+    else:
+        filas = heapq.merge(*partes, key=clave, reverse=desc)
+    if limite is not None:
+        return [f for _, f in zip(range(limite), filas)]
+    return list(filas)
+
+
+def sumar_todos(query, parametros=()):
+    # Para conteos: una fila de números por shard, sumada columna a columna.
+    totales = {}
+    for fila in consultar_todos(query, parametros):
+        for k in fila.keys():
+            totales[k] = totales.get(k, 0) + (fila[k] or 0)
+    return totales
+
+
+# ----------------------------------------
+#  ESQUEMA DE LOS SHARDS
+# ----------------------------------------
+def _columnas(cursor, esquema, tabla):
+    # (nombre, definición) con NOT NULL/DEFAULT, para poder replicar la columna.
+    cursor.execute(f"PRAGMA {esquema}.table_info({tabla})")
+    columnas = []
+    for col in cursor.fetchall():
+        definicion = col[2]
+        if col[4] is not None:
+            definicion += (" NOT NULL" if col[3] else "") + f" DEFAULT {col[4]}"
+        columnas.append((col[1], definicion))
+    return columnas
+
+
+def _ddl_compartido():
+    conn = conectar_bd()
+    filas = conn.execute("""
+        SELECT type, name, tbl_name, sql FROM sqlite_master
+        WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+        ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END
+    """).fetchall()
+    conn.close()
+    propias = set(TABLAS) | set(SOPORTE)
+    # Las tablas internas del FTS se crean solas con la tabla virtual (sus
+    # triggers muestras_fts_ai/ad/au sí se copian).
+    return [
+        f for f in filas
+        if f["tbl_name"] in propias and not (f["type"] == "table" and f["name"].startswith("muestras_fts_"))
+    ]
+
+
+def crear_shard(laboratorio_id, ddl=None):
+    # Idempotente: crea lo que falta y agrega columnas nuevas, igual que
+    # crear_bd() con la BD compartida.
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    conn = conectar_bd(ruta_laboratorio(laboratorio_id))
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+    existentes = dict(cursor.execute("SELECT name, sql FROM main.sqlite_master").fetchall())
+    alteradas = set()
+    ddl = ddl or _ddl_compartido()
+    for f in ddl:
+        if f["name"] not in existentes:
+            cursor.execute(f["sql"])
+        elif f["type"] == "trigger" and existentes[f["name"]] != f["sql"]:
+            # Trigger de una versión anterior (p. ej. los de Merkle sin sesión).
+            cursor.execute(f"DROP TRIGGER main.{f['name']}")
+            cursor.execute(f["sql"])
+        elif f["type"] == "table" and f["tbl_name"] != "muestras_fts":
+            propias = {nombre for nombre, _ in _columnas(cursor, "main", f["name"])}
+            for nombre, tipo in _columnas(cursor, "global", f["name"]):
+                if nombre not in propias:
+                    cursor.execute(f"ALTER TABLE main.{f['name']} ADD COLUMN {nombre} {tipo}")
+                    alteradas.add(f["name"])
+    if "muestras_fts_ai" not in existentes and any(f["name"] == "muestras_fts_ai" for f in ddl):
+        # Shard creado sin los triggers del FTS (o FTS nuevo): se indexan
+        # las filas que ya tenía.
+        cursor.execute("INSERT INTO main.muestras_fts(muestras_fts) VALUES ('rebuild')")
+    # Igual que en crear_bd(): filas con columnas nuevas, árbol nuevo.
+    for tabla in alteradas & set(TABLAS_MERKLE):
+        construir_merkle(cursor, tabla)
+    for tabla in TABLAS:
+        cursor.execute("""
+            INSERT INTO main.sqlite_sequence (name, seq)
+            SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM main.sqlite_sequence WHERE name = ?)
+        """, (tabla, laboratorio_id << BITS_ID, tabla))
+    cursor.execute(f"PRAGMA main.user_version = {SCHEMA_VERSION}")
+    conn.commit()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+
+
+def preparar():
+    if not ACTIVO:
+        return
+    ddl = _ddl_compartido()
+    for laboratorio_id in sorted(_laboratorios()[0].values()):
+        ruta = ruta_laboratorio(laboratorio_id)
+        if os.path.exists(ruta):
+            conn = conectar_bd(ruta)
+            version = conn.execute("PRAGMA main.user_version").fetchone()[0]
+            conn.close()
+            if version == SCHEMA_VERSION:
+                continue
+        crear_shard(laboratorio_id, ddl)
+
+
+# ----------------------------------------
+#  MOVER FILAS ENTRE ARCHIVOS
+# ----------------------------------------
+def _copiar(cursor, origen, destino, tabla, condicion, parametros=()):
+    columnas = ", ".join(nombre for nombre, _ in _columnas(cursor, origen, tabla))
+    # Un id explícito más alto que la secuencia la arrastraría al rango de
+    # otro laboratorio: se guarda y se restaura.
+    cursor.execute(f"SELECT seq FROM {destino}.sqlite_sequence WHERE name = ?", (tabla,))
+    seq = cursor.fetchone()
+    cursor.execute(
+        f"INSERT OR IGNORE INTO {destino}.{tabla} ({columnas}) SELECT {columnas} FROM {origen}.{tabla} WHERE {condicion}",
+        parametros,
+    )
+    movidas = cursor.rowcount
+    if seq:
+        cursor.execute(f"UPDATE {destino}.sqlite_sequence SET seq = ? WHERE name = ?", (seq[0], tabla))
+    cursor.execute(f"DELETE FROM {origen}.{tabla} WHERE {condicion}", parametros)
+    return movidas
+
+
+def mover(tabla, registro_id, bd_origen, bd_destino, version=None):
+    # Cambio de laboratorio: la fila pasa de archivo conservando su id.
+    # Con version, solo se mueve si la fila sigue viva en esa versión (el
+    # control va en la misma transacción que la copia); si no, no se toca
+    # nada y devuelve False.
+    if bd_origen == bd_destino:
+        return True
+    if bd_origen and bd_destino:
+        # Entre dos shards: se pasa por la BD compartida. La versión se
+        # controla en el primer tramo; el segundo completa el cambio.
+        if not mover(tabla, registro_id, bd_origen, None, version):
+            return False
+        return mover(tabla, registro_id, None, bd_destino)
+    # Escribe en el shard y en la BD compartida a la vez: por fuera del
+    # escritor (ver escritor.py), invalidando la cache a mano.
+    conn = conectar_bd(bd_origen or bd_destino)
+    escritas = cache_consultas.vigilar(conn, bd_origen or bd_destino, DB_PATH)
+    cursor = conn.cursor()
+    origen, destino = ("main", "global") if bd_origen else ("global", "main")
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        for esquema in ("main", "global"):
+            abrir_escritura(cursor, esquema)
+        if version is not None:
+            cursor.execute(
+                f"SELECT 1 FROM {origen}.{tabla} WHERE id = ? AND estado_logico = 0 AND version = ?",
+                (registro_id, version),
+            )
+            if cursor.fetchone() is None:
+                conn.rollback()
+                return False
+        _copiar(cursor, origen, destino, tabla, "id = ?", (registro_id,))
+        cursor.execute(
+            "INSERT OR REPLACE INTO global.directorio_ids (tabla, id, laboratorio_id) VALUES (?, ?, ?)",
+            (tabla, registro_id, laboratorio_de_ruta(bd_destino)),
+        )
+        for esquema in ("main", "global"):
+            cerrar_escritura(cursor, esquema)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    cache_consultas.invalidar(escritas)
+    recalcular_dvv(tabla, bd_origen)
+    recalcular_dvv(tabla, bd_destino)
+    return True
+
+
+# ----------------------------------------
+#  MIGRACIÓN DE UNA BD EXISTENTE
+# ----------------------------------------
+CONDICIONES = {
+    "muestras": "ubicacion = ?",
+    "reservas_equipos": "equipo IN (SELECT nombre FROM global.equipos WHERE ubicacion = ?)",
+}
+
+
+def migrar():
+    # Reparte las filas de la BD compartida en los shards conservando sus
+    # ids. Se puede volver a correr: cada pasada mueve lo que quedó.
+    preparar()
+    resumen = {}
+    labs, _ = _laboratorios()
+    for nombre, laboratorio_id in sorted(labs.items(), key=lambda x: x[1]):
+        ruta = ruta_laboratorio(laboratorio_id)
+        conn = conectar_bd(ruta)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for esquema in ("main", "global"):
+                abrir_escritura(cursor, esquema)
+            for tabla, condicion in CONDICIONES.items():
+                for fisica in (tabla, f"{tabla}_archivo"):
+                    cursor.execute(f"""
+                        INSERT OR REPLACE INTO global.directorio_ids (tabla, id, laboratorio_id)
+                        SELECT ?, id, ? FROM global.{fisica} WHERE {condicion}
+                    """, (tabla, laboratorio_id, nombre))
+                    movidas = _copiar(cursor, "global", "main", fisica, condicion, (nombre,))
+                    resumen[(nombre, fisica)] = movidas
+            for esquema in ("main", "global"):
+                cerrar_escritura(cursor, esquema)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        for tabla in CONDICIONES:
+            recalcular_dvv(tabla, ruta)
+            recalcular_dvv(f"{tabla}_archivo", ruta)
+    for tabla in CONDICIONES:
+        recalcular_dvv(tabla)
+        recalcular_dvv(f"{tabla}_archivo")
+    return resumen
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharding por laboratorio de BioLabHub")
+    parser.add_argument("accion", choices=("preparar", "migrar"))
+    args = parser.parse_args()
+    if not ACTIVO:
+        parser.error("definí BIOLABHUB_SHARDS=1")
+    if args.accion == "preparar":
+        preparar()
+        print(f"Shards listos en {SHARD_DIR}")
+    else:
+        for (laboratorio, tabla), movidas in migrar().items():
+            if movidas:
+                print(f"{laboratorio:<40} {tabla:<28} {movidas}")
+        print(f"Migración terminada ({DB_PATH} -> {SHARD_DIR})")
@@ -0,0 +1,499 @@
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
+
+import metricas
+from db import ejecutar_select, ejecutar_update
+import escritor
+
+telemetria_bp = Blueprint("telemetria_bp", __name__)
+
+
+# ========================================
+#  TELEMETRÍA DE EQUIPOS
+# ========================================
+# Los equipos (o el simulador de abajo) mandan lecturas por HTTP o por
+# Socket.IO. ingerir() solo valida y las agrega a un buffer circular en
+# memoria; un hilo las vuelca de a lotes (una transacción por lote) y en el
+# mismo volcado suma cada lote a los rollups por minuto y por hora. Las
+# alertas por umbral se evalúan lectura a lectura sobre el lote ordenado,
+# sin volver a leer la BD. Los gráficos leen solo los rollups.
+#
+# Las lecturas crudas se guardan RETENCION_CRUDA_H horas y los minutos
+# RETENCION_MINUTOS_DIAS días; las horas no se borran.
+METRICAS = {"temperatura": 1, "rpm": 2, "puerta": 3}
+NOMBRES_METRICA = {codigo: nombre for nombre, codigo in METRICAS.items()}
+UNIDADES = {"temperatura": "°C", "rpm": "rpm", "puerta": "abierta"}
+
+CAPACIDAD_BUFFER = int(os.environ.get("BIOLABHUB_TELEMETRIA_BUFFER", "50000"))
+VOLCAR_CADA = float(os.environ.get("BIOLABHUB_TELEMETRIA_VOLCAR_CADA", "1"))
+# Con tantas lecturas pendientes se vuelca sin esperar al próximo intervalo.
+LOTE = 5000
+MAX_LECTURAS_POR_PEDIDO = 10000
+RETENCION_CRUDA_H = int(os.environ.get("BIOLABHUB_TELEMETRIA_RETENCION_H", "48"))
+RETENCION_MINUTOS_DIAS = int(os.environ.get("BIOLABHUB_TELEMETRIA_RETENCION_MINUTOS", "30"))
+PODAR_CADA = 600
+# Rangos de hasta estas horas se grafican por minuto; más largos, por hora.
+HORAS_POR_MINUTO = 6
+# Token para dispositivos sin sesión: Authorization: Bearer <token>.
+TOKEN = os.environ.get("BIOLABHUB_TELEMETRIA_TOKEN")
+
+RESOLUCIONES = {"minuto": 60000, "hora": 3600000}
+
+
+class Telemetria:
+    def __init__(self, capacidad=CAPACIDAD_BUFFER):
+        self._buffer = deque(maxlen=capacidad)
+        self._lock = threading.Lock()
+        self._despertar = threading.Event()
+        self._activo = False
+        self._socketio = None
+        self._ultima_poda = 0
+        self.descartadas = 0
+        self._equipos = {}          # nombre -> id
+        self._nombres = {}          # id -> nombre
+        self._umbrales = {}         # (equipo_id, metrica) -> (minimo, maximo, sostenido_ms)
+        self._fuera_desde = {}      # (equipo_id, metrica) -> ts de la primera lectura fuera de rango
+        self.alertas = {}           # (equipo_id, metrica) -> alerta activa
+
+    # ---------- configuración ----------
+    def cargar(self):
+        equipos = ejecutar_select("SELECT id, nombre FROM equipos WHERE estado_logico = 0")
+        umbrales = ejecutar_select("SELECT * FROM umbrales_telemetria")
+        with self._lock:
+            self._equipos = {e["nombre"]: e["id"] for e in equipos}
+            self._nombres = {e["id"]: e["nombre"] for e in equipos}
+            self._umbrales = {
+                (u["equipo_id"], METRICAS[u["metrica"]]): (u["minimo"], u["maximo"], u["sostenido_seg"] * 1000)
+                for u in umbrales if u["metrica"] in METRICAS
+            }
+
+    def _equipo_id(self, equipo):
+        if isinstance(equipo, int) or str(equipo).isdigit():
+            equipo_id = int(equipo)
+            return equipo_id if equipo_id in self._nombres else None
+        return self._equipos.get(equipo)
+
+    # ---------- ingesta ----------
+    def ingerir(self, lecturas):
+        # lecturas: [{"equipo": id o nombre, "metrica": "temperatura",
+        # "valor": -79.4, "ts": segundos epoch (opcional)}, ...]
+        if len(lecturas) > MAX_LECTURAS_POR_PEDIDO:
+            raise ValueError(f"Máximo {MAX_LECTURAS_POR_PEDIDO} lecturas por envío.")
+        ahora = int(time.time() * 1000)
+        nuevas = []
+        for i, lectura in enumerate(lecturas):
+            try:
+                equipo_id = self._equipo_id(lectura["equipo"])
+                if equipo_id is None:
+                    self.cargar()
+                    equipo_id = self._equipo_id(lectura["equipo"])
+                metrica = METRICAS[lectura["metrica"]]
+                valor = float(lectura["valor"])
+                ts = int(float(lectura["ts"]) * 1000) if lectura.get("ts") is not None else ahora
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Lectura {i + 1} inválida.")
+            if equipo_id is None or not math.isfinite(valor):
+                raise ValueError(f"Lectura {i + 1} inválida.")
+            nuevas.append((equipo_id, metrica, ts, valor))
+
+        with self._lock:
+            libres = self._buffer.maxlen - len(self._buffer)
+            self._buffer.extend(nuevas)
+            if len(nuevas) > libres:
+                # Buffer lleno (la BD no da abasto): se pierden las más viejas.
+                self.descartadas += len(nuevas) - libres
+                metricas.incrementar("telemetria_descartadas", len(nuevas) - libres)
+            pendientes = len(self._buffer)
+        metricas.incrementar("telemetria_lecturas", len(nuevas))
+        if pendientes >= LOTE:
+            self._despertar.set()
+        return len(nuevas)
+
+    # ---------- volcado ----------
+    def volcar(self):
+        with self._lock:
+            lote = list(self._buffer)
+            self._buffer.clear()
+        if not lote:
+            return 0
+        lote.sort(key=lambda l: l[2])
+
+        def insertar(cursor):
+            # Un dispositivo que reintenta manda de nuevo la misma lectura
+            # (mismo equipo, métrica y ts): se queda la primera y a los
+            # rollups solo se suman las que entraron de verdad.
+            insertadas = []
+            for lectura in lote:
+                cursor.execute("""
+                    INSERT OR IGNORE INTO telemetria_lecturas (equipo_id, metrica, ts, valor)
+                    VALUES (?, ?, ?, ?)
+                """, lectura)
+                if cursor.rowcount:
+                    insertadas.append(lectura)
+            for resolucion, ancho in RESOLUCIONES.items():
+                cursor.executemany(f"""
+                    INSERT INTO telemetria_{resolucion} (equipo_id, metrica, {resolucion}, n, suma, minimo, maximo)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (equipo_id, metrica, {resolucion}) DO UPDATE SET
+                        n = n + excluded.n,
+                        suma = suma + excluded.suma,
+                        minimo = MIN(minimo, excluded.minimo),
+                        maximo = MAX(maximo, excluded.maximo)
+                """, _agregar(insertadas, ancho))
+            return insertadas
+
+        try:
+            insertadas = escritor.ejecutar(insertar)
+        except Exception:
+            # Se devuelven al buffer para el próximo intento.
+            with self._lock:
+                self._buffer.extendleft(reversed(lote))
+            raise
+
+        if len(insertadas) < len(lote):
+            metricas.incrementar("telemetria_repetidas", len(lote) - len(insertadas))
+        for evento in self._evaluar(insertadas):
+            self._emitir(evento)
+        return len(insertadas)
+
+    def podar(self):
+        ahora = int(time.time() * 1000)
+        def borrar(cursor):
+            # Se borra por prefijo de la PK (equipo, métrica): cada DELETE es
+            # un recorrido de rango y no un escaneo de toda la tabla.
+            claves = cursor.execute("SELECT DISTINCT equipo_id, metrica FROM telemetria_hora").fetchall()
+            for equipo_id, metrica in claves:
+                cursor.execute(
+                    "DELETE FROM telemetria_lecturas WHERE equipo_id = ? AND metrica = ? AND ts < ?",
+                    (equipo_id, metrica, ahora - RETENCION_CRUDA_H * 3600000),
+                )
+                cursor.execute(
+                    "DELETE FROM telemetria_minuto WHERE equipo_id = ? AND metrica = ? AND minuto < ?",
+                    (equipo_id, metrica, (ahora - RETENCION_MINUTOS_DIAS * 86400000) // 60000),
+                )
+
+        escritor.ejecutar(borrar, agrupable=False)
+
+    # ---------- alertas ----------
+    def _evaluar(self, lote):
+        # Una alerta se activa cuando la métrica lleva sostenido_ms fuera de
+        # rango y se normaliza con la primera lectura dentro del rango.
+        eventos = []
+        for equipo_id, metrica, ts, valor in lote:
+            clave = (equipo_id, metrica)
+            umbral = self._umbrales.get(clave)
+            if umbral is None:
+                continue
+            minimo, maximo, sostenido = umbral
+            if (minimo is not None and valor < minimo) or (maximo is not None and valor > maximo):
+                desde = self._fuera_desde.setdefault(clave, ts)
+                if clave not in self.alertas and ts - desde >= sostenido:
+                    self.alertas[clave] = self._alerta("fuera_de_rango", equipo_id, metrica, valor, desde, umbral)
+                    eventos.append(self.alertas[clave])
+            else:
+                self._fuera_desde.pop(clave, None)
+                if clave in self.alertas:
+                    self.alertas.pop(clave)
+                    eventos.append(self._alerta("normalizada", equipo_id, metrica, valor, ts, umbral))
+        return eventos
+
+    def _alerta(self, tipo, equipo_id, metrica, valor, desde, umbral):
+        nombre, equipo = NOMBRES_METRICA[metrica], self._nombres.get(equipo_id, equipo_id)
+        if tipo == "fuera_de_rango":
+            rango = " / ".join(f"{e} {v}" for e, v in (("mín.", umbral[0]), ("máx.", umbral[1])) if v is not None)
+            mensaje = f"{equipo}: {nombre} en {valor:g} {UNIDADES[nombre]} ({rango})."
+        else:
+            mensaje = f"{equipo}: {nombre} volvió al rango normal ({valor:g} {UNIDADES[nombre]})."
+        return {"tipo": tipo, "equipo_id": equipo_id, "equipo": equipo, "metrica": nombre,
+                "valor": valor, "desde": desde, "mensaje": mensaje}
+
+    def _emitir(self, evento):
+        if self._socketio is not None:
+            self._socketio.emit("alerta_equipo", evento)
+
+    # ---------- hilo de volcado ----------
+    def iniciar(self, socketio):
+        if self._activo:
+            return
+        self._activo = True
+        self._socketio = socketio
+        self.cargar()
+        socketio.start_background_task(self._bucle)
+        if os.environ.get("BIOLABHUB_SIMULADOR_TELEMETRIA") == "1":
+            socketio.start_background_task(simular, self.ingerir)
+
+    def _bucle(self):
+        while True:
+            self._despertar.wait(VOLCAR_CADA)
+            self._despertar.clear()
+            try:
+                self.volcar()
+                if time.time() - self._ultima_poda >= PODAR_CADA:
+                    self._ultima_poda = time.time()
+                    self.podar()
+            except Exception as e:
+                print("Error volcando telemetría:", e)
+
+
+def _agregar(lote, ancho):
+    # (equipo, métrica, bucket, n, suma, mínimo, máximo) por bucket de `ancho` ms
+    grupos = {}
+    for equipo_id, metrica, ts, valor in lote:
+        clave = (equipo_id, metrica, ts // ancho)
+        g = grupos.get(clave)
+        if g is None:
+            grupos[clave] = [1, valor, valor, valor]
+        else:
+            g[0] += 1
+            g[1] += valor
+            g[2] = min(g[2], valor)
+            g[3] = max(g[3], valor)
+    return [clave + tuple(g) for clave, g in grupos.items()]
+
+
+telemetria = Telemetria()
+
+
+def iniciar_telemetria(socketio):
+    telemetria.iniciar(socketio)
+
+
+# ========================================
+#  CONSULTAS
+# ========================================
+def serie(equipo_id, metrica, desde_ms, hasta_ms):
+    resolucion = "minuto" if hasta_ms - desde_ms <= HORAS_POR_MINUTO * 3600000 else "hora"
+    ancho = RESOLUCIONES[resolucion]
+    filas = ejecutar_select(f"""
+        SELECT {resolucion} AS bucket, n, suma, minimo, maximo
+        FROM telemetria_{resolucion}
+        WHERE equipo_id = ? AND metrica = ? AND {resolucion} BETWEEN ? AND ?
+        ORDER BY {resolucion}
+    """, (equipo_id, METRICAS[metrica], desde_ms // ancho, hasta_ms // ancho))
+    return {
+        "resolucion": resolucion,
+        "puntos": [
+            {"t": f["bucket"] * ancho, "promedio": f["suma"] / f["n"], "minimo": f["minimo"], "maximo": f["maximo"]}
+            for f in filas
+        ],
+    }
+
+
+def estado_equipos():
+    # Último minuto registrado de cada (equipo, métrica) con datos.
+    filas = ejecutar_select("""
+        SELECT e.id, e.nombre, t.metrica, t.minuto, t.suma / t.n AS promedio, t.maximo
+        FROM (SELECT DISTINCT equipo_id, metrica FROM telemetria_hora) k
+        JOIN equipos e ON e.id = k.equipo_id
+        JOIN telemetria_minuto t ON t.equipo_id = k.equipo_id AND t.metrica = k.metrica
+        WHERE t.minuto = (
+            SELECT MAX(minuto) FROM telemetria_minuto
+            WHERE equipo_id = k.equipo_id AND metrica = k.metrica
+        )
+        ORDER BY e.nombre, t.metrica
+    """)
+    umbrales = {(u["equipo_id"], u["metrica"]): u for u in ejecutar_select("SELECT * FROM umbrales_telemetria", cache=True)}
+    equipos = {}
+    for f in filas:
+        nombre = NOMBRES_METRICA.get(f["metrica"])
+        if nombre is None:
+            continue
+        equipo = equipos.setdefault(f["id"], {"id": f["id"], "nombre": f["nombre"], "metricas": []})
+        u = umbrales.get((f["id"], nombre))
+        equipo["metricas"].append({
+            "metrica": nombre,
+            "unidad": UNIDADES[nombre],
+            "valor": f["promedio"],
+            "maximo": f["maximo"],
+            "minuto": f["minuto"] * 60000,
+            "umbral_min": u["minimo"] if u else None,
+            "umbral_max": u["maximo"] if u else None,
+            "alerta": (f["id"], f["metrica"]) in telemetria.alertas,
+        })
+    return list(equipos.values())
+
+
+# ========================================
+#  SIMULADOR
+# ========================================
+# Reemplaza a los equipos reales: un freezer -80 °C cuya puerta se abre de
+# vez en cuando (y se calienta mientras está abierta) y una centrífuga
+# refrigerada que alterna corridas y reposo.
+def _generador(hz):
+    paso = 1.0 / hz
+    temp_freezer, puerta_hasta = -80.0, 0.0
+    rpm_objetivo, corrida_hasta, rpm = 0, 0.0, 0.0
+    while True:
+        ahora = time.time()
+        if ahora >= puerta_hasta and random.random() < paso / 900:
+            puerta_hasta = ahora + random.uniform(20, 180)
+        abierta = ahora < puerta_hasta
+        temp_freezer += (0.15 if abierta else -0.02 * (temp_freezer + 80)) * paso * 10
+        if ahora >= corrida_hasta:
+            rpm_objetivo = 0 if rpm_objetivo else random.choice((8000, 12000, 14680))
+            corrida_hasta = ahora + random.uniform(60, 600)
+        rpm += (rpm_objetivo - rpm) * min(1.0, paso * 0.5)
+        yield [
+            {"equipo": "Freezer -80°C", "metrica": "temperatura", "valor": round(temp_freezer + random.gauss(0, 0.1), 2), "ts": ahora},
+            {"equipo": "Freezer -80°C", "metrica": "puerta", "valor": 1 if abierta else 0, "ts": ahora},
+            {"equipo": "Centrífuga Eppendorf 5424R", "metrica": "rpm", "valor": round(max(rpm + random.gauss(0, 15), 0)), "ts": ahora},
+            {"equipo": "Centrífuga Eppendorf 5424R", "metrica": "temperatura", "valor": round(4 + random.gauss(0, 0.3), 2), "ts": ahora},
+        ]
+
+
+def simular(destino, hz=10, segundos=None, lote_seg=1.0):
+    # destino(lecturas): telemetria.ingerir en el mismo proceso, o un POST
+    # HTTP (ver enviar_http) para probar el camino completo.
+    fin = time.time() + segundos if segundos else None
+    pendientes = []
+    for lecturas in _generador(hz):
+        pendientes.extend(lecturas)
+        if len(pendientes) >= 4 * hz * lote_seg:
+            try:
+                destino(pendientes)
+            except Exception as e:
+                print("Error del simulador de telemetría:", e)
+            pendientes = []
+        if fin and time.time() >= fin:
+            break
+        time.sleep(1.0 / hz)
+
+
+def enviar_http(url, token=None):
+    def destino(lecturas):
+        pedido = urllib.request.Request(
+            url.rstrip("/") + "/equipreserve/telemetria/lecturas",
+            data=json.dumps({"lecturas": lecturas}).encode(),
+            headers={"Content-Type": "application/json", **({"Authorization": f"Bearer {token}"} if token else {})},
+        )
+        urllib.request.urlopen(pedido, timeout=10).read()
+    return destino
+
+
+# ========================================
+#  RUTAS
+# ========================================
+def _autorizado():
+    if "usuario_id" in session:
+        return True
+    return bool(TOKEN) and request.headers.get("Authorization") == f"Bearer {TOKEN}"
+
+
+@telemetria_bp.route("/equipreserve/telemetria/lecturas", methods=["POST"])
+def recibir_lecturas():
+    if not _autorizado():
+        return jsonify({"error": "No autenticado."}), 401
+    datos = request.get_json(silent=True)
+    if isinstance(datos, dict):
+        datos = datos.get("lecturas", [datos])
+    if not isinstance(datos, list):
+        return jsonify({"error": "Se esperaba JSON con 'lecturas'."}), 400
+    try:
+        aceptadas = telemetria.ingerir(datos)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"aceptadas": aceptadas}), 202
+
+
+def recibir_lecturas_socket(datos):
+    # Evento Socket.IO "telemetria": {"token": ..., "lecturas": [...]}; la
+    # respuesta va en el ack.
+    datos = datos or {}
+    if "usuario_id" not in session and not (TOKEN and datos.get("token") == TOKEN):
+        return {"error": "No autenticado."}
+    try:
+        return {"aceptadas": telemetria.ingerir(datos.get("lecturas") or [])}
+    except ValueError as e:
+        return {"error": str(e)}
+
+
+@telemetria_bp.route("/equipreserve/telemetria")
+def telemetria_panel():
+    if "usuario_id" not in session:
+        flash("Debes iniciar sesión primero.", "error")
+        return redirect(url_for("login_bp.login"))
+    return render_template(
+        "equipreserve/Telemetria.html",
+        equipos=estado_equipos(),
+        umbrales=ejecutar_select("""
+            SELECT u.*, e.nombre AS equipo FROM umbrales_telemetria u
+            JOIN equipos e ON e.id = u.equipo_id ORDER BY e.nombre, u.metrica
+        """, cache=True),
+        todos_equipos=ejecutar_select("SELECT id, nombre FROM equipos WHERE estado_logico = 0 ORDER BY nombre", cache=True),
+        metricas=list(METRICAS),
+        alertas=list(telemetria.alertas.values()),
+    )
+
+
+@telemetria_bp.route("/equipreserve/telemetria/datos")
+def telemetria_datos():
+    if "usuario_id" not in session:
+        return jsonify({"error": "No autenticado."}), 401
+    metrica = request.args.get("metrica", "temperatura")
+    if metrica not in METRICAS:
+        return jsonify({"error": "Métrica inválida."}), 400
+    try:
+        equipo_id = int(request.args["equipo_id"])
+        horas = min(float(request.args.get("horas", 1)), 24 * 365)
+    except (KeyError, ValueError):
+        return jsonify({"error": "Parámetros inválidos."}), 400
+    hasta = int(time.time() * 1000)
+    return jsonify(serie(equipo_id, metrica, hasta - int(horas * 3600000), hasta))
+
+
+@telemetria_bp.route("/equipreserve/telemetria/umbrales", methods=["POST"])
+def guardar_umbral():
+    if session.get("rol") != "admin":
+        flash("Solo los administradores pueden cambiar umbrales.", "error")
+        return redirect(url_for("telemetria_bp.telemetria_panel"))
+    try:
+        equipo_id = int(request.form["equipo_id"])
+        metrica = request.form["metrica"]
+        minimo = float(request.form["minimo"]) if request.form.get("minimo") else None
+        maximo = float(request.form["maximo"]) if request.form.get("maximo") else None
+        sostenido = int(request.form.get("sostenido_seg") or 0)
+        if metrica not in METRICAS:
+            raise ValueError
+    except (KeyError, ValueError):
+        flash("Umbral inválido.", "error")
+        return redirect(url_for("telemetria_bp.telemetria_panel"))
+    if minimo is None and maximo is None:
+        ejecutar_update("DELETE FROM umbrales_telemetria WHERE equipo_id = ? AND metrica = ?", (equipo_id, metrica))
+    else:
+        ejecutar_update("""
+            INSERT OR REPLACE INTO umbrales_telemetria (equipo_id, metrica, minimo, maximo, sostenido_seg)
+            VALUES (?, ?, ?, ?, ?)
+        """, (equipo_id, metrica, minimo, maximo, sostenido))
+    telemetria.cargar()
+    flash("Umbral actualizado.", "success")
+    return redirect(url_for("telemetria_bp.telemetria_panel"))
+
+
+# ========================================
+#  CLI
+# ========================================
+# python telemetria.py simular --url http://localhost:5000 [--hz 10] [--token X] [--segundos 60]
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulador de telemetría de BioLabHub")
+    parser.add_argument("accion", choices=("simular",))
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--hz", type=float, default=10)
+    parser.add_argument("--token", default=TOKEN)
+    parser.add_argument("--segundos", type=float)
+    args = parser.parse_args()
+    print(f" Simulando {args.hz:g} Hz contra {args.url} (Ctrl+C para cortar)")
+    try:
+        simular(enviar_http(args.url, args.token), hz=args.hz, segundos=args.segundos)
+    except KeyboardInterrupt:
+        sys.exit(0)
@@ -0,0 +1,162 @@
+# ========================================
+#  BENCHMARK: CONTROL DE ADMISIÓN
+# ========================================
+# Varios hilos piden /admin/recalcular_todo sin parar (un admin apurado o
+# un script) mientras otros usuarios navegan /samples y cargan muestras
+# (escrituras que esperan al mismo escritor que el recálculo). Se mide la
+# latencia de esos requests y cuántos pedidos pesados corrieron, con y sin
+# control de admisión. Cada modo corre en un proceso y una base nuevos,
+# para que el recálculo que quedó en curso de uno no ensucie al otro.
+#
+#   python benchmarks/bench_admision.py --muestras 3000 --pesados 8 --segundos 15
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+
+def sembrar(muestras, usuarios):
+    import bcrypt
+    from db import crear_bd, conectar_bd, recalcular_dvv
+
+    crear_bd()
+    conn = conectar_bd()
+    # Un usuario por hilo liviano: cada uno con su bucket, como en la realidad.
+    hash_clave = bcrypt.hashpw(b"clave123", bcrypt.gensalt(4)).decode()
+    conn.executemany(
+        "INSERT INTO usuarios (nombre, email, contraseña_hash, rol, estado_logico, dvh) VALUES (?, ?, ?, 'usuario', 0, 0)",
+        ((f"Usuario {i}", f"usuario{i}@biolabhub.com", hash_clave) for i in range(usuarios)),
+    )
+    conn.executemany(
+        "INSERT INTO muestras (nombre, tipo, estado, ubicacion, responsable_id, estado_logico, dvh) "
+        "VALUES (?, 'ADN', 'En análisis', 'Laboratorio Químico', 1, 0, 0)",
+        ((f"Muestra {i}",) for i in range(muestras)),
+    )
+    conn.commit()
+    conn.close()
+    for tabla in ("muestras", "usuarios"):
+        recalcular_dvv(tabla)
+
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    valores = sorted(valores)
+    return round(valores[min(len(valores) - 1, int(len(valores) * p / 100))], 2)
+
+
+def correr(app, activo, pesados, livianos, segundos):
+    import admision
+
+    # Los logins (bcrypt, con tope de concurrencia) se hacen antes de medir.
+    admision.ACTIVO = False
+    clientes = []
+    for i in range(pesados + livianos):
+        c = app.test_client()
+        # Cada cliente desde su IP.
+        c.environ_base["REMOTE_ADDR"] = f"10.0.{i // 250}.{i % 250 + 1}"
+        if i < pesados:
+            datos = {"email": "admin@biolabhub.com", "contraseña": "admin123"}
+        else:
+            datos = {"email": f"usuario{i - pesados}@biolabhub.com", "contraseña": "clave123"}
+        assert c.post("/login", data=datos).status_code == 302
+        clientes.append(c)
+    admision.ACTIVO = activo
+    admision._buckets.clear()
+    fin = time.monotonic() + segundos
+    latencias, estados_pesados = [], {}
+    lock = threading.Lock()
+
+    def pesado(c):
+        while time.monotonic() < fin:
+            respuesta = c.post("/admin/recalcular_todo")
+            with lock:
+                estados_pesados[respuesta.status_code] = estados_pesados.get(respuesta.status_code, 0) + 1
+            if "Retry-After" in respuesta.headers:
+                time.sleep(min(float(respuesta.headers["Retry-After"]), max(0, fin - time.monotonic())))
+
+    def liviano(c, i):
+        propias = []
+        while time.monotonic() < fin:
+            inicio = time.perf_counter()
+            if i % 2:
+                codigo = c.post("/samples/add", data={"nombre": f"Nueva {i}", "tipo": "ADN", "estado": "Pendiente",
+                                                      "ubicacion": "Laboratorio Químico"}).status_code
+            else:
+                codigo = c.get("/samples").status_code
+            assert codigo in (200, 302)
+            propias.append((time.perf_counter() - inicio) * 1000)
+            # Una persona navegando: un par de páginas por segundo.
+            time.sleep(0.3)
+        with lock:
+            latencias.extend(propias)
+
+    hilos = [threading.Thread(target=pesado, args=(clientes[i],)) for i in range(pesados)]
+    hilos += [threading.Thread(target=liviano, args=(clientes[pesados + i], i)) for i in range(livianos)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    return {
+        "livianos_requests": len(latencias),
+        "livianos_p50_ms": _percentil(latencias, 50),
+        "livianos_p95_ms": _percentil(latencias, 95),
+        "pesados_por_estado": {str(k): v for k, v in sorted(estados_pesados.items())},
+    }
+
+
+def medir(args):
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_admision_")
+    os.environ["BIOLABHUB_DB"] = os.path.join(carpeta, "admision.db")
+    os.environ["BIOLABHUB_JINJA_CACHE"] = os.path.join(carpeta, "jinja")
+    os.environ["BIOLABHUB_STATIC_DIST"] = os.path.join(carpeta, "static_dist")
+    sys.path.insert(0, BACKEND)
+
+    sembrar(args.muestras, args.livianos)
+    import servidor
+
+    app = servidor.obtener_app()
+    # Sin testing: es lo que hace que admision.py aplique los límites.
+    app.testing = False
+    return correr(app, args.modo == "con_admision", args.pesados, args.livianos, args.segundos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control de admisión de BioLabHub")
+    parser.add_argument("--muestras", type=int, default=3000)
+    parser.add_argument("--pesados", type=int, default=8, help="hilos pidiendo recalcular_todo")
+    parser.add_argument("--livianos", type=int, default=16, help="usuarios navegando y cargando muestras")
+    parser.add_argument("--segundos", type=float, default=15)
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    parser.add_argument("--modo", choices=("sin_admision", "con_admision"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.modo:
+        print(json.dumps(medir(args)))
+        return
+
+    resultados = {}
+    for modo in ("sin_admision", "con_admision"):
+        salida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--modo", modo, "--muestras", str(args.muestras),
+             "--pesados", str(args.pesados), "--livianos", str(args.livianos), "--segundos", str(args.segundos)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        resultados[modo] = r = json.loads(salida.strip().splitlines()[-1])
+        print(f"{modo:<13} livianos: {r['livianos_requests']} requests, p50 {r['livianos_p50_ms']} ms, "
+              f"p95 {r['livianos_p95_ms']} ms | recalcular_todo por estado: {r['pesados_por_estado']}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# ========================================
+#  BENCHMARK: ANALÍTICA DE USO DE EQUIPOS
+# ========================================
+# Siembra una BD temporal con un año de reservas y mide:
+#   - reconstruir_resumen(): carga en bloque + bineado con numpy
+#   - calcular_uso() de un año leyendo el resumen diario
+#   - lo mismo recorriendo las reservas fila por fila en Python (referencia)
+#
+#   python benchmarks/bench_analitica.py --reservas-por-dia 12
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+
+def sembrar(dias, por_dia, semilla):
+    from db import crear_bd, conectar_bd
+
+    crear_bd()
+    rnd = random.Random(semilla)
+    conn = conectar_bd()
+    equipos = [r[0] for r in conn.execute("SELECT nombre FROM equipos").fetchall()]
+    inicio = date.today() - timedelta(days=dias)
+    filas = []
+    for d in range(dias):
+        dia = datetime.combine(inicio + timedelta(days=d), datetime.min.time())
+        for _ in range(por_dia):
+            desde = dia + timedelta(hours=rnd.randint(7, 19), minutes=rnd.choice((0, 15, 30, 45)))
+            hasta = desde + timedelta(minutes=rnd.choice((30, 60, 90, 120, 240)))
+            filas.append((rnd.choice(equipos), desde.strftime("%Y-%m-%dT%H:%M"), hasta.strftime("%Y-%m-%dT%H:%M")))
+    conn.executemany(
+        "INSERT INTO reservas_equipos (equipo, fecha_inicio, fecha_fin, usuario_id, estado, dvh) VALUES (?, ?, ?, 1, 'Reservado', 0)",
+        filas,
+    )
+    conn.commit()
+    conn.close()
+    return len(filas), inicio
+
+
+def por_fila(desde, hasta):
+    # Lo que haría falta sin resumen: recorrer cada reserva minuto a minuto.
+    from db import ejecutar_select
+
+    minutos = {}
+    for r in ejecutar_select(
+        "SELECT equipo, fecha_inicio, fecha_fin FROM reservas_equipos WHERE estado_logico = 0"
+    ):
+        t = datetime.fromisoformat(r["fecha_inicio"])
+        fin = datetime.fromisoformat(r["fecha_fin"])
+        while t < fin:
+            if desde <= t.date() < hasta:
+                clave = (r["equipo"], t.weekday(), t.hour)
+                minutos[clave] = minutos.get(clave, 0) + 1
+            t += timedelta(minutes=1)
+    return minutos
+
+
+def _medir(func, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return round(statistics.median(tiempos), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analítica de uso de equipos en BioLabHub")
+    parser.add_argument("--dias", type=int, default=365)
+    parser.add_argument("--reservas-por-dia", type=int, default=12)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    os.environ["BIOLABHUB_DB"] = os.path.join(tempfile.mkdtemp(prefix="biolabhub_uso_"), "uso.db")
+    sys.path.insert(0, BACKEND)
+    from analitica import reconstruir_resumen, calcular_uso
+
+    n, inicio = sembrar(args.dias, args.reservas_por_dia, args.semilla)
+    print(f"{n} reservas en {args.dias} días")
+    hasta = date.today() + timedelta(days=1)
+
+    resultado = {
+        "reservas": n,
+        "reconstruir_ms": _medir(reconstruir_resumen, 3),
+        "calcular_uso_ms": _medir(lambda: calcular_uso(inicio, hasta), args.repeticiones),
+        "por_fila_ms": _medir(lambda: por_fila(inicio, hasta), 1),
+    }
+    print(f"reconstruir_resumen (numpy):   {resultado['reconstruir_ms']:>10.2f} ms")
+    print(f"calcular_uso un año (resumen): {resultado['calcular_uso_ms']:>10.2f} ms")
+    print(f"fila por fila en Python:       {resultado['por_fila_ms']:>10.2f} ms")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# ========================================
+#  BENCHMARK DE ARRANQUE
+# ========================================
+# Mide, en procesos nuevos (como un reinicio del contenedor):
+#   - import servidor
+#   - create_app() (blueprints + verificación de esquema)
+#   - primer request a "/"
+# con la BD ya en la versión de esquema actual y con una BD vacía.
+#
+#   python benchmarks/bench_arranque.py --repeticiones 10
+#   python benchmarks/bench_arranque.py --importtime   # top de módulos más lentos
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+MEDICION = r"""
+import json, time
+t0 = time.perf_counter()
+import servidor
+t1 = time.perf_counter()
+app = servidor.create_app()
+t2 = time.perf_counter()
+app.test_client().get("/")
+t3 = time.perf_counter()
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "create_app_ms": (t2 - t1) * 1000,
+    "primer_request_ms": (t3 - t2) * 1000,
+    "total_ms": (t3 - t0) * 1000,
+}))
+"""
+
+
+def _medir_una_vez(ruta_db):
+    env = dict(os.environ, BIOLABHUB_DB=ruta_db)
+    salida = subprocess.run(
+        [sys.executable, "-c", MEDICION], cwd=BACKEND, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def _resumir(mediciones):
+    return {
+        clave: {
+            "mediana_ms": round(statistics.median(m[clave] for m in mediciones), 2),
+            "min_ms": round(min(m[clave] for m in mediciones), 2),
+            "max_ms": round(max(m[clave] for m in mediciones), 2),
+        }
+        for clave in mediciones[0]
+    }
+
+
+def _importtime(ruta_db, top):
+    env = dict(os.environ, BIOLABHUB_DB=ruta_db)
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import servidor"], cwd=BACKEND, env=env,
+        capture_output=True, text=True,
+    ).stderr
+    # formato: "import time: self [us] | cumulative | imported package"
+    filas = []
+    for linea in err.splitlines():
+        partes = linea.split("|")
+        if not linea.startswith("import time:") or len(partes) != 3 or not partes[1].strip().isdigit():
+            continue
+        filas.append((int(partes[1].strip()), partes[2].strip()))
+    for acumulado, modulo in sorted(filas, reverse=True)[:top]:
+        print(f"{acumulado / 1000:>9.1f} ms  {modulo}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de arranque de BioLabHub")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_arranque_")
+    ruta_db = os.path.join(carpeta, "arranque.db")
+
+    if args.importtime:
+        _importtime(ruta_db, args.top)
+        return
+
+    # Primer arranque: BD inexistente, corre crear_bd() completo.
+    frio = _medir_una_vez(ruta_db)
+    # Arranques siguientes: la versión de esquema coincide y se saltea.
+    tibios = [_medir_una_vez(ruta_db) for _ in range(args.repeticiones)]
+
+    resultado = {
+        "bd_nueva": {k: round(v, 2) for k, v in frio.items()},
+        "bd_existente": _resumir(tibios),
+        "repeticiones": args.repeticiones,
+    }
+    print(f"BD nueva:      total {resultado['bd_nueva']['total_ms']:.1f} ms "
+          f"(create_app {resultado['bd_nueva']['create_app_ms']:.1f} ms)")
+    for clave, r in resultado["bd_existente"].items():
+        print(f"BD existente:  {clave:<18} mediana {r['mediana_ms']:>8.1f} ms  "
+              f"[{r['min_ms']:.1f} - {r['max_ms']:.1f}]")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# ========================================
+#  BENCHMARK: FTS5 vs LIKE
+# ========================================
+# Siembra una BD temporal con N muestras y N experimentos y compara la
+# búsqueda por LIKE '%…%' (lo que haría falta sin índice) contra las
+# tablas FTS5 que mantiene crear_bd().
+#
+#   python benchmarks/bench_busqueda.py --filas 100000
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+DOMINIO = (
+    "sangre suelo cultivo plasma suero tejido bacteria levadura plasmido enzima "
+    "centrifugado congelado extraccion purificacion secuenciacion amplificacion "
+    "proteina anticuerpo celula cepa reactivo buffer fenol cloroformo etanol "
+    "microscopia espectro absorbancia incubacion esterilizacion placa colonia"
+).split()
+
+
+def _vocabulario(rnd, n=20000):
+    # Vocabulario grande con distribución tipo Zipf: unas pocas palabras muy
+    # frecuentes y una cola larga, como en texto real.
+    silabas = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "te", "vi", "zo", "tra", "pro"]
+    palabras = list(DOMINIO)
+    while len(palabras) < n:
+        palabras.append("".join(rnd.choice(silabas) for _ in range(rnd.randint(2, 4))))
+    rnd.shuffle(palabras)
+    pesos = [1.0 / (i + 1) for i in range(len(palabras))]
+    return palabras, pesos
+
+
+LIKE_MUESTRAS = """
+    SELECT id, nombre FROM muestras
+    WHERE estado_logico = 0 AND (nombre LIKE ? OR tipo LIKE ? OR ubicacion LIKE ?)
+    LIMIT 20
+"""
+LIKE_EXPERIMENTOS = """
+    SELECT id, titulo FROM experimentos
+    WHERE (estado_logico = 0 OR estado_logico IS NULL) AND (titulo LIKE ? OR descripcion LIKE ?)
+    LIMIT 20
+"""
+
+
+def _frase(rnd, vocab, n):
+    return " ".join(rnd.choices(vocab[0], vocab[1], k=n))
+
+
+def sembrar(filas, semilla):
+    from db import crear_bd, conectar_bd
+
+    crear_bd()
+    rnd = random.Random(semilla)
+    vocab = _vocabulario(rnd)
+    conn = conectar_bd()
+    labs = [r[0] for r in conn.execute("SELECT nombre FROM laboratorios").fetchall()]
+    conn.executemany(
+        "INSERT INTO muestras (nombre, tipo, estado, ubicacion, estado_logico) VALUES (?, ?, 'En análisis', ?, 0)",
+        ((f"{_frase(rnd, vocab, 3)} {i}", rnd.choice(DOMINIO), rnd.choice(labs)) for i in range(filas)),
+    )
+    conn.executemany(
+        "INSERT INTO experimentos (titulo, descripcion, estado, estado_logico) VALUES (?, ?, 'Planificado', 0)",
+        ((f"{_frase(rnd, vocab, 4)} {i}", _frase(rnd, vocab, 40)) for i in range(filas)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _medir(func, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return round(statistics.median(tiempos), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FTS5 vs LIKE en BioLabHub")
+    parser.add_argument("--filas", type=int, default=100000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    os.environ["BIOLABHUB_DB"] = os.path.join(tempfile.mkdtemp(prefix="biolabhub_fts_"), "fts.db")
+    sys.path.insert(0, BACKEND)
+    from db import conectar_bd
+    from busqueda import buscar, armar_consulta_fts
+
+    print(f"Sembrando {args.filas} muestras y {args.filas} experimentos...")
+    inicio = time.perf_counter()
+    sembrar(args.filas, args.semilla)
+    print(f"Listo en {time.perf_counter() - inicio:.1f} s (incluye mantenimiento de FTS por triggers)")
+
+    conn = conectar_bd()
+    resultados = {}
+    for termino in ("cloroformo", "centrif", "plasmido enzima", "microscopia"):
+        patron = f"%{termino}%"
+
+        def con_like():
+            # igual que /search: total + primera página
+            for sql, params in ((LIKE_MUESTRAS, (patron,) * 3), (LIKE_EXPERIMENTOS, (patron,) * 2)):
+                conn.execute(f"SELECT COUNT(*) FROM ({sql.replace('LIMIT 20', '')})", params).fetchone()
+                conn.execute(sql, params).fetchall()
+
+        def con_fts():
+            buscar(termino, ("muestras", "experimentos"), 1, 20)
+
+        like_ms = _medir(con_like, args.repeticiones)
+        fts_ms = _medir(con_fts, args.repeticiones)
+        resultados[termino] = {"like_ms": like_ms, "fts_ms": fts_ms, "fts_match": armar_consulta_fts(termino)}
+        print(f"{termino:<18} LIKE {like_ms:>9.2f} ms   FTS5 {fts_ms:>9.2f} ms   x{like_ms / max(fts_ms, 1e-6):.1f}")
+    conn.close()
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"filas": args.filas, "resultados": resultados}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+# ========================================
+#  BENCHMARK: CACHE DE CONSULTAS
+# ========================================
+# 1) ejecutar_select de las consultas que usan cache=True, sin cache y con
+#    la entrada ya cargada.
+# 2) Varios hilos repiten esas lecturas mientras otro escribe por el
+#    escritor: consultas por segundo, tasa de aciertos e invalidaciones.
+#
+#   python benchmarks/bench_cache_consultas.py --hilos 8 --segundos 3
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+CONSULTAS = {
+    "laboratorios": ("SELECT nombre FROM laboratorios WHERE estado_logico = 0 ORDER BY nombre ASC", ()),
+    "equipos": ("SELECT nombre FROM equipos WHERE estado_logico = 0 ORDER BY nombre ASC", ()),
+    "inicio": ("""
+        SELECT id, titulo, descripcion, fecha_inicio, estado
+        FROM experimentos
+        WHERE responsable_id = ?
+          AND estado_logico = 0
+        ORDER BY fecha_inicio DESC
+        LIMIT 5
+    """, (1,)),
+}
+
+
+def sembrar(experimentos):
+    from db import crear_bd, conectar_bd, recalcular_dvv
+
+    crear_bd()
+    conn = conectar_bd()
+    conn.executemany(
+        "INSERT INTO experimentos (titulo, descripcion, fecha_inicio, fecha_fin, estado, responsable_id, "
+        "estado_logico, dvh) VALUES (?, 'Descripción', ?, ?, 'Planificado', ?, 0, 0)",
+        ((f"Experimento {i}", f"2025-{i % 12 + 1:02d}-01", f"2025-{i % 12 + 1:02d}-28", i % 20 + 1)
+         for i in range(experimentos)),
+    )
+    conn.commit()
+    conn.close()
+    recalcular_dvv("experimentos")
+
+
+def _mediana_us(func, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append((time.perf_counter() - inicio) * 1e6)
+    return round(statistics.median(tiempos), 1)
+
+
+def medir_lecturas(repeticiones):
+    from db import ejecutar_select
+
+    resultados = {}
+    for nombre, (query, parametros) in CONSULTAS.items():
+        sin = _mediana_us(lambda: ejecutar_select(query, parametros), repeticiones)
+        ejecutar_select(query, parametros, cache=True)
+        con = _mediana_us(lambda: ejecutar_select(query, parametros, cache=True), repeticiones)
+        resultados[nombre] = {"sin_cache_us": sin, "con_cache_us": con}
+    return resultados
+
+
+def medir_concurrencia(hilos, segundos, escrituras_por_segundo, cache):
+    import cache_consultas
+    from db import ejecutar_select, ejecutar_update
+
+    cache_consultas.vaciar()
+    antes = {c["consulta"]: dict(c) for c in cache_consultas.estadisticas()["consultas"]}
+    fin = time.monotonic() + segundos
+    cuentas = [0] * hilos
+
+    def lector(h):
+        consultas = list(CONSULTAS.values())
+        i = 0
+        while time.monotonic() < fin:
+            query, parametros = consultas[i % len(consultas)]
+            ejecutar_select(query, parametros, cache=cache)
+            cuentas[h] += 1
+            i += 1
+
+    def escritor():
+        # Toca experimentos (invalida "inicio"); laboratorios y equipos quedan.
+        while time.monotonic() < fin:
+            ejecutar_update("UPDATE experimentos SET descripcion = descripcion WHERE id = 1")
+            time.sleep(1 / escrituras_por_segundo)
+
+    lista = [threading.Thread(target=lector, args=(h,)) for h in range(hilos)]
+    lista.append(threading.Thread(target=escritor))
+    for t in lista:
+        t.start()
+    for t in lista:
+        t.join()
+
+    resultado = {"consultas_por_segundo": round(sum(cuentas) / segundos, 1)}
+    if cache:
+        despues = cache_consultas.estadisticas()["consultas"]
+        aciertos = sum(c["aciertos"] - antes.get(c["consulta"], {}).get("aciertos", 0) for c in despues)
+        fallos = sum(c["fallos"] - antes.get(c["consulta"], {}).get("fallos", 0) for c in despues)
+        resultado["tasa_aciertos"] = round(aciertos / ((aciertos + fallos) or 1), 3)
+        resultado["invalidaciones"] = sum(
+            c["invalidaciones"] - antes.get(c["consulta"], {}).get("invalidaciones", 0) for c in despues
+        )
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache de consultas de BioLabHub")
+    parser.add_argument("--experimentos", type=int, default=20000)
+    parser.add_argument("--repeticiones", type=int, default=500)
+    parser.add_argument("--hilos", type=int, default=8)
+    parser.add_argument("--segundos", type=float, default=3)
+    parser.add_argument("--escrituras", type=float, default=20, help="escrituras por segundo durante la prueba")
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_cache_consultas_")
+    os.environ["BIOLABHUB_DB"] = os.path.join(carpeta, "cache.db")
+    sys.path.insert(0, BACKEND)
+    from db import activar_wal
+
+    print(f"Sembrando {args.experimentos} experimentos...")
+    sembrar(args.experimentos)
+    activar_wal()
+
+    lecturas = medir_lecturas(args.repeticiones)
+    for nombre, r in lecturas.items():
+        print(f"{nombre:<14} sin cache {r['sin_cache_us']:>8} us   con cache {r['con_cache_us']:>6} us")
+
+    concurrencia = {
+        "sin_cache": medir_concurrencia(args.hilos, args.segundos, args.escrituras, False),
+        "con_cache": medir_concurrencia(args.hilos, args.segundos, args.escrituras, True),
+    }
+    for modo, r in concurrencia.items():
+        extra = f"  aciertos {r['tasa_aciertos']:.1%}  invalidaciones {r['invalidaciones']}" if "tasa_aciertos" in r else ""
+        print(f"{modo:<10} {args.hilos} hilos: {r['consultas_por_segundo']:>9} consultas/s{extra}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"lecturas": lecturas, "concurrencia": concurrencia}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
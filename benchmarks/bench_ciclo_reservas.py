@@ -0,0 +1,119 @@
+# ========================================
+#  BENCHMARK: CICLO DE VIDA DE RESERVAS
+# ========================================
+# Siembra decenas de miles de reservas futuras (repartidas en varios
+# meses) más un grupo que vence ahora, y mide:
+# 1) la recarga de la ventana: tiempo y cuántos bordes quedan en el heap;
+# 2) un tick con todas las transiciones vencidas juntas: tiempo, filas
+#    cambiadas y refresh_calendar emitidos;
+# 3) que la integridad (DVV y Merkle) siga cerrando después.
+#
+#   python benchmarks/bench_ciclo_reservas.py --futuras 50000 --vencidas 2000
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+FORMATO = "%Y-%m-%dT%H:%M"
+
+
+class SocketContador:
+    def __init__(self):
+        self.emitidos = 0
+
+    def emit(self, evento, *args, **kwargs):
+        self.emitidos += 1
+
+    def start_background_task(self, *args, **kwargs):
+        pass
+
+
+def sembrar(futuras, vencidas, dias):
+    from db import crear_bd, conectar_bd, recalcular_dvv, calcular_dvh
+    import integridad
+
+    crear_bd()
+    ahora = datetime.now()
+    filas = []
+    for i in range(futuras):
+        inicio = ahora + timedelta(minutes=30 + (i * dias * 24 * 60) // max(futuras, 1))
+        filas.append((f"Equipo {i % 50}", inicio, inicio + timedelta(hours=1)))
+    for i in range(vencidas):
+        # La mitad terminó hace un rato, la otra mitad está empezando.
+        inicio = ahora - timedelta(hours=2 if i % 2 else 0, minutes=5)
+        filas.append((f"Equipo {i % 50}", inicio, inicio + timedelta(hours=1)))
+    conn = conectar_bd()
+    valores = []
+    for equipo, inicio, fin in filas:
+        datos = {"equipo": equipo, "fecha_inicio": inicio.strftime(FORMATO), "fecha_fin": fin.strftime(FORMATO),
+                 "usuario_id": 1, "estado": "Reservado"}
+        valores.append((*datos.values(), calcular_dvh(datos)))
+    conn.executemany(
+        "INSERT INTO reservas_equipos (equipo, fecha_inicio, fecha_fin, usuario_id, estado, dvh) "
+        "VALUES (?, ?, ?, ?, ?, ?)", valores,
+    )
+    conn.commit()
+    integridad.construir(conn.cursor(), "reservas_equipos")
+    conn.commit()
+    conn.close()
+    recalcular_dvv("reservas_equipos")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ciclo de vida de reservas de BioLabHub")
+    parser.add_argument("--futuras", type=int, default=50000)
+    parser.add_argument("--vencidas", type=int, default=2000)
+    parser.add_argument("--dias", type=int, default=180, help="días sobre los que se reparten las futuras")
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_ciclo_")
+    os.environ["BIOLABHUB_DB"] = os.path.join(carpeta, "ciclo.db")
+    sys.path.insert(0, BACKEND)
+
+    print(f"Sembrando {args.futuras} reservas futuras y {args.vencidas} vencidas...")
+    sembrar(args.futuras, args.vencidas, args.dias)
+
+    import ciclo_reservas
+    import integridad
+
+    socket = SocketContador()
+    planificador = ciclo_reservas.PlanificadorReservas()
+    planificador.iniciar(socket)
+
+    inicio = time.perf_counter()
+    planificador._recargar(datetime.now())
+    recarga_ms = (time.perf_counter() - inicio) * 1000
+    en_heap = planificador.pendientes()
+
+    inicio = time.perf_counter()
+    planificador._tick()
+    tick_ms = (time.perf_counter() - inicio) * 1000
+
+    alteradas = [r["tabla"] for r in integridad.verificar_todo() if r["estado"] != "ok"]
+    resultados = {
+        "reservas": args.futuras + args.vencidas,
+        "recarga_ms": round(recarga_ms, 2),
+        "bordes_en_heap": en_heap,
+        "tick_ms": round(tick_ms, 2),
+        "transiciones": planificador.transiciones,
+        "refresh_calendar": socket.emitidos,
+        "tablas_alteradas": alteradas,
+    }
+    print(f"recarga {resultados['recarga_ms']} ms -> {en_heap} bordes en el heap "
+          f"(de {resultados['reservas']} reservas)")
+    print(f"tick {resultados['tick_ms']} ms: {planificador.transiciones} transiciones, "
+          f"{socket.emitidos} refresh_calendar; integridad: {alteradas or 'ok'}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# ========================================
+#  BENCHMARK: DETALLE DE MUESTRAS
+# ========================================
+# Compara, para N muestras, N pedidos a /samples/detail/<id> contra un solo
+# pedido a /samples/details (todas las columnas y con proyección), sobre una
+# BD temporal sembrada.
+#
+#   python benchmarks/bench_detalles.py --muestras 20000 --pedidas 200
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+
+def sembrar(muestras):
+    from db import crear_bd, conectar_bd, recalcular_dvv
+
+    crear_bd()
+    conn = conectar_bd()
+    conn.executemany(
+        "INSERT INTO muestras (nombre, tipo, estado, ubicacion, responsable_id, origen, condiciones, "
+        "observaciones, estado_logico, dvh) VALUES (?, 'ADN', 'En análisis', 'Laboratorio Químico', 1, "
+        "'Hospital', '-80 °C', ?, 0, 0)",
+        ((f"Muestra {i}", f"Observación larga de la muestra {i} " * 4) for i in range(muestras)),
+    )
+    conn.commit()
+    conn.close()
+    recalcular_dvv("muestras")
+
+
+def _mediana_ms(func, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return round(statistics.median(tiempos), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Detalle de muestras de BioLabHub")
+    parser.add_argument("--muestras", type=int, default=20000)
+    parser.add_argument("--pedidas", type=int, default=200)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_detalles_")
+    os.environ["BIOLABHUB_DB"] = os.path.join(carpeta, "detalles.db")
+    os.environ["BIOLABHUB_JINJA_CACHE"] = os.path.join(carpeta, "jinja")
+    os.environ["BIOLABHUB_STATIC_DIST"] = os.path.join(carpeta, "static_dist")
+    sys.path.insert(0, BACKEND)
+
+    print(f"Sembrando {args.muestras} muestras...")
+    sembrar(args.muestras)
+    import servidor
+
+    app = servidor.obtener_app()
+    app.testing = True
+    cliente = app.test_client()
+    cliente.post("/login", data={"email": "admin@biolabhub.com", "contraseña": "admin123"})
+    ids = random.Random(7).sample(range(1, args.muestras + 1), args.pedidas)
+
+    def uno_por_uno():
+        for i in ids:
+            assert cliente.get(f"/samples/detail/{i}").status_code == 200
+
+    def lote(campos=None):
+        cuerpo = {"ids": ids}
+        if campos:
+            cuerpo["campos"] = campos
+        respuesta = cliente.post("/samples/details", json=cuerpo)
+        assert len(respuesta.get_json()["muestras"]) == len(ids)
+        return len(respuesta.data)
+
+    resultados = {
+        "uno_por_uno_ms": _mediana_ms(uno_por_uno, args.repeticiones),
+        "lote_ms": _mediana_ms(lote, args.repeticiones),
+        "lote_proyeccion_ms": _mediana_ms(lambda: lote(["nombre", "estado"]), args.repeticiones),
+        "bytes_lote": lote(),
+        "bytes_lote_proyeccion": lote(["nombre", "estado"]),
+    }
+    print(f"{args.pedidas} detalles: uno por uno {resultados['uno_por_uno_ms']} ms | "
+          f"lote {resultados['lote_ms']} ms ({resultados['bytes_lote']} B) | "
+          f"lote nombre,estado {resultados['lote_proyeccion_ms']} ms ({resultados['bytes_lote_proyeccion']} B)")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# ========================================
+#  BENCHMARK: ESCRITOR ÚNICO
+# ========================================
+# Varios hilos escriben a la vez como lo hacen los requests (alta de muestra
+# con DVH, DVV y auditoría) y se mide throughput, latencia y errores de
+# lock con cada hilo usando su propia conexión (BIOLABHUB_ESCRITOR=0, el
+# comportamiento anterior) y pasando por el hilo escritor con group commit.
+#
+#   python benchmarks/bench_escritor.py --hilos 32 --escrituras 100 --timeout 1
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+
+def alta(cursor, i):
+    from db import calcular_dvh, sumar_dvv, registrar_auditoria_en
+
+    cursor.execute("""
+        INSERT INTO muestras (nombre, tipo, estado, responsable_id, ubicacion, estado_logico)
+        VALUES (?, 'ADN', 'Disponible', 1, NULL, 0)
+        RETURNING *
+    """, (f"Muestra {i}",))
+    fila = cursor.fetchone()
+    dvh = calcular_dvh({k: fila[k] for k in fila.keys() if k != "dvh"})
+    cursor.execute("UPDATE muestras SET dvh = ? WHERE id = ?", (dvh, fila["id"]))
+    sumar_dvv(cursor, "muestras", dvh)
+    registrar_auditoria_en(cursor, 1, "CREAR MUESTRA", "muestras", fila["id"], "127.0.0.1")
+
+
+def correr(modo, hilos, escrituras):
+    import escritor
+
+    escritor.ACTIVO = modo == "escritor"
+    latencias, errores = [], []
+    lock = threading.Lock()
+
+    def trabajador(h):
+        propias, fallas = [], []
+        for j in range(escrituras):
+            inicio = time.perf_counter()
+            try:
+                escritor.ejecutar(alta, h * escrituras + j)
+                propias.append((time.perf_counter() - inicio) * 1000)
+            except Exception as e:
+                fallas.append(str(e))
+        with lock:
+            latencias.extend(propias)
+            errores.extend(fallas)
+
+    inicio = time.perf_counter()
+    lista = [threading.Thread(target=trabajador, args=(h,)) for h in range(hilos)]
+    for t in lista:
+        t.start()
+    for t in lista:
+        t.join()
+    segundos = time.perf_counter() - inicio
+
+    latencias.sort()
+    estado = escritor.estado().get("global", {})
+    return {
+        "escrituras": len(latencias),
+        "errores": len(errores),
+        "errores_lock": sum("locked" in e for e in errores),
+        "segundos": round(segundos, 3),
+        "por_segundo": round(len(latencias) / segundos, 1),
+        "p50_ms": round(latencias[len(latencias) // 2], 3) if latencias else None,
+        "p99_ms": round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))], 3) if latencias else None,
+        "trabajos_por_transaccion": round(estado["trabajos"] / estado["transacciones"], 2) if estado.get("transacciones") else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Escritor único de BioLabHub")
+    parser.add_argument("--hilos", type=int, default=32)
+    parser.add_argument("--escrituras", type=int, default=100, help="escrituras por hilo")
+    parser.add_argument("--timeout", type=float, default=1, help="BIOLABHUB_DB_TIMEOUT en segundos")
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_escritor_")
+    os.environ["BIOLABHUB_DB"] = os.path.join(carpeta, "escritor.db")
+    os.environ["BIOLABHUB_DB_TIMEOUT"] = str(args.timeout)
+    sys.path.insert(0, BACKEND)
+    from db import crear_bd, activar_wal
+
+    crear_bd()
+    activar_wal()
+
+    resultados = {}
+    for modo in ("conexion_propia", "escritor"):
+        resultados[modo] = r = correr(modo, args.hilos, args.escrituras)
+        print(f"{modo:<16} {r['por_segundo']:>8} escr/s  p50 {r['p50_ms']} ms  p99 {r['p99_ms']} ms  "
+              f"errores {r['errores']} (lock {r['errores_lock']})  "
+              f"trabajos/transacción {r['trabajos_por_transaccion']}")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
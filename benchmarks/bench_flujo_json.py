@@ -0,0 +1,114 @@
+# ========================================
+#  BENCHMARK: JSON EN STREAMING
+# ========================================
+# Siembra N experimentos y compara /experiments/events en streaming
+# (flujo_json.py) con la versión anterior (fetchall + lista de dicts +
+# jsonify), registrada acá como ruta aparte. Para cada tamaño mide el pico
+# de memoria (tracemalloc), el tiempo hasta el primer chunk y el total.
+#
+#   python benchmarks/bench_flujo_json.py --filas 10000 50000 200000
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+
+def sembrar(filas):
+    from db import conectar_bd
+
+    conn = conectar_bd()
+    conn.execute("DELETE FROM experimentos")
+    conn.executemany(
+        "INSERT INTO experimentos (titulo, descripcion, fecha_inicio, fecha_fin, estado_logico) "
+        "VALUES (?, ?, '2025-01-01', '2025-01-08', 0)",
+        ((f"Experimento {i}", f"Descripción del experimento número {i} " * 3) for i in range(filas)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def ruta_jsonify(app):
+    from flask import jsonify
+    from db import conectar_bd
+
+    def eventos_jsonify():
+        conn = conectar_bd()
+        rows = conn.execute("""
+            SELECT id, titulo, descripcion, fecha_inicio, fecha_fin
+            FROM experimentos
+            WHERE estado_logico = 0 OR estado_logico IS NULL
+        """).fetchall()
+        conn.close()
+        eventos = [{"id": r["id"], "title": r["titulo"], "start": r["fecha_inicio"], "end": r["fecha_fin"],
+                    "description": r["descripcion"]} for r in rows]
+        return jsonify(eventos)
+
+    app.add_url_rule("/bench/events_jsonify", "bench_events_jsonify", eventos_jsonify)
+
+
+def medir(cliente, url, gzip):
+    headers = {"Accept-Encoding": "gzip"} if gzip else {}
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    respuesta = cliente.get(url, headers=headers, buffered=False)
+    partes = iter(respuesta.response)
+    primero = next(partes)
+    primer_byte = time.perf_counter() - inicio
+    total_bytes = len(primero) + sum(len(p) for p in partes)
+    respuesta.close()
+    total = time.perf_counter() - inicio
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "primer_byte_ms": round(primer_byte * 1000, 2),
+        "total_ms": round(total * 1000, 2),
+        "pico_mb": round(pico / 2**20, 2),
+        "bytes": total_bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON en streaming de BioLabHub")
+    parser.add_argument("--filas", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_flujo_")
+    os.environ["BIOLABHUB_DB"] = os.path.join(carpeta, "flujo.db")
+    os.environ["BIOLABHUB_JINJA_CACHE"] = os.path.join(carpeta, "jinja")
+    os.environ["BIOLABHUB_STATIC_DIST"] = os.path.join(carpeta, "static_dist")
+    sys.path.insert(0, BACKEND)
+
+    import servidor
+
+    app = servidor.obtener_app()
+    app.testing = True
+    ruta_jsonify(app)
+    cliente = app.test_client()
+
+    resultados = {}
+    for filas in args.filas:
+        sembrar(filas)
+        for nombre, url, gzip in (
+            ("jsonify", "/bench/events_jsonify", False),
+            ("streaming", "/experiments/events", False),
+            ("streaming_gzip", "/experiments/events", True),
+        ):
+            r = medir(cliente, url, gzip)
+            resultados[f"{filas}_{nombre}"] = r
+            print(f"{filas:>7} filas {nombre:<15} primer byte {r['primer_byte_ms']:>8} ms | "
+                  f"total {r['total_ms']:>8} ms | pico {r['pico_mb']:>7} MB | {r['bytes']} bytes")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
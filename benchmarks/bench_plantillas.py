@@ -0,0 +1,135 @@
+# ========================================
+#  BENCHMARK: CACHE DE PLANTILLAS
+# ========================================
+# 1) Compilación: cuánto tarda un worker nuevo en cargar cada plantilla sin
+#    cache de bytecode y con el cache en disco ya armado.
+# 2) Render: tiempo por página (request completo, consultas incluidas) con
+#    y sin cache de fragmentos, sobre una BD temporal sembrada.
+#
+#   python benchmarks/bench_plantillas.py --muestras 2000 --auditoria 20000
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+PAGINAS = os.path.join(RAIZ, "frontend", "pages")
+
+PLANTILLAS = {
+    "Home/Home.html": "/home",
+    "samples/Samples.html": "/samples",
+    "experiments/Experiments.html": "/experiments/",
+    "equipreserve/EquipReserve.html": "/equipreserve",
+    "admin/AdminPanel.html": "/admin/",
+}
+
+
+def sembrar(muestras, auditoria):
+    from db import crear_bd, conectar_bd, recalcular_dvv
+
+    crear_bd()
+    conn = conectar_bd()
+    labs = [r[0] for r in conn.execute("SELECT nombre FROM laboratorios").fetchall()]
+    conn.executemany(
+        "INSERT INTO muestras (nombre, tipo, estado, ubicacion, responsable_id, estado_logico, dvh) "
+        "VALUES (?, 'ADN', 'En análisis', ?, 1, 0, 0)",
+        ((f"Muestra {i}", labs[i % len(labs)]) for i in range(muestras)),
+    )
+    conn.executemany(
+        "INSERT INTO audits_logs (usuario_id, accion, tabla_afectada, registro_id, fecha, ip_origen, dvh) "
+        "VALUES (1, 'EDITAR', 'muestras', ?, datetime('now'), '127.0.0.1', 0)",
+        ((i,) for i in range(auditoria)),
+    )
+    conn.commit()
+    conn.close()
+    for tabla in ("muestras", "audits_logs"):
+        recalcular_dvv(tabla)
+
+
+def _mediana_ms(func, repeticiones):
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        func()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return round(statistics.median(tiempos), 3)
+
+
+def medir_compilacion(directorio_cache, repeticiones):
+    from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+    from plantillas import ExtensionCache
+
+    def cargar(nombre, cache):
+        # Environment nuevo = worker recién arrancado (sin cache en memoria).
+        env = Environment(loader=FileSystemLoader(PAGINAS), extensions=[ExtensionCache], bytecode_cache=cache)
+        env.get_template(nombre)
+
+    resultados = {}
+    os.makedirs(directorio_cache, exist_ok=True)
+    cache = FileSystemBytecodeCache(directorio_cache)
+    for nombre in PLANTILLAS:
+        cargar(nombre, cache)   # deja el bytecode en disco
+        resultados[nombre] = {
+            "sin_bytecode_ms": _mediana_ms(lambda: cargar(nombre, None), repeticiones),
+            "con_bytecode_ms": _mediana_ms(lambda: cargar(nombre, cache), repeticiones),
+        }
+    return resultados
+
+
+def medir_render(repeticiones):
+    import plantillas
+    import servidor
+
+    app = servidor.obtener_app()
+    app.testing = True
+    cliente = app.test_client()
+    cliente.post("/login", data={"email": "admin@biolabhub.com", "contraseña": "admin123"})
+
+    resultados = {}
+    for nombre, url in PLANTILLAS.items():
+        plantillas.CACHE_FRAGMENTOS = False
+        sin = _mediana_ms(lambda: cliente.get(url), repeticiones)
+        plantillas.CACHE_FRAGMENTOS = True
+        cliente.get(url)
+        con = _mediana_ms(lambda: cliente.get(url), repeticiones)
+        resultados[nombre] = {"sin_fragmentos_ms": sin, "con_fragmentos_ms": con}
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache de plantillas de BioLabHub")
+    parser.add_argument("--muestras", type=int, default=2000)
+    parser.add_argument("--auditoria", type=int, default=20000)
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_plantillas_")
+    os.environ["BIOLABHUB_DB"] = os.path.join(carpeta, "plantillas.db")
+    os.environ["BIOLABHUB_JINJA_CACHE"] = os.path.join(carpeta, "jinja")
+    os.environ["BIOLABHUB_STATIC_DIST"] = os.path.join(carpeta, "static_dist")
+    sys.path.insert(0, BACKEND)
+
+    print(f"Sembrando {args.muestras} muestras y {args.auditoria} filas de auditoría...")
+    sembrar(args.muestras, args.auditoria)
+
+    compilacion = medir_compilacion(os.path.join(carpeta, "bytecode"), args.repeticiones)
+    render = medir_render(args.repeticiones)
+
+    print(f"{'Plantilla':<32} {'compilar':>9} {'bytecode':>9} {'render':>9} {'fragmentos':>11}")
+    for nombre in PLANTILLAS:
+        c, r = compilacion[nombre], render[nombre]
+        print(f"{nombre:<32} {c['sin_bytecode_ms']:>7.2f}ms {c['con_bytecode_ms']:>7.2f}ms "
+              f"{r['sin_fragmentos_ms']:>7.2f}ms {r['con_fragmentos_ms']:>9.2f}ms")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump({"compilacion": compilacion, "render": render}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# ========================================
+#  BENCHMARK: RESPALDO EN LÍNEA
+# ========================================
+# Siembra una BD temporal, levanta un escritor y un lector que imitan el
+# tráfico de /samples (alta con DVH/DVV y listado) y mide su latencia sin
+# respaldo y mientras respaldos.tomar_snapshot() copia la BD. Informa
+# también el throughput de la copia y cuánto escribe un segundo snapshot.
+#
+#   python benchmarks/bench_respaldo.py --filas 200000
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+
+
+def sembrar(filas, semilla):
+    from db import crear_bd, conectar_bd, calcular_dvh, recalcular_dvv, activar_wal
+
+    crear_bd()
+    activar_wal()
+    rnd = random.Random(semilla)
+    conn = conectar_bd()
+    labs = [r[0] for r in conn.execute("SELECT nombre FROM laboratorios").fetchall()]
+    lote = []
+    for i in range(filas):
+        fila = {"nombre": f"Muestra {i}", "tipo": rnd.choice(("ADN", "ARN", "Suero")),
+                "estado": "Disponible", "ubicacion": rnd.choice(labs), "estado_logico": 0}
+        lote.append((*fila.values(), calcular_dvh(fila)))
+    conn.executemany(
+        "INSERT INTO muestras (nombre, tipo, estado, ubicacion, estado_logico, dvh) VALUES (?, ?, ?, ?, ?, ?)", lote
+    )
+    conn.commit()
+    conn.close()
+    recalcular_dvv("muestras")
+
+
+class Carga:
+    # Un escritor y un lector en hilos propios, como dos requests concurrentes.
+    def __init__(self):
+        self.latencias = {"escritura": [], "lectura": []}
+        self._parar = threading.Event()
+        self._hilos = [threading.Thread(target=self._escritor), threading.Thread(target=self._lector)]
+
+    def _escritor(self):
+        from db import conectar_bd, calcular_dvh, sumar_dvv
+        conn = conectar_bd()
+        i = 0
+        while not self._parar.is_set():
+            inicio = time.perf_counter()
+            fila = {"nombre": f"Nueva {i}", "tipo": "ADN", "estado": "Disponible", "estado_logico": 0}
+            dvh = calcular_dvh(fila)
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT INTO muestras (nombre, tipo, estado, estado_logico, dvh) VALUES (?, ?, ?, ?, ?)",
+                         (*fila.values(), dvh))
+            sumar_dvv(conn.cursor(), "muestras", dvh)
+            conn.commit()
+            self.latencias["escritura"].append((time.perf_counter() - inicio) * 1000)
+            i += 1
+            time.sleep(0.005)
+        conn.close()
+
+    def _lector(self):
+        from db import conectar_bd
+        conn = conectar_bd()
+        while not self._parar.is_set():
+            inicio = time.perf_counter()
+            conn.execute("""
+                SELECT id, nombre, tipo, estado, ubicacion, fecha_ingreso FROM muestras
+                WHERE estado_logico = 0 ORDER BY fecha_ingreso DESC LIMIT 50
+            """).fetchall()
+            self.latencias["lectura"].append((time.perf_counter() - inicio) * 1000)
+            time.sleep(0.005)
+        conn.close()
+
+    def iniciar(self):
+        for h in self._hilos:
+            h.start()
+
+    def detener(self):
+        self._parar.set()
+        for h in self._hilos:
+            h.join()
+
+    def tomar(self):
+        # Devuelve y reinicia las latencias acumuladas.
+        actuales = {k: sorted(v) for k, v in self.latencias.items()}
+        for v in self.latencias.values():
+            v.clear()
+        return actuales
+
+
+def _percentiles(valores):
+    if not valores:
+        return {}
+    return {
+        "n": len(valores),
+        "p50_ms": round(valores[len(valores) // 2], 3),
+        "p99_ms": round(valores[min(len(valores) - 1, int(len(valores) * 0.99))], 3),
+        "max_ms": round(valores[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Respaldo en línea de BioLabHub")
+    parser.add_argument("--filas", type=int, default=200000)
+    parser.add_argument("--segundos-base", type=float, default=3)
+    parser.add_argument("--paginas", type=int, default=256)
+    parser.add_argument("--semilla", type=int, default=7)
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    args = parser.parse_args()
+
+    carpeta = tempfile.mkdtemp(prefix="biolabhub_respaldo_")
+    os.environ["BIOLABHUB_DB"] = os.path.join(carpeta, "respaldo.db")
+    os.environ["BIOLABHUB_BACKUP_DIR"] = os.path.join(carpeta, "respaldos")
+    sys.path.insert(0, BACKEND)
+    import respaldos
+
+    print(f"Sembrando {args.filas} muestras...")
+    sembrar(args.filas, args.semilla)
+
+    carga = Carga()
+    carga.iniciar()
+    time.sleep(args.segundos_base)
+    sin_respaldo = carga.tomar()
+
+    primero = respaldos.tomar_snapshot(paginas=args.paginas)
+    durante = carga.tomar()
+    time.sleep(1)
+    segundo = respaldos.tomar_snapshot(paginas=args.paginas)
+    carga.detener()
+
+    resultados = {
+        "bytes": primero["bytes"],
+        "segundos": primero["segundos"],
+        "mb_por_segundo": primero["mb_por_segundo"],
+        "modo": primero["archivos"]["principal"]["modo"],
+        "verificado": primero["verificado"] and segundo["verificado"],
+        "bytes_nuevos_segundo_snapshot": segundo["bytes_nuevos"],
+        "sin_respaldo": {k: _percentiles(v) for k, v in sin_respaldo.items()},
+        "durante_respaldo": {k: _percentiles(v) for k, v in durante.items()},
+    }
+    print(f"Copia: {resultados['bytes'] / 1048576:.1f} MB en {resultados['segundos']} s "
+          f"({resultados['mb_por_segundo']} MB/s, modo {resultados['modo']}, verificado={resultados['verificado']})")
+    print(f"Segundo snapshot: {resultados['bytes_nuevos_segundo_snapshot'] / 1048576:.2f} MB nuevos")
+    for tipo in ("escritura", "lectura"):
+        a, b = resultados["sin_respaldo"][tipo], resultados["durante_respaldo"].get(tipo, {})
+        print(f"{tipo:<10} sin respaldo p50 {a['p50_ms']:>7.3f} p99 {a['p99_ms']:>7.3f} ms | "
+              f"durante p50 {b.get('p50_ms', 0):>7.3f} p99 {b.get('p99_ms', 0):>7.3f} ms (n={b.get('n', 0)})")
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+# ========================================
+#  BENCHMARK DE RUTAS PRINCIPALES
+# ========================================
+# Genera una base de datos de prueba con volúmenes configurables y recorre
+# las rutas más usadas con el test client de Flask (o contra un servidor
+# local con --url). Reporta throughput y p50/p95/p99 por endpoint y guarda
+# el resultado en JSON para comparar entre commits.
+#
+#   python benchmarks/bench_rutas.py --muestras 5000 --reservas 2000
+#   python benchmarks/bench_rutas.py --comparar benchmarks/resultados/abc123.json
+#
+# Nunca toca biolabhub.db: por defecto usa un archivo temporal.
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND = os.path.join(RAIZ, "backend")
+RESULTADOS = os.path.join(RAIZ, "benchmarks", "resultados")
+
+ESTADOS_MUESTRA = ["En almacenamiento", "En análisis", "Descartada"]
+ESTADOS_EXPERIMENTO = ["Planificado", "En curso", "Finalizado"]
+PASSWORD = "bench123"
+
+
+# -----------------------------
+# SEMILLA DE DATOS
+# -----------------------------
+def sembrar(ruta_db, args):
+    os.environ["BIOLABHUB_DB"] = ruta_db
+    sys.path.insert(0, BACKEND)
+    import bcrypt
+    from db import crear_bd, conectar_bd, calcular_dvh, recalcular_dvv
+
+    crear_bd()
+    rnd = random.Random(args.semilla)
+    conn = conectar_bd()
+    cur = conn.cursor()
+
+    # Todos los usuarios comparten el mismo hash: el costo de bcrypt en el
+    # login no depende de la contraseña, solo de las rondas.
+    hash_pw = bcrypt.hashpw(PASSWORD.encode("utf-8"), bcrypt.gensalt(args.bcrypt_rondas)).decode("utf-8")
+    usuarios = []
+    for i in range(args.usuarios):
+        datos = {"nombre": f"Usuario {i}", "email": f"user{i}@bench.local",
+                 "contraseña_hash": hash_pw, "rol": "usuario", "estado_logico": 0}
+        usuarios.append(tuple(datos.values()) + (calcular_dvh(datos),))
+    cur.executemany("""
+        INSERT INTO usuarios (nombre, email, contraseña_hash, rol, estado_logico, dvh)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, usuarios)
+    ids_usuarios = [r[0] for r in cur.execute("SELECT id FROM usuarios").fetchall()]
+    labs = [r[0] for r in cur.execute("SELECT nombre FROM laboratorios").fetchall()]
+    equipos = [r[0] for r in cur.execute("SELECT nombre FROM equipos").fetchall()]
+    base = datetime(2025, 1, 1, 8, 0)
+
+    muestras = []
+    for i in range(args.muestras):
+        datos = {"nombre": f"Muestra {i}", "tipo": rnd.choice(["Sangre", "Suelo", "ADN", "Cultivo"]),
+                 "estado": rnd.choice(ESTADOS_MUESTRA), "responsable_id": rnd.choice(ids_usuarios),
+                 "ubicacion": rnd.choice(labs), "estado_logico": 0}
+        muestras.append(tuple(datos.values()) + (calcular_dvh(datos),))
+    cur.executemany("""
+        INSERT INTO muestras (nombre, tipo, estado, responsable_id, ubicacion, estado_logico, dvh)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, muestras)
+
+    experimentos = []
+    for i in range(args.experimentos):
+        inicio = base + timedelta(days=rnd.randint(0, 365))
+        datos = {"titulo": f"Experimento {i}", "descripcion": f"Descripción del experimento {i}",
+                 "fecha_inicio": inicio.strftime("%Y-%m-%d"),
+                 "fecha_fin": (inicio + timedelta(days=rnd.randint(1, 30))).strftime("%Y-%m-%d"),
+                 "estado": rnd.choice(ESTADOS_EXPERIMENTO), "responsable_id": rnd.choice(ids_usuarios),
+                 "protocolo_archivo": None}
+        experimentos.append(tuple(datos.values()) + (sum(len(str(v)) for v in datos.values()),))
+    cur.executemany("""
+        INSERT INTO experimentos (titulo, descripcion, fecha_inicio, fecha_fin, estado,
+                                  responsable_id, protocolo_archivo, dvh)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, experimentos)
+
+    reservas = []
+    for i in range(args.reservas):
+        inicio = base + timedelta(hours=rnd.randint(0, 24 * 365))
+        datos = {"equipo": rnd.choice(equipos), "fecha_inicio": inicio.strftime("%Y-%m-%dT%H:%M"),
+                 "fecha_fin": (inicio + timedelta(hours=rnd.randint(1, 4))).strftime("%Y-%m-%dT%H:%M"),
+                 "usuario_id": rnd.choice(ids_usuarios), "estado": "Reservado"}
+        reservas.append(tuple(datos.values()) + (calcular_dvh(datos),))
+    cur.executemany("""
+        INSERT INTO reservas_equipos (equipo, fecha_inicio, fecha_fin, usuario_id, estado, dvh)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, reservas)
+
+    auditoria = []
+    for i in range(args.auditoria):
+        datos = {"usuario_id": rnd.choice(ids_usuarios), "accion": "LOGIN EXITOSO",
+                 "tabla_afectada": "usuarios", "registro_id": i,
+                 "fecha": (base + timedelta(minutes=i)).strftime("%Y-%m-%d %H:%M:%S"),
+                 "ip_origen": "127.0.0.1"}
+        auditoria.append(tuple(datos.values()) + (calcular_dvh(datos),))
+    cur.executemany("""
+        INSERT INTO audits_logs (usuario_id, accion, tabla_afectada, registro_id, fecha, ip_origen, dvh)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, auditoria)
+
+    conn.commit()
+    conn.close()
+    for tabla in ("usuarios", "muestras", "experimentos", "reservas_equipos", "audits_logs"):
+        recalcular_dvv(tabla)
+
+
+# -----------------------------
+# CLIENTES
+# -----------------------------
+class ClienteFlask:
+    def __init__(self):
+        from servidor import app
+        app.testing = True
+        self.cliente = app.test_client()
+
+    def pedir(self, metodo, ruta, datos=None):
+        if metodo == "POST":
+            r = self.cliente.post(ruta, data=datos or {})
+        else:
+            r = self.cliente.get(ruta)
+        return r.status_code
+
+
+class ClienteHTTP:
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _SinRedirecciones(),
+        )
+
+    def pedir(self, metodo, ruta, datos=None):
+        cuerpo = urllib.parse.urlencode(datos).encode() if metodo == "POST" else None
+        req = urllib.request.Request(self.url + ruta, data=cuerpo, method=metodo)
+        try:
+            with self.opener.open(req) as r:
+                r.read()
+                return r.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+class _SinRedirecciones(urllib.request.HTTPRedirectHandler):
+    # Igual que el test client: se mide cada request, no la cadena de redirects.
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def _login_admin(cliente):
+    # admin creado por crear_bd()
+    return cliente.pedir("POST", "/login", {"email": "admin@biolabhub.com", "contraseña": "admin123"})
+
+
+# -----------------------------
+# ESCENARIOS
+# -----------------------------
+def escenario_login(cliente, rnd, args):
+    i = rnd.randrange(args.usuarios)
+    yield "login", "POST", "/login", {"email": f"user{i}@bench.local", "contraseña": PASSWORD}
+
+
+def escenario_calendario(cliente, rnd, args):
+    yield "equipreserve_events", "GET", "/equipreserve/events", None
+    yield "experiments_events", "GET", "/experiments/events", None
+
+
+def escenario_muestras(cliente, rnd, args):
+    yield "samples", "GET", "/samples", None
+    yield "samples_add", "POST", "/samples/add", {
+        "nombre": f"Bench {rnd.random():.6f}", "tipo": "ADN",
+        "estado": rnd.choice(ESTADOS_MUESTRA), "ubicacion": "Cámara Fría"}
+    sample_id = rnd.randint(1, max(args.muestras, 1))
+    yield "samples_update", "POST", f"/samples/update/{sample_id}", {
+        "nombre": f"Muestra {sample_id}", "tipo": "ADN",
+        "estado": rnd.choice(ESTADOS_MUESTRA), "ubicacion": "Cámara Fría"}
+
+
+def escenario_admin(cliente, rnd, args):
+    yield "admin_panel", "GET", "/admin/", None
+    yield "home", "GET", "/home", None
+
+
+ESCENARIOS = {
+    "login": escenario_login,
+    "calendario": escenario_calendario,
+    "muestras": escenario_muestras,
+    "admin": escenario_admin,
+}
+
+# Mezcla realista: mucho calendario, bastante CRUD, pocos logins y admin.
+MEZCLA_DEFAULT = "calendario:50,muestras:30,login:10,admin:10"
+
+
+def _parsear_mezcla(texto):
+    pesos = {}
+    for parte in texto.split(","):
+        nombre, _, peso = parte.partition(":")
+        if nombre not in ESCENARIOS:
+            raise SystemExit(f"Escenario desconocido: {nombre}")
+        pesos[nombre] = int(peso or 1)
+    return pesos
+
+
+def _trabajador(n_hilo, args, pesos, latencias, errores, lock):
+    rnd = random.Random(args.semilla + n_hilo)
+    cliente = ClienteHTTP(args.url) if args.url else ClienteFlask()
+    _login_admin(cliente)
+    nombres = list(pesos)
+    por_peso = [pesos[n] for n in nombres]
+    locales = {}
+    fallas = {}
+
+    for _ in range(args.iteraciones):
+        escenario = rnd.choices(nombres, por_peso)[0]
+        for etiqueta, metodo, ruta, datos in ESCENARIOS[escenario](cliente, rnd, args):
+            inicio = time.perf_counter()
+            try:
+                estado = cliente.pedir(metodo, ruta, datos)
+            except Exception:
+                estado = 599
+            locales.setdefault(etiqueta, []).append((time.perf_counter() - inicio) * 1000)
+            if estado >= 400:
+                fallas[etiqueta] = fallas.get(etiqueta, 0) + 1
+        if escenario == "login":
+            # el login cambia la sesión; se vuelve a admin para el resto de la mezcla
+            _login_admin(cliente)
+
+    with lock:
+        for etiqueta, valores in locales.items():
+            latencias.setdefault(etiqueta, []).extend(valores)
+        for etiqueta, n in fallas.items():
+            errores[etiqueta] = errores.get(etiqueta, 0) + n
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100.0
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def correr(args):
+    pesos = _parsear_mezcla(args.mezcla)
+    latencias, errores = {}, {}
+    lock = threading.Lock()
+    hilos = [
+        threading.Thread(target=_trabajador, args=(n, args, pesos, latencias, errores, lock))
+        for n in range(args.hilos)
+    ]
+    inicio = time.perf_counter()
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    total_s = time.perf_counter() - inicio
+
+    resultados = {}
+    for etiqueta, valores in sorted(latencias.items()):
+        resultados[etiqueta] = {
+            "requests": len(valores),
+            "errores": errores.get(etiqueta, 0),
+            "rps": round(len(valores) / total_s, 2),
+            "media_ms": round(statistics.fmean(valores), 3),
+            "p50_ms": round(_percentil(valores, 50), 3),
+            "p95_ms": round(_percentil(valores, 95), 3),
+            "p99_ms": round(_percentil(valores, 99), 3),
+        }
+    total = sum(len(v) for v in latencias.values())
+    return {
+        "total_requests": total,
+        "duracion_s": round(total_s, 3),
+        "rps_total": round(total / total_s, 2),
+        "endpoints": resultados,
+    }
+
+
+# -----------------------------
+# REPORTE
+# -----------------------------
+def _commit_actual():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "sin-git"
+
+
+def imprimir(resultado, anterior=None):
+    print(f"\nTotal: {resultado['total_requests']} requests en {resultado['duracion_s']} s "
+          f"({resultado['rps_total']} req/s)\n")
+    print(f"{'endpoint':<22}{'n':>7}{'err':>5}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for etiqueta, r in resultado["endpoints"].items():
+        linea = (f"{etiqueta:<22}{r['requests']:>7}{r['errores']:>5}{r['rps']:>9}"
+                 f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['p99_ms']:>9.2f}")
+        if anterior and etiqueta in anterior["endpoints"]:
+            previo = anterior["endpoints"][etiqueta]["p95_ms"]
+            if previo:
+                linea += f"   p95 {(r['p95_ms'] - previo) / previo * 100:+.1f}%"
+        print(linea)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de rutas de BioLabHub")
+    parser.add_argument("--usuarios", type=int, default=50)
+    parser.add_argument("--muestras", type=int, default=2000)
+    parser.add_argument("--experimentos", type=int, default=500)
+    parser.add_argument("--reservas", type=int, default=1000)
+    parser.add_argument("--auditoria", type=int, default=5000)
+    parser.add_argument("--bcrypt-rondas", type=int, default=12)
+    parser.add_argument("--iteraciones", type=int, default=100, help="escenarios por hilo")
+    parser.add_argument("--hilos", type=int, default=1)
+    parser.add_argument("--mezcla", default=MEZCLA_DEFAULT)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--db", help="ruta de la BD a sembrar (por defecto un archivo temporal)")
+    parser.add_argument("--sin-semilla", action="store_true", help="usar --db tal como está")
+    parser.add_argument("--url", help="medir un servidor ya levantado en vez del test client")
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior para comparar")
+    args = parser.parse_args()
+
+    if args.url:
+        print(f"Usando servidor en {args.url} (la BD la siembra quien lo levantó).")
+    else:
+        ruta_db = args.db or os.path.join(tempfile.mkdtemp(prefix="biolabhub_bench_"), "bench.db")
+        if not args.sin_semilla:
+            print(f"Sembrando {ruta_db} ...")
+            inicio = time.perf_counter()
+            sembrar(ruta_db, args)
+            print(f"Semilla lista en {time.perf_counter() - inicio:.2f} s")
+        else:
+            os.environ["BIOLABHUB_DB"] = ruta_db
+            sys.path.insert(0, BACKEND)
+
+    resultado = correr(args)
+    resultado["commit"] = _commit_actual()
+    resultado["fecha"] = datetime.now().isoformat(timespec="seconds")
+    resultado["config"] = {k: v for k, v in vars(args).items() if k not in ("salida", "comparar")}
+
+    anterior = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            anterior = json.load(f)
+    imprimir(resultado, anterior)
+
+    salida = args.salida or os.path.join(RESULTADOS, f"{resultado['commit']}.json")
+    os.makedirs(os.path.dirname(salida), exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    print(f"\nResultados guardados en {salida}")
+
+
+if __name__ == "__main__":
+    main()
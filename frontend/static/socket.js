@@ -9,10 +9,45 @@ const socket = io({
 
 
 
+// Diario de eventos (ver backend/diario.py): cada broadcast llega con su
+// número de secuencia. Al reconectarse se piden solo los que se perdieron;
+// recién si el servidor ya no los tiene se recarga la página.
+const EVENTOS_DIARIO = ["nuevo_evento", "refresh_calendar", "experimento_actualizado", "experiment_event", "alerta_reactivo", "alerta_equipo"];
+let ultimoSeq = null;
+let epoca = null;
+const vistos = new Set();
+
+
+function marcarVisto(seq) {
+    vistos.add(seq);
+    if (vistos.size > 1000) vistos.delete(vistos.values().next().value);
+    if (ultimoSeq === null || seq > ultimoSeq) ultimoSeq = seq;
+}
+
+
+socket.onAny((evento, ...args) => {
+    const seq = args[args.length - 1];
+    if (EVENTOS_DIARIO.includes(evento) && Number.isInteger(seq)) marcarVisto(seq);
+});
 
 
 socket.on("connect", () => {
     console.log(" WebSocket conectado:", socket.id);
+
+    socket.emit("reanudar", { desde: ultimoSeq, epoca: epoca }, (resp) => {
+        if (resp.resync) {
+            console.log(" Demasiados eventos perdidos, recargando...");
+            location.reload();
+            return;
+        }
+        epoca = resp.epoca;
+        resp.eventos.forEach((e) => {
+            if (vistos.has(e.seq)) return;
+            marcarVisto(e.seq);
+            socket.listeners(e.evento).forEach((handler) => handler(e.datos, e.seq));
+        });
+        if (ultimoSeq === null || resp.seq > ultimoSeq) ultimoSeq = resp.seq;
+    });
 });
 
 
@@ -33,9 +68,9 @@ socket.on("server_message", (data) => {
 const eventosDiv = document.getElementById("eventos");
 
 
-socket.on("sample_event", (msg) => {
-    if (!eventosDiv) return; 
-    
+socket.on("nuevo_evento", (msg) => {
+    if (!eventosDiv) return;
+
     const p = document.createElement("p");
     p.textContent = " " + msg;
     p.classList.add("fade");